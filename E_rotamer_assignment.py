@@ -1,154 +1,74 @@
-import os
-import pandas as pd
+import argparse
 from tqdm import tqdm
-import seaborn as sns
-import matplotlib.pyplot as plt
+from energy_lookup import summarize_unmatched
+from checkpoint import BatchCheckpoint
+from energy_store import load_energy_store
+from pipeline import load_rotamers, score_deposited, write_failed
+from plotting import render_plots
+from rotamer_io import list_rotamer_files
+from streaming import ScoreAggregates, stream_score
 
 # Define the directories containing the files
 rotamer = '/dors/wankowicz_lab/all_pdb/1_10000/output_rotamer/'
 folder_path = '/dors/wankowicz_lab/shared/backbone_independent_energy'
+# Backbone-dependent (phi/psi/chi) potentials; None scores with the backbone-independent tables only
+backbone_dependent_path = None
 
-# Function to process chi data
-def process_chi_data(chi_data, chi_bins): 
-    # Initialize an empty DataFrame to store results
-    final_results = pd.DataFrame()
-
-    # Loop through each row in chi_data
-    for x in range(len(chi_data)):
-        row = chi_data.iloc[[x]].copy()
-        eval_angle = row['angle'].values[0]  # Get the angle value
-
-        # Filter chi_bins for matching bin range
-        matched_row = chi_bins[(chi_bins['bin min'] < eval_angle) & (chi_bins['bin max'] > eval_angle)]
-
-        # If there's a matching bin, add the E value to the row
-        if not matched_row.empty:
-            row.loc[:, 'E'] = matched_row['E'].values[0]  # Use .loc for assignment
-            final_results = pd.concat([final_results, row], ignore_index=True)
-
-    return final_results
+# Outputs of the streaming mode
+scored_output = 'E_rotamer_assignment_scored.csv'
+aggregates_output = 'E_rotamer_assignment_aggregates.npz'
+# Rotamer files that could not be parsed, with the reason
+failed_output = 'E_rotamer_assignment_failed.csv'
+# Per-batch results of the streaming mode; a restarted run only scores the batches not yet in here
+checkpoint_dir = 'E_rotamer_assignment_checkpoint'
 
 # Function to plot data
 def plot_data(final_sorted_data):
-    sns.set(style='whitegrid', palette='muted') 
-
-    # Get unique AA_CHI values
-    unique_aa_chi = final_sorted_data['AA_CHI'].unique()
-
-    # Loop through each unique AA_CHI
-    for aa_chi in unique_aa_chi:
-        # Filter for the specific amino acid and chi angle
-        specific_aa_chi = final_sorted_data[final_sorted_data['AA_CHI'] == aa_chi]
-
-        # Extract amino acid and chi angle, and replace 'CHI' with Greek letter 'χ'
-        amino_acid, chi_angle = aa_chi.split('_')
-        chi_angle = chi_angle.replace('CHI', 'χ')
-        chi_angle_label = f"{amino_acid} {chi_angle}(°)" 
-
-        # Create the plot
-        plt.figure(figsize=(5, 3)) 
-        sns.scatterplot(data=specific_aa_chi, x='angle', y='E', color='dodgerblue', s=100, edgecolor='w', alpha=0.8)
-        plt.title(f'Knowledge-based ΔE({amino_acid} {chi_angle})', fontsize=15, fontweight='bold', color='gray')  # Set title color to gray
-        plt.xlabel(chi_angle_label, fontsize=14)
-        plt.ylabel('ΔE(kcal/mol)', fontsize=14)
-        plt.xlim(0, 360)
-        plt.xticks([0, 120, 240, 360], fontsize=12)
-        plt.yticks(fontsize=12)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.tight_layout()
-        plt.savefig(f'knowledge_based_energy{amino_acid}_{chi_angle}.png')
-
+    # Rendered per AA_CHI in a process pool on the Agg backend
+    render_plots(final_sorted_data, 'energy')
 
 def main():
-    # Use glob to find all *_B_factors.csv files in the specified directory
-    b_factor_files = [os.path.join(rotamer,item) for item in os.listdir(rotamer)]
-    
-    # Initialize a list to store the DataFrames and track unparsed files
-    b_factor_dfs = []
-    not_parsed = []
-
-    # Loop through each file and read it into a DataFrame
-    for file in b_factor_files:
-        try:
-            df = pd.read_csv(file)
-            # Optionally, add a new column to identify the source file
-            b_factor_dfs.append(df)
-        except:
-            not_parsed.append(file)
-
-    # Check if any DataFrames were added
-    print("Number of DataFrames read:", len(b_factor_dfs))
-
-    # Concatenate all DataFrames into a single DataFrame
-    if b_factor_dfs:  # Check if the list is not empty
-        combined_b_factor_df = pd.concat(b_factor_dfs, ignore_index=True)
-
-        # Rename the columns
-        combined_b_factor_df.rename(columns={'residue_name': 'residue_type', 'rotamer_value': 'angle', 'nchi': 'chi_angle'}, inplace=True)
-        combined_b_factor_df['chi_angle'] = combined_b_factor_df['chi_angle'].replace({
-            0: 'chi1',
-            1: 'chi2',
-            2: 'chi3',
-            3: 'chi4'
-        })
-
-        # Make all angles positive
-        combined_b_factor_df.loc[combined_b_factor_df['angle'] < 0, 'angle'] += 360    
-
-    print("Not parsed:",len(not_parsed))
+    # Read and normalise every rotamer file through a worker pool
+    ingest = load_rotamers(rotamer)
+    combined_b_factor_df = ingest.data
+    write_failed(ingest.failed, failed_output)
     
-    # List all CSV files in the energy bin folder
-    csv_files = [file for file in os.listdir(folder_path) if file.endswith('.csv')]
-
-    # Initialize an empty list to collect the DataFrames
-    dfs = []
+    # Load the compiled energy potentials, rebuilding them if any CSV changed
+    energy_store = load_energy_store(folder_path)
 
-    # Loop through all CSV files and append the processed DataFrames to the list
-    for file_name in csv_files:
-        df = pd.read_csv(os.path.join(folder_path, file_name))
-        df["AA_CHI"] = file_name.split('.')[0]  # Add the new column for AA_CHI & labeling each row by file name
-        dfs.append(df)
+    # Assign energies to every residue type and chi angle in one batched lookup per AA_CHI
+    final_sorted_data, unmatched = score_deposited(combined_b_factor_df, energy_store, backbone_dependent_path, progress=tqdm)
+    print("Angles without an energy bin:", len(unmatched))
+    print(summarize_unmatched(unmatched).to_string(index=False))
 
-    # Concatenate all DataFrames in the list into one DataFrame
-    energy_bin = pd.concat(dfs, ignore_index=True)
-
-    # Create an empty list to store processed data
-    process_list = []
-
-    # Iterate through each unique amino acid and chi angle, and process data accordingly
-    for amino_acid in tqdm(combined_b_factor_df['residue_type'].unique()):
-        # Filter the DataFrame by the current amino acid
-        temp_df = combined_b_factor_df[combined_b_factor_df['residue_type'] == amino_acid]
-        
-        for chi_angle in temp_df['chi_angle'].unique():
-            # Ensure chi_angle is a string and contains 'chi'
-            if isinstance(chi_angle, str) and 'chi' in chi_angle:
-                # Capitalize chi_angle if valid
-                chi_angle_capital = chi_angle.upper()
-                
-                # Create the energy_bins key
-                energy_bins = f"{amino_acid}_{chi_angle_capital}"
-                
-                # Filter the energy_bin DataFrame by the energy_bins key
-                temp_energy = energy_bin[energy_bin['AA_CHI'] == energy_bins]
-                
-                # Further filter temp_df by the current chi_angle
-                temp_df2 = temp_df[temp_df['chi_angle'] == chi_angle]
-                
-                # Process the chi data and append to process_list
-                process = process_chi_data(temp_df2, temp_energy)
+    # Plotting
+    plot_data(final_sorted_data)
 
-                # Add the AA_CHI column using the energy_bins key
-                process["AA_CHI"] = energy_bins
-                
-                process_list.append(process)
 
-    # Concatenate all processed DataFrames into one final DataFrame
-    final_sorted_data = pd.concat(process_list, ignore_index=True)
+# Score the rotamer files chunk by chunk with bounded memory, then plot from the aggregates
+def main_streaming(files_per_chunk=256, prefetch=2):
+    energy_store = load_energy_store(folder_path)
+    checkpoint = BatchCheckpoint(checkpoint_dir, {'energy_hash': energy_store.source_hash, 'files_per_chunk': files_per_chunk})
+    aggregates, not_parsed = stream_score(list_rotamer_files(rotamer), energy_store.tables, scored_output, files_per_chunk, checkpoint=checkpoint, prefetch=prefetch)
+    aggregates.save(aggregates_output)
+    write_failed(not_parsed, failed_output)
+    print(aggregates.summary().to_string(index=False))
 
     # Plotting
-    plot_data(final_sorted_data)
+    plot_data(aggregates.to_points())
 
 # Run the main function
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Assign knowledge-based energies to rotamer chi angles.')
+    parser.add_argument('--stream', action='store_true', help='score files in chunks, checkpointing every chunk so a restarted run resumes')
+    parser.add_argument('--files-per-chunk', type=int, default=256)
+    parser.add_argument('--prefetch', type=int, default=2, help='chunks read ahead while the current one is scored; 0 reads sequentially')
+    parser.add_argument('--plot-from', metavar='AGGREGATES', help='only redraw the plots from a saved aggregates .npz')
+    args = parser.parse_args()
+
+    if args.plot_from:
+        plot_data(ScoreAggregates.load(args.plot_from).to_points())
+    elif args.stream:
+        main_streaming(args.files_per_chunk, args.prefetch)
+    else:
+        main()
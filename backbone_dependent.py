@@ -0,0 +1,206 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from energy_lookup import aa_chi_keys, score_rotamers
+from energy_store import read_energy_sources
+from rotamer_io import concat_rotamers
+
+
+# Tolerance, in bins, for a lower edge to count as lying on the grid
+GRID_TOLERANCE = 1e-6
+
+
+# Infer a uniform bin width from the distinct lower edges of a grid axis
+def grid_step(edges, name='grid'):
+    steps = np.diff(np.unique(np.round(edges, 6)))
+    if len(steps) == 0:
+        return 360.0
+    step = float(np.min(steps))
+    # Gaps may skip empty cells, but every edge must lie a whole number of bins from the first
+    if not np.allclose(steps / step, np.rint(steps / step), rtol=0, atol=GRID_TOLERANCE):
+        raise ValueError(f"{name} edges are not on a uniform grid (bin widths {np.unique(np.round(steps, 6)).tolist()})")
+    return step
+
+
+def grid_index(values, origin, step, name='grid'):
+    '''
+    Arguments:
+        values (array): lower edges of the bins along one axis
+        origin (float): lower edge of the first bin
+        step (float): bin width
+        name (str): axis name used in error messages {default: 'grid'}
+    Returns
+        integer bin index of every edge; raises ValueError for an edge off the grid
+        or a width that does not divide the 360° circle.
+    '''
+    if not np.isclose(360 / step, np.rint(360 / step), rtol=0, atol=GRID_TOLERANCE):
+        raise ValueError(f"{name} bin width {step} does not divide 360")
+    offsets = (values - origin) / step
+    idx = np.rint(offsets)
+    off_grid = ~np.isclose(offsets, idx, rtol=0, atol=GRID_TOLERANCE)
+    if off_grid.any():
+        raise ValueError(f"{name} edges off the grid of width {step} from {origin}: {np.unique(values[off_grid])[:5].tolist()}")
+    return idx.astype(np.intp)
+
+
+# Dense (phi, psi, chi) energy grid of one AA_CHI key
+class BackboneDependentGrid:
+    def __init__(self, origins, steps, energy, chi_edges=None):
+        '''
+        Arguments:
+            origins (tuple of float): lower edge of the first phi, psi and chi bin
+            steps (tuple of float): width of the phi, psi and chi bins
+            energy (array): E with shape (n_phi, n_psi, n_chi); NaN for empty cells
+            chi_edges (tuple of array): bin min and bin max of every chi bin, as given in
+                the potential {default: origin + k * step and the next edge}
+        '''
+        self.origins = np.asarray(origins, dtype=float)
+        self.steps = np.asarray(steps, dtype=float)
+        self.energy = np.asarray(energy, dtype=float)
+        if chi_edges is None:
+            lower = self.origins[2] + np.arange(self.energy.shape[2]) * self.steps[2]
+            chi_edges = (lower, lower + self.steps[2])
+        self.chi_min, self.chi_max = (np.asarray(edges, dtype=float) for edges in chi_edges)
+
+    @classmethod
+    def from_frame(cls, table):
+        '''
+        Arguments:
+            table (pandas dataframe): backbone-dependent potential with columns phi and
+                psi (lower edges of the backbone bins), bin min, bin max and E. Each
+                axis must be binned on a uniform grid and every cell listed at most once.
+        Returns
+            BackboneDependentGrid over every (phi, psi, chi) bin in the table; raises
+            ValueError for an edge off the grid, non-uniform chi bins or a duplicate cell.
+            A chi angle matches a bin only strictly inside it (bin min < chi < bin max),
+            like the backbone-independent tables, so an angle on a chi edge is unmatched by
+            both. The phi/psi bins tile the backbone space, lower edge included.
+        '''
+        phi = table['phi'].to_numpy(dtype=float)
+        psi = table['psi'].to_numpy(dtype=float)
+        chi = table['bin min'].to_numpy(dtype=float)
+        origins = (phi.min(), psi.min(), chi.min())
+        widths = table['bin max'].to_numpy(dtype=float) - chi
+        chi_step = float(np.median(widths))
+        if not np.allclose(widths, chi_step, rtol=0, atol=GRID_TOLERANCE * chi_step):
+            raise ValueError(f"chi bins are not of uniform width (widths {np.unique(np.round(widths, 6)).tolist()})")
+        steps = (grid_step(phi, 'phi'), grid_step(psi, 'psi'), chi_step)
+
+        idx = [grid_index(values, origin, step, name) for values, origin, step, name in zip((phi, psi, chi), origins, steps, ('phi', 'psi', 'chi'))]
+        shape = tuple(min(int(i.max()) + 1, int(round(360 / step))) for i, step in zip(idx, steps))
+        cells = np.ravel_multi_index((idx[0] % shape[0], idx[1] % shape[1], idx[2] % shape[2]), shape)
+        unique_cells, counts = np.unique(cells, return_counts=True)
+        if (counts > 1).any():
+            duplicates = np.unravel_index(unique_cells[counts > 1][:5], shape)
+            cell_edges = [(float(origins[0] + i * steps[0]), float(origins[1] + j * steps[1]), float(origins[2] + k * steps[2])) for i, j, k in zip(*duplicates)]
+            raise ValueError(f"{int((counts > 1).sum())} (phi, psi, chi) cells appear more than once, e.g. {cell_edges}")
+        energy = np.full(shape, np.nan)
+        energy.flat[cells] = table['E'].to_numpy(dtype=float)
+
+        # The exact chi edges of the table, so edge angles compare as in BinnedEnergyTable
+        chi_min = origins[2] + np.arange(shape[2]) * steps[2]
+        chi_max = chi_min + steps[2]
+        chi_index, first = np.unique(idx[2] % shape[2], return_index=True)
+        chi_min[chi_index] = chi[first]
+        chi_max[chi_index] = table['bin max'].to_numpy(dtype=float)[first]
+        return cls(origins, steps, energy, (chi_min, chi_max))
+
+    def cell_index(self, values, axis):
+        # Bin of every value along one axis (lower edge included), wrapping angles by 360°; -1 outside the grid
+        values = np.asarray(values, dtype=float)
+        finite = np.isfinite(values)
+        offset = np.mod(np.where(finite, values, 0) - self.origins[axis], 360)
+        idx = np.floor(offset / self.steps[axis]).astype(np.intp)
+        return np.where(finite & (idx < self.energy.shape[axis]), idx, -1)
+
+    def chi_index(self, chi):
+        # Chi bin of every angle with both edges excluded, as in the backbone-independent tables; -1 otherwise
+        chi = np.asarray(chi, dtype=float)
+        finite = np.isfinite(chi)
+        chi = np.where(finite, chi, 0)
+        nearest = np.floor(np.mod(chi - self.origins[2], 360) / self.steps[2]).astype(np.intp)
+        index = np.full(chi.shape, -1, dtype=np.intp)
+        # Rounding can put an angle right at an edge one bin off, so the neighbours are checked too
+        for k in (nearest, nearest - 1, nearest + 1):
+            valid = finite & (index < 0) & (k >= 0) & (k < self.energy.shape[2])
+            k = np.where(valid, k, 0)
+            lower, upper = self.chi_min[k], self.chi_max[k]
+            # The angle turned by whole periods to lie next to the bin
+            angle = chi - 360 * np.round((chi - (lower + upper) / 2) / 360)
+            index = np.where(valid & (lower < angle) & (angle < upper), k, index)
+        return index
+
+    def lookup(self, phi, psi, chi):
+        '''
+        Arguments:
+            phi, psi, chi (array-like): backbone and side-chain angles in degrees
+        Returns
+            (energy, matched): E of the grid cell of every angle triple (NaN where
+            any angle is missing or the cell is empty) and the mask of filled cells.
+        '''
+        i = self.cell_index(phi, 0)
+        j = self.cell_index(psi, 1)
+        k = self.chi_index(chi)
+        inside = (i >= 0) & (j >= 0) & (k >= 0)
+        energy = np.full(inside.shape, np.nan)
+        energy[inside] = self.energy[i[inside], j[inside], k[inside]]
+        return energy, ~np.isnan(energy)
+
+
+def load_backbone_dependent_tables(source):
+    '''
+    Arguments:
+        source (str): directory or .zip archive of <AA>_CHI<n>.csv backbone-dependent
+            potentials (see BackboneDependentGrid.from_frame for the columns)
+    Returns
+        dict of AA_CHI key -> BackboneDependentGrid.
+    '''
+    grids = {}
+    for aa_chi, data in read_energy_sources(source).items():
+        try:
+            grids[aa_chi] = BackboneDependentGrid.from_frame(pd.read_csv(io.BytesIO(data)))
+        except ValueError as e:
+            raise ValueError(f"{aa_chi}: {e}") from e
+    return grids
+
+
+def score_rotamers_backbone(rotamer_df, grids, fallback_tables):
+    '''
+    Score rotamer rows with backbone-dependent potentials, falling back to the
+    backbone-independent tables where phi/psi are missing or the grid cell is empty.
+
+    Arguments:
+        rotamer_df (pandas dataframe): normalised rotamer rows with residue_type,
+            chi_angle, angle and (optionally) phi and psi columns
+        grids (dict): BackboneDependentGrid per AA_CHI key
+        fallback_tables (dict): backbone-independent tables per AA_CHI key, e.g. EnergyStore.tables
+    Returns
+        (scored, unmatched) as in score_rotamers, with an E_source column telling
+        which potential each energy came from.
+    '''
+    df = rotamer_df[rotamer_df['chi_angle'].astype(str).str.contains('chi')].copy()
+    df['AA_CHI'] = aa_chi_keys(df)
+    phi = df['phi'].to_numpy(dtype=float) if 'phi' in df.columns else np.full(len(df), np.nan)
+    psi = df['psi'].to_numpy(dtype=float) if 'psi' in df.columns else np.full(len(df), np.nan)
+    angles = df['angle'].to_numpy(dtype=float)
+
+    energy = np.full(len(df), np.nan)
+    matched = np.zeros(len(df), dtype=bool)
+    codes, keys = pd.factorize(df['AA_CHI'])
+    for code, idx in pd.Series(codes).groupby(codes, sort=False).indices.items():
+        if code >= 0 and keys[code] in grids:
+            energy[idx], matched[idx] = grids[keys[code]].lookup(phi[idx], psi[idx], angles[idx])
+
+    backbone = df.loc[matched].copy()
+    backbone['E'] = energy[matched].astype(np.float32)
+    backbone['E_source'] = 'backbone_dependent'
+
+    # Everything the grids could not score goes through the backbone-independent lookup
+    fallback, unmatched = score_rotamers(df.loc[~matched].drop(columns='AA_CHI'), fallback_tables)
+    if not fallback.empty:
+        fallback['E_source'] = 'backbone_independent'
+    scored = concat_rotamers([backbone, fallback])
+    scored['E_source'] = scored['E_source'].astype('category')
+    return scored, unmatched
@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from energy_store import EnergyStore, read_energy_sources
+from example_function import StatsPotential, get_energy_from_stats, get_energy_from_stats_batch
+
+# Energy potentials shipped with the repository
+energy_zip = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backbone_independent_energy.zip')
+
+# (default_maximum, set_maximum) combinations covering every branch of the scalar function
+MAXIMUM_OPTIONS = [(True, None), (True, 9.0), (False, 9.0), (False, 0), (False, None)]
+
+
+# Measurements that exercise bin edges, gaps, the ends of the table and NaN
+def edge_case_angles(potential, n_random, rng):
+    edges = np.concatenate([potential['bin min'], potential['bin max']])
+    return np.concatenate([
+        edges,
+        np.nextafter(edges, np.inf),
+        np.nextafter(edges, -np.inf),
+        potential['bin mid'],
+        [edges.min() - 1, edges.max() + 1, np.nan, -np.inf, np.inf],
+        rng.uniform(-200, 400, n_random),
+    ])
+
+
+# Check the batch function against the scalar function for every measurement
+def check_potential(potential, angles):
+    prepared = StatsPotential(potential)
+    for default_maximum, set_maximum in MAXIMUM_OPTIONS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [get_energy_from_stats(potential, angle, default_maximum, set_maximum) for angle in angles]
+            result = get_energy_from_stats_batch(prepared, angles, default_maximum, set_maximum)
+        expected = np.array([np.nan if value is None else value for value in expected], dtype=float)
+        if not np.array_equal(expected, result.energy, equal_nan=True):
+            mismatch = np.flatnonzero(~((expected == result.energy) | (np.isnan(expected) & np.isnan(result.energy))))
+            raise AssertionError(f"{len(mismatch)} mismatches for default_maximum={default_maximum}, set_maximum={set_maximum}, e.g. angle {angles[mismatch[0]]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check get_energy_from_stats_batch against the scalar function and time both.')
+    parser.add_argument('--random', type=int, default=200, help='random angles per potential in the regression check')
+    parser.add_argument('--rows', type=int, default=1000000, help='angles in the timing run')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    store = EnergyStore.from_sources(read_energy_sources(energy_zip))
+    for aa_chi in store.keys:
+        potential = store.table_frame(aa_chi)
+        check_potential(potential, edge_case_angles(potential, args.random, rng))
+    print(f"Batch results identical to the scalar function on {len(store)} potentials")
+
+    potential = store.table_frame(store.keys[0])
+    angles = rng.uniform(0, 360, args.rows)
+    n_scalar = min(args.rows, 2000)
+    start = time.perf_counter()
+    for angle in angles[:n_scalar]:
+        get_energy_from_stats(potential, angle)
+    scalar = (time.perf_counter() - start) / n_scalar
+    start = time.perf_counter()
+    get_energy_from_stats_batch(potential, angles)
+    batch = (time.perf_counter() - start) / args.rows
+    print(f"scalar={scalar * 1e6:.1f}us/angle batch={batch * 1e9:.1f}ns/angle over {args.rows} angles")
+
+
+if __name__ == '__main__':
+    main()
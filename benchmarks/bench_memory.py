@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from energy_lookup import score_rotamers
+from energy_store import load_energy_store
+from rotamer_io import list_rotamer_files, load_rotamer_files
+from synthetic_data import energy_zip, write_dataset
+
+
+# Seconds taken by a function, best of a few runs
+def best_time(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# Memory of the ingested and scored tables and the cost of typical filters in one schema
+def measure_schema(paths, tables, compact):
+    data = load_rotamer_files(paths, workers=1, verbose=False, compact=compact).data
+    scored, _ = score_rotamers(data, tables)
+    return {
+        'ingest_bytes': int(data.memory_usage(deep=True).sum()),
+        'scored_bytes': int(scored.memory_usage(deep=True).sum()),
+        'columns': {column: int(n) for column, n in scored.memory_usage(deep=True, index=False).items()},
+        'filter_seconds': best_time(lambda: scored[(scored['residue_type'] == 'ARG') & (scored['chi_angle'] == 'chi3')]),
+        'groupby_seconds': best_time(lambda: scored.groupby(['AA_CHI'], observed=True, sort=False)['E'].mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory and filter speed of the object and compact rotamer schemas.')
+    parser.add_argument('--rows', type=int, default=1000000, help='approximate deposited rows of the synthetic data')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tmp', help='directory the synthetic files are written to {default: system temp}')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    store = load_energy_store(energy_zip)
+    directory = tempfile.mkdtemp(prefix='bench_memory_', dir=args.tmp)
+    try:
+        rotamer_dir, _, n_rows, _ = write_dataset(directory, store, args.rows, args.seed)
+        paths = list_rotamer_files(rotamer_dir)
+        report = {'rows': n_rows, 'object': measure_schema(paths, store.tables, False), 'compact': measure_schema(paths, store.tables, True)}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for key in ('ingest_bytes', 'scored_bytes'):
+        print(f"{key}: {report['object'][key] / 1e6:.1f} MB -> {report['compact'][key] / 1e6:.1f} MB "
+              f"({report['object'][key] / report['compact'][key]:.1f}x smaller)", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from energy_lookup import score_rotamers
+from energy_store import load_energy_store
+from ensemble import residue_energies
+from instrumentation import PeakRSS
+from interpolated_potential import build_interpolated_potentials
+from pairing import pair_altlocs, score_pairs
+from rotamer_io import list_rotamer_files, normalize_rotamers, read_rotamer_file
+from streaming import ScoreAggregates
+from synthetic_data import energy_zip, write_dataset
+
+
+# Run one stage, returning its result and a JSON-ready record of rows, time and memory
+def measure(stage, n_rows, rows_in, function, *args):
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+    rows_out = len(result[0]) if isinstance(result, tuple) else len(result)
+    record = {
+        'rows': n_rows,
+        'stage': stage,
+        'rows_in': rows_in,
+        'rows_out': rows_out,
+        'seconds': seconds,
+        'rows_per_second': rows_in / seconds if seconds else None,
+        'peak_rss_bytes': memory.peak,
+        'peak_rss_increase_bytes': memory.peak - memory.start,
+    }
+    print(f"rows={n_rows} {stage:<12} {seconds:8.3f}s {record['rows_per_second'] or 0:12.0f} rows/s "
+          f"peak RSS +{record['peak_rss_increase_bytes'] / 1e6:.0f} MB", file=sys.stderr)
+    return result, record
+
+
+def read_files(paths):
+    return pd.concat([read_rotamer_file(path) for path in paths], ignore_index=True)
+
+
+def pair(qfit, deposited, tables):
+    return score_pairs(pair_altlocs(qfit, deposited), tables)
+
+
+def aggregate(scored, unmatched):
+    aggregates = ScoreAggregates().add(scored, unmatched)
+    residues = residue_energies(scored)
+    return residues, aggregates
+
+
+def plot(scored, output_dir, workers):
+    from plotting import render_plots
+    return render_plots(scored, 'energy', output_dir, workers=workers)
+
+
+def run_size(n_rows, tables, store, args):
+    # Time every stage on one synthetic dataset of about n_rows deposited rows
+    directory = tempfile.mkdtemp(prefix='bench_pipeline_', dir=args.tmp)
+    try:
+        start = time.perf_counter()
+        rotamer_dir, qfit_dir, n_deposited, n_qfit = write_dataset(directory, store, n_rows, args.seed)
+        print(f"rows={n_rows} generated {n_deposited} + {n_qfit} qFit rows in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        paths = list_rotamer_files(rotamer_dir)
+        n_bytes = sum(os.path.getsize(path) for path in paths)
+
+        records = []
+        raw, record = measure('ingest', n_rows, n_deposited, read_files, paths)
+        record['bytes_read'] = n_bytes
+        records.append(record)
+        deposited, record = measure('normalize', n_rows, len(raw), normalize_rotamers, raw)
+        records.append(record)
+        del raw
+        (scored, unmatched), record = measure('lookup', n_rows, len(deposited), score_rotamers, deposited, tables)
+        records.append(record)
+
+        qfit = normalize_rotamers(read_files(list_rotamer_files(qfit_dir)))
+        merged, record = measure('pairing', n_rows, len(qfit) + len(deposited), pair, qfit, deposited, tables)
+        records.append(record)
+        del qfit, merged
+
+        _, record = measure('aggregation', n_rows, len(scored), aggregate, scored, unmatched)
+        records.append(record)
+        if not args.skip_plotting:
+            plot_dir = os.path.join(directory, 'plots')
+            os.makedirs(plot_dir)
+            _, record = measure('plotting', n_rows, len(scored), plot, scored, plot_dir, args.workers)
+            records.append(record)
+        return records
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every stage of the scoring pipeline on synthetic data and report JSON.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='approximate deposited rows per run, e.g. 1000 ... 10000000')
+    parser.add_argument('--engine', choices=['binned', 'spline'], default='binned', help='potential used in the lookup stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help='plotting processes {default: all cores}')
+    parser.add_argument('--skip-plotting', action='store_true')
+    parser.add_argument('--tmp', help='directory the synthetic files are written to {default: system temp}')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    store = load_energy_store(energy_zip)
+    tables = store.tables if args.engine == 'binned' else build_interpolated_potentials(store)
+
+    report = {
+        'engine': args.engine,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': [record for n_rows in args.rows for record in run_size(n_rows, tables, store, args)],
+    }
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rotamer_io
+from energy_store import load_energy_store
+from instrumentation import PeakRSS
+from rotamer_io import list_rotamer_files
+from streaming import stream_score
+from synthetic_data import energy_zip, write_dataset
+
+
+# Stand-in for a networked filesystem: every file read first waits latency seconds
+def add_read_latency(latency):
+    read_file = rotamer_io.read_rotamer_file
+
+    def slow_read(path):
+        time.sleep(latency)
+        return read_file(path)
+    rotamer_io.read_rotamer_file = slow_read
+
+
+# Streaming score of every file with one prefetch depth
+def run(paths, tables, output_path, files_per_chunk, prefetch):
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        aggregates, _ = stream_score(paths, tables, output_path, files_per_chunk, prefetch=prefetch)
+        seconds = time.perf_counter() - start
+    return {
+        'prefetch': prefetch,
+        'seconds': seconds,
+        'rows': int(sum(aggregates.counts.values())),
+        'peak_rss_increase_bytes': memory.peak - memory.start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time streaming scoring with overlapped file reads against the sequential path.')
+    parser.add_argument('--rows', type=int, default=200000, help='approximate deposited rows of the synthetic dataset')
+    parser.add_argument('--residues-per-file', type=int, default=100, help='residues per file; small files make reads latency-bound')
+    parser.add_argument('--files-per-chunk', type=int, default=32)
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[0, 1, 2, 4, 8], help='prefetch depths to time; 0 is the sequential path')
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated per-file read latency, e.g. 5 for a networked filesystem')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tmp', help='directory the synthetic files are written to {default: system temp}')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    store = load_energy_store(energy_zip)
+    directory = tempfile.mkdtemp(prefix='bench_prefetch_', dir=args.tmp)
+    try:
+        rotamer_dir, _, n_rows, _ = write_dataset(directory, store, args.rows, args.seed, args.residues_per_file)
+        paths = list_rotamer_files(rotamer_dir)
+        if args.latency_ms:
+            add_read_latency(args.latency_ms / 1000)
+
+        results = []
+        reference = None
+        for prefetch in args.prefetch:
+            output_path = os.path.join(directory, f'scored_prefetch{prefetch}.csv')
+            record = run(paths, store.tables, output_path, args.files_per_chunk, prefetch)
+            if reference is None:
+                reference = output_path
+            record['identical'] = filecmp.cmp(reference, output_path, shallow=False)
+            record['speedup'] = results[0]['seconds'] / record['seconds'] if results else 1.0
+            results.append(record)
+            print(f"prefetch={prefetch:<3} {record['seconds']:8.3f}s speedup {record['speedup']:5.2f}x "
+                  f"peak RSS +{record['peak_rss_increase_bytes'] / 1e6:.0f} MB identical={record['identical']}", file=sys.stderr)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'rows': n_rows,
+        'files': len(paths),
+        'files_per_chunk': args.files_per_chunk,
+        'latency_ms': args.latency_ms,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from energy_store import load_energy_store
+from ensemble import KT
+
+# Energy potentials shipped with the repository
+energy_zip = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backbone_independent_energy.zip')
+
+# Approximate frequencies (%) of the residue types with side-chain chi angles in protein sequences
+RESIDUE_FREQUENCIES = {
+    'ARG': 5.5, 'ASN': 4.1, 'ASP': 5.5, 'CYS': 1.4, 'GLN': 3.9, 'GLU': 6.7, 'HIS': 2.3, 'ILE': 5.9, 'LEU': 9.7,
+    'LYS': 5.8, 'MET': 2.4, 'PHE': 3.9, 'PRO': 4.7, 'SER': 6.6, 'THR': 5.3, 'TRP': 1.1, 'TYR': 2.9, 'VAL': 6.9,
+}
+
+# Columns of the deposited and qFit rotamer CSVs
+ROTAMER_COLUMNS = ['chain', 'residue', 'residue_name', 'nchi', 'rotamer_value']
+QFIT_COLUMNS = ROTAMER_COLUMNS + ['altloc', 'occupancy']
+
+
+# Per AA_CHI, the bins of the potential and the Boltzmann probability of landing in each
+def chi_distributions(energy_store, kT=KT):
+    distributions = {}
+    for aa_chi in energy_store.keys:
+        rows = energy_store.slice(aa_chi)
+        energy = energy_store.columns['E'][rows]
+        weight = np.exp(-(energy - energy.min()) / kT)
+        distributions[aa_chi] = (energy_store.columns['bin min'][rows], energy_store.columns['bin max'][rows], np.cumsum(weight) / weight.sum())
+    return distributions
+
+
+# Angles drawn from the Boltzmann distribution of one potential, plus a fraction of uniform noise that falls into gaps
+def sample_angles(distribution, n, rng, noise=0.01):
+    bin_min, bin_max, cumulative = distribution
+    idx = np.minimum(np.searchsorted(cumulative, rng.random(n)), len(cumulative) - 1)
+    angles = rng.uniform(bin_min[idx], bin_max[idx])
+    uniform = rng.random(n) < noise
+    angles[uniform] = rng.uniform(0, 360, uniform.sum())
+    # Written in (-180, 180] like the rotamer output
+    return (angles + 180) % 360 - 180
+
+
+def make_rotamer_rows(energy_store, n_rows, seed=0, altloc_fraction=0.2):
+    '''
+    Arguments:
+        energy_store (EnergyStore): potentials the angles are drawn from
+        n_rows (int): approximate number of deposited chi angle rows
+        seed (int): random seed {default: 0}
+        altloc_fraction (float): fraction of residues qFit models with two altlocs {default: 0.2}
+    Returns
+        (deposited, qfit): raw rotamer rows (columns of the CSVs plus a residue_index
+        column numbering the residues) of the deposited and qFit models.
+    '''
+    rng = np.random.default_rng(seed)
+    distributions = chi_distributions(energy_store)
+    names = np.array(list(RESIDUE_FREQUENCIES))
+    n_chi = np.array([sum(key.startswith(name + '_') for key in energy_store.keys) for name in names])
+    probability = np.array(list(RESIDUE_FREQUENCIES.values())) / sum(RESIDUE_FREQUENCIES.values())
+
+    # Enough residues for n_rows chi angles on average
+    n_residues = max(1, int(round(n_rows / (probability * n_chi).sum())))
+    residue_kind = rng.choice(len(names), n_residues, p=probability)
+    per_residue = n_chi[residue_kind]
+    residue_index = np.repeat(np.arange(n_residues), per_residue)
+    kind = residue_kind[residue_index]
+    chi = np.arange(len(residue_index)) - np.repeat(np.cumsum(per_residue) - per_residue, per_residue)
+
+    deposited = pd.DataFrame({'residue_index': residue_index, 'residue_name': names[kind], 'nchi': chi})
+    angles = np.empty(len(deposited))
+    keys = deposited['residue_name'] + '_CHI' + (chi + 1).astype(str)
+    for key, idx in deposited.groupby(keys, sort=False).indices.items():
+        angles[idx] = sample_angles(distributions[key], len(idx), rng)
+    deposited['rotamer_value'] = angles
+
+    # qFit: altloc A near the deposited angle and a resampled altloc B for a fraction of residues
+    multi = rng.random(n_residues) < altloc_fraction
+    single_rows = deposited[~multi[residue_index]].assign(altloc=np.nan, occupancy=1.0)
+    altloc_a = deposited[multi[residue_index]].copy()
+    occupancy = np.round(rng.uniform(0.3, 0.7, n_residues), 2)
+    altloc_a['altloc'] = 'A'
+    altloc_a['occupancy'] = occupancy[altloc_a['residue_index']]
+    altloc_a['rotamer_value'] = (altloc_a['rotamer_value'] + rng.normal(0, 5, len(altloc_a)) + 180) % 360 - 180
+    altloc_b = altloc_a.copy()
+    altloc_b['altloc'] = 'B'
+    altloc_b['occupancy'] = np.round(1 - altloc_a['occupancy'], 2)
+    b_keys = altloc_b['residue_name'] + '_CHI' + (altloc_b['nchi'] + 1).astype(str)
+    for key, idx in altloc_b.groupby(b_keys.to_numpy(), sort=False).indices.items():
+        altloc_b.iloc[idx, altloc_b.columns.get_loc('rotamer_value')] = sample_angles(distributions[key], len(idx), rng)
+    qfit = pd.concat([single_rows, altloc_a, altloc_b]).sort_values(['residue_index', 'altloc', 'nchi'], kind='stable', na_position='first')
+    return deposited, qfit.reset_index(drop=True)
+
+
+def write_dataset(directory, energy_store, n_rows, seed=0, residues_per_file=300, altloc_fraction=0.2):
+    '''
+    Write synthetic <id>_rotamers_output.csv and <id>_qFit_rotamers_output.csv files,
+    one pair per structure of residues_per_file residues split over chains A and B.
+
+    Arguments:
+        directory (str): root of the dataset; files go to rotamers/ and qfit/ below it
+        energy_store (EnergyStore): potentials the angles are drawn from
+        n_rows (int): approximate number of deposited chi angle rows
+        seed (int): random seed {default: 0}
+        residues_per_file (int): residues per structure {default: 300}
+        altloc_fraction (float): fraction of residues with two qFit altlocs {default: 0.2}
+    Returns
+        (rotamer_dir, qfit_dir, n_deposited_rows, n_qfit_rows).
+    '''
+    deposited, qfit = make_rotamer_rows(energy_store, n_rows, seed, altloc_fraction)
+    rotamer_dir = os.path.join(directory, 'rotamers')
+    qfit_dir = os.path.join(directory, 'qfit')
+    os.makedirs(rotamer_dir, exist_ok=True)
+    os.makedirs(qfit_dir, exist_ok=True)
+
+    for df in (deposited, qfit):
+        structure = df['residue_index'] // residues_per_file
+        position = df['residue_index'] % residues_per_file
+        df['chain'] = np.where(position < residues_per_file // 2, 'A', 'B')
+        df['residue'] = position + 1
+        df['structure'] = structure
+
+    for (structure, rows), (_, qfit_rows) in zip(deposited.groupby('structure', sort=True), qfit.groupby('structure', sort=True)):
+        pdb_id = f'syn{structure:06d}'
+        rows[ROTAMER_COLUMNS].to_csv(os.path.join(rotamer_dir, f'{pdb_id}_rotamers_output.csv'), index=False)
+        qfit_rows[QFIT_COLUMNS].to_csv(os.path.join(qfit_dir, f'{pdb_id}_qFit_rotamers_output.csv'), index=False)
+    return rotamer_dir, qfit_dir, len(deposited), len(qfit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic rotamer / qFit dataset drawn from the bundled potentials.')
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=100000, help='approximate number of deposited chi angle rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--residues-per-file', type=int, default=300)
+    parser.add_argument('--altloc-fraction', type=float, default=0.2)
+    args = parser.parse_args()
+
+    store = load_energy_store(energy_zip)
+    rotamer_dir, qfit_dir, n_deposited, n_qfit = write_dataset(args.directory, store, args.rows, args.seed, args.residues_per_file, args.altloc_fraction)
+    print(f"Wrote {n_deposited} rows to {rotamer_dir} and {n_qfit} rows to {qfit_dir}")
@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+
+from streaming import ScoreAggregates
+
+# Bump when the layout of the batch files changes; older checkpoints are then rescored
+CHECKPOINT_VERSION = 1
+
+
+# Path, modification time and size of an input file, recorded when its batch completes.
+# A file that cannot be stat'ed (e.g. deleted since it was listed) gets None for both; reading it
+# fails and the batch lists it as failed, as a run without a checkpoint would.
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+# Copy a CSV onto an open output file, keeping its header only if asked to
+def append_csv(out, path, header):
+    with open(path, 'rb') as handle:
+        first_line = handle.readline()
+        if header:
+            out.write(first_line)
+        shutil.copyfileobj(handle, out)
+
+
+# Durable per-batch results of a streaming run, so a restarted run skips finished batches
+class BatchCheckpoint:
+    def __init__(self, directory, settings=None):
+        '''
+        Every completed batch leaves batch-<n>.csv (scored rows, if any), batch-<n>.npz
+        (its ScoreAggregates) and, written last, batch-<n>.json: the manifest entry
+        listing the batch's input files. Each file is written under a temporary
+        name and renamed, so a kill at any point leaves only complete batches.
+
+        Arguments:
+            directory (str): checkpoint directory, created if missing
+            settings (dict): run parameters a batch must have been scored with to be
+                reused, e.g. the energy store hash and files_per_chunk {default: {}}
+        '''
+        self.directory = directory
+        self.settings = settings or {}
+        os.makedirs(directory, exist_ok=True)
+
+    def prefix(self, index):
+        return os.path.join(self.directory, f'batch-{index:06d}')
+
+    def is_complete(self, index, paths):
+        # The batch finished with the same settings and none of its files changed since
+        try:
+            with open(self.prefix(index) + '.json') as handle:
+                record = json.load(handle)
+            files = [file_signature(path) for path in paths]
+        except (OSError, ValueError):
+            return False
+        return (record.get('version') == CHECKPOINT_VERSION
+                and record.get('settings') == self.settings
+                and record.get('files') == files)
+
+    def save(self, index, paths, scored, unmatched, failed):
+        '''
+        Arguments:
+            index (int): position of the batch in the run
+            paths (list of str): input files of the batch
+            scored, unmatched (pandas dataframe): output of score_rotamers for the batch
+            failed (list): (file, reason) pairs of the batch's unreadable files
+        '''
+        prefix = self.prefix(index)
+        if os.path.exists(prefix + '.json'):
+            os.remove(prefix + '.json')
+        if not scored.empty:
+            scored.to_csv(prefix + '.csv.tmp', index=False)
+            os.replace(prefix + '.csv.tmp', prefix + '.csv')
+        elif os.path.exists(prefix + '.csv'):
+            os.remove(prefix + '.csv')
+        ScoreAggregates().add(scored, unmatched).save(prefix + '.tmp.npz')
+        os.replace(prefix + '.tmp.npz', prefix + '.npz')
+
+        record = {
+            'version': CHECKPOINT_VERSION,
+            'settings': self.settings,
+            'files': [file_signature(path) for path in paths],
+            'failed': [list(item) for item in failed],
+        }
+        with open(prefix + '.json.tmp', 'w') as handle:
+            json.dump(record, handle)
+        os.replace(prefix + '.json.tmp', prefix + '.json')
+
+    def load(self, index):
+        # (csv path or None, aggregates, failed files) of a completed batch
+        prefix = self.prefix(index)
+        with open(prefix + '.json') as handle:
+            record = json.load(handle)
+        csv_path = prefix + '.csv' if os.path.exists(prefix + '.csv') else None
+        return csv_path, ScoreAggregates.load(prefix + '.npz'), [tuple(item) for item in record['failed']]
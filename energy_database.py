@@ -0,0 +1,324 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from rotamer_io import COMPACT_DTYPES
+
+# Bump when the layout of the database changes
+DATABASE_VERSION = 1
+
+# Columns the rows are sorted and indexed by: AA_CHI first, so every key is one contiguous slice
+INDEX_COLUMNS = ['AA_CHI', 'pdb_id']
+
+# Text columns of the pipeline outputs, read as strings from CSV so an all-empty first chunk is not taken for numbers
+TEXT_COLUMNS = [column for column, dtype in COMPACT_DTYPES.items() if dtype == 'category'] + [
+    'AA_CHI', 'source_file', 'residue_altloc', 'altloc_qFit', 'altloc_rotamers', 'reason', 'rotamer', 'E_table_hash', 'E_source']
+
+# Missing value of integer columns
+INT_MISSING = np.iinfo(np.int32).min
+
+# Rows gathered at once when the sorted columns are written
+WRITE_BLOCK_ROWS = 1 << 20
+
+
+# On-disk dtype of every storage kind; categorical columns are int32 codes into sorted labels (-1 for missing)
+STORAGE_DTYPES = {'float32': np.float32, 'int32': np.int32, 'bool': np.bool_, 'category': np.int32}
+
+
+# Storage kind of a column: float32, int32, bool or category
+def column_kind(values):
+    dtype = values.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'int32'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float32'
+    return 'category'
+
+
+# Column values as the array written to disk; categories grow as new labels appear
+def encode_column(values, kind, categories):
+    if kind == 'category':
+        codes, labels = pd.factorize(values.astype(object) if isinstance(values.dtype, pd.CategoricalDtype) else values)
+        known = np.array([categories.setdefault(label, len(categories)) for label in labels] + [-1], dtype=np.int32)
+        return known[codes]
+    if kind == 'int32':
+        numbers = pd.to_numeric(values, errors='coerce')
+        return np.where(numbers.isna(), INT_MISSING, numbers.fillna(0)).astype(np.int32)
+    if kind == 'bool':
+        return values.fillna(False).to_numpy(dtype=bool)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float32)
+
+
+def build_database(frames, directory):
+    '''
+    Write table rows as memory-mapped column arrays sorted by AA_CHI and pdb_id,
+    with an offset index per AA_CHI and a row index per pdb_id.
+
+    Arguments:
+        frames (pandas dataframe or iterable of them): the rows, e.g. the scored
+            output or chunks of it; every chunk must have the same columns
+        directory (str): database directory, replaced if it exists
+    Returns
+        EnergyDatabase over the written directory.
+    '''
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    directory = directory.rstrip(os.sep)
+    # Raw unsorted columns go to <directory>.build, the finished database to <directory>.tmp, renamed at the end
+    build_dir = directory + '.build'
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    # Pass 1: append every chunk's encoded columns to raw files
+    columns = None
+    n_rows = 0
+    for df in frames:
+        if columns is None:
+            columns = [{'name': name, 'kind': column_kind(df[name]), 'categories': {}} for name in df.columns]
+            handles = [open(os.path.join(build_dir, f'raw_{i}.bin'), 'wb') for i in range(len(columns))]
+        for column, handle in zip(columns, handles):
+            handle.write(encode_column(df[column['name']], column['kind'], column['categories']).tobytes())
+        n_rows += len(df)
+    if columns is not None:
+        for handle in handles:
+            handle.close()
+    if not n_rows:
+        shutil.rmtree(build_dir)
+        raise ValueError('No rows to write')
+    raw = [np.memmap(os.path.join(build_dir, f'raw_{i}.bin'), dtype=STORAGE_DTYPES[column['kind']], mode='r', shape=(n_rows,)) for i, column in enumerate(columns)]
+
+    # Recode categories in sorted label order, so codes sort like the labels and labels can be found by binary search
+    recode = {}
+    for i, column in enumerate(columns):
+        if column['kind'] == 'category':
+            labels = np.array([str(label) for label in column['categories']], dtype=str)
+            order = np.argsort(labels, kind='stable')
+            new_code = np.empty(len(labels) + 1, dtype=np.int32)
+            new_code[order] = np.arange(len(labels), dtype=np.int32)
+            new_code[-1] = -1
+            recode[i] = new_code
+            column['categories'] = labels[order]
+
+    names = [column['name'] for column in columns]
+    keys = [names.index(name) for name in INDEX_COLUMNS if name in names and columns[names.index(name)]['kind'] == 'category']
+    sort_keys = [recode[i][raw[i]] for i in reversed(keys)]
+    order = np.lexsort(sort_keys) if sort_keys else np.arange(n_rows)
+
+    # Pass 2: write every column in sorted order, one block of rows at a time
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for i, column in enumerate(columns):
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, f'col_{i}.npy'), mode='w+', dtype=STORAGE_DTYPES[column['kind']], shape=(n_rows,))
+        for start in range(0, n_rows, WRITE_BLOCK_ROWS):
+            block = raw[i][order[start:start + WRITE_BLOCK_ROWS]]
+            out[start:start + WRITE_BLOCK_ROWS] = recode[i][block] if i in recode else block
+        out.flush()
+        del out
+        if column['kind'] == 'category':
+            np.save(os.path.join(tmp_dir, f'categories_{i}.npy'), column['categories'])
+    del raw
+
+    # Index: rows of AA_CHI code c are offsets[c]:offsets[c + 1]; rows of pdb_id code c are rows[offsets[c]:offsets[c + 1]]
+    index = {}
+    for i in keys:
+        name = names[i]
+        codes = np.load(os.path.join(tmp_dir, f'col_{i}.npy'), mmap_mode='r')
+        n_labels = len(columns[i]['categories'])
+        if name == INDEX_COLUMNS[0]:
+            offsets = np.searchsorted(codes, np.arange(n_labels + 1))
+            np.save(os.path.join(tmp_dir, f'offsets_{i}.npy'), offsets)
+            index[name] = {'column': i, 'sorted': True}
+        else:
+            rows = np.argsort(codes, kind='stable').astype(np.int32 if n_rows < 2 ** 31 else np.int64)
+            offsets = np.searchsorted(codes[rows], np.arange(n_labels + 1))
+            np.save(os.path.join(tmp_dir, f'rows_{i}.npy'), rows)
+            np.save(os.path.join(tmp_dir, f'offsets_{i}.npy'), offsets)
+            index[name] = {'column': i, 'sorted': False}
+        del codes
+
+    meta = {
+        'version': DATABASE_VERSION,
+        'n_rows': n_rows,
+        'columns': [{'name': column['name'], 'kind': column['kind']} for column in columns],
+        'index': index,
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as handle:
+        json.dump(meta, handle, indent=1)
+    shutil.rmtree(build_dir)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return EnergyDatabase(directory)
+
+
+def build_database_from_table(path, directory, chunksize=1000000):
+    '''
+    Arguments:
+        path (str): .csv or .parquet table written by the pipeline
+        directory (str): database directory, replaced if it exists
+        chunksize (int): CSV rows read at a time {default: 1000000}
+    Returns
+        EnergyDatabase; a CSV is read in chunks, so the table never has to fit in memory.
+    '''
+    if path.endswith('.parquet'):
+        return build_database(pd.read_parquet(path), directory)
+    header = pd.read_csv(path, nrows=0).columns
+    dtype = {column: str for column in TEXT_COLUMNS if column in header}
+    return build_database(pd.read_csv(path, dtype=dtype, chunksize=chunksize), directory)
+
+
+# Read-only view of a database written by build_database; columns are memory-mapped, never loaded whole
+class EnergyDatabase:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as handle:
+            meta = json.load(handle)
+        if meta.get('version') != DATABASE_VERSION:
+            raise ValueError(f"{directory} was written by an incompatible database version")
+        self.n_rows = meta['n_rows']
+        self.kinds = {column['name']: column['kind'] for column in meta['columns']}
+        self.position = {column['name']: i for i, column in enumerate(meta['columns'])}
+        self.index = meta['index']
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def columns(self):
+        return list(self.kinds)
+
+    def path(self, prefix, name):
+        if name not in self.position:
+            raise KeyError(f"No column {name!r} in {self.directory}")
+        return os.path.join(self.directory, f'{prefix}_{self.position[name]}.npy')
+
+    def array(self, name):
+        # Memory-mapped stored array of one column (codes for categorical columns)
+        return np.load(self.path('col', name), mmap_mode='r')
+
+    def categories(self, name):
+        return np.load(self.path('categories', name), mmap_mode='r')
+
+    def code(self, name, label):
+        # Code of a label of a categorical column, or -1 if it never occurs
+        categories = self.categories(name)
+        i = np.searchsorted(categories, label)
+        return int(i) if i < len(categories) and categories[i] == label else -1
+
+    def labels(self, name):
+        return self.categories(name).tolist()
+
+    def select(self, aa_chi=None, pdb_id=None, where=None):
+        '''
+        Arguments:
+            aa_chi (str): only rows of this key, e.g. 'ARG_CHI3' {default: all}
+            pdb_id (str): only rows of this structure {default: all}
+            where (dict): further filters, column -> (low, high) inclusive bounds
+                (None for an open end) for numeric columns, or a label / list of
+                labels for categorical ones, e.g. {'E': (2.0, None)} {default: none}
+        Returns
+            the selected rows: a slice when only the indexes were used, otherwise
+            a sorted array of row numbers.
+        '''
+        rows = slice(0, self.n_rows)
+        for name, label in zip(INDEX_COLUMNS, (aa_chi, pdb_id)):
+            if label is not None and name not in self.index:
+                raise ValueError(f"{self.directory} has no {name} index")
+        if aa_chi is not None:
+            name = INDEX_COLUMNS[0]
+            code = self.code(name, aa_chi)
+            if code < 0:
+                return slice(0, 0)
+            offsets = np.load(self.path('offsets', name), mmap_mode='r')
+            rows = slice(int(offsets[code]), int(offsets[code + 1]))
+        if pdb_id is not None:
+            name = INDEX_COLUMNS[1]
+            code = self.code(name, pdb_id)
+            if code < 0:
+                return slice(0, 0)
+            if aa_chi is not None:
+                # Within one AA_CHI the rows are sorted by pdb_id, so the structure is a sub-slice
+                codes = self.array(name)[rows]
+                rows = slice(rows.start + int(np.searchsorted(codes, code)), rows.start + int(np.searchsorted(codes, code, side='right')))
+            else:
+                offsets = np.load(self.path('offsets', name), mmap_mode='r')
+                rows = np.asarray(np.load(self.path('rows', name), mmap_mode='r')[offsets[code]:offsets[code + 1]], dtype=np.int64)
+        for name, condition in (where or {}).items():
+            rows = self.filter(rows, name, condition)
+        return rows
+
+    def filter(self, rows, name, condition):
+        # Rows of a selection that satisfy one where condition
+        values = self.array(name)[rows]
+        if self.kinds[name] == 'category':
+            labels = [condition] if isinstance(condition, str) else list(condition)
+            # Unknown labels get code -1, which is also the code of missing values: leave them out
+            codes = [code for code in (self.code(name, label) for label in labels) if code >= 0]
+            keep = np.isin(values, codes) if codes else np.zeros(len(values), dtype=bool)
+        else:
+            low, high = condition
+            keep = np.ones(len(values), dtype=bool)
+            if self.kinds[name] == 'int32':
+                keep &= values != INT_MISSING
+            elif self.kinds[name] == 'float32':
+                # Bounds at the stored precision, so a value equal to an inclusive bound is kept
+                low, high = (None if bound is None else np.float32(bound) for bound in (low, high))
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+        positions = np.flatnonzero(keep)
+        if isinstance(rows, slice):
+            return positions + rows.start
+        return rows[positions]
+
+    def column(self, name, aa_chi=None, pdb_id=None, where=None):
+        '''
+        Returns
+            the values of one column for the rows of select(aa_chi, pdb_id, where):
+            float with NaN for numeric columns, a Categorical for categorical ones.
+        '''
+        return self.decode(name, self.array(name)[self.select(aa_chi, pdb_id, where)])
+
+    def decode(self, name, values):
+        kind = self.kinds[name]
+        if kind == 'category':
+            return pd.Categorical.from_codes(np.asarray(values), categories=pd.Index(self.labels(name), dtype=str))
+        if kind == 'int32':
+            values = np.asarray(values)
+            return pd.arrays.IntegerArray(values, values == INT_MISSING)
+        return np.asarray(values)
+
+    def rows(self, aa_chi=None, pdb_id=None, where=None, columns=None):
+        '''
+        Arguments:
+            aa_chi, pdb_id, where: selection, see select
+            columns (list of str): columns to return {default: all}
+        Returns
+            dataframe of the selected rows, in database order (AA_CHI, then pdb_id).
+        '''
+        rows = self.select(aa_chi, pdb_id, where)
+        return pd.DataFrame({name: self.decode(name, self.array(name)[rows]) for name in (columns or self.columns)})
+
+    def histogram(self, name, aa_chi=None, pdb_id=None, where=None, bins=50, range=None):
+        '''
+        Arguments:
+            name (str): numeric column, e.g. 'E' or 'ΔE'
+            aa_chi, pdb_id, where: selection, see select
+            bins (int or array): number of bins or bin edges {default: 50}
+            range (tuple): (low, high) of the bins {default: the selected values' range}
+        Returns
+            (counts, edges) as np.histogram, NaN values left out.
+        '''
+        values = np.asarray(self.array(name)[self.select(aa_chi, pdb_id, where)], dtype=float)
+        return np.histogram(values[~np.isnan(values)], bins=bins, range=range)
+
+    def counts(self, name=INDEX_COLUMNS[0]):
+        # Number of rows per label of an indexed column
+        offsets = np.load(self.path('offsets', name), mmap_mode='r')
+        return pd.Series(np.diff(offsets), index=self.labels(name), name='rows')
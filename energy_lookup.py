@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+
+# Reasons recorded for angles that do not receive an energy
+NO_POTENTIAL = 'no_potential'
+NAN_ANGLE = 'nan_angle'
+OUT_OF_RANGE = 'out_of_range'
+BIN_GAP = 'bin_gap'
+
+
+# Sorted bin edges of one AA_CHI energy table, built once and reused for every lookup
+class BinnedEnergyTable:
+    def __init__(self, bin_min, bin_max, energy, right_inclusive=False):
+        '''
+        Arguments:
+            bin_min (array-like): lower edge of every bin
+            bin_max (array-like): upper edge of every bin
+            energy (array-like): E value of every bin
+            right_inclusive (bool): if True, bins are bin min < angle <= bin max,
+                as in get_energy_from_stats; otherwise both edges are excluded {default: False}
+        '''
+        bin_min = np.asarray(bin_min, dtype=float)
+        bin_max = np.asarray(bin_max, dtype=float)
+        energy = np.asarray(energy, dtype=float)
+        order = np.argsort(bin_min, kind='stable')
+        self.bin_min = bin_min[order]
+        self.bin_max = bin_max[order]
+        self.energy = energy[order]
+        self.right_inclusive = right_inclusive
+
+        # A searchsorted lookup only finds the first matching bin when bins do not overlap
+        if np.any(self.bin_min[1:] < self.bin_max[:-1]):
+            raise ValueError('Energy bins overlap; cannot build a sorted lookup table')
+
+    @classmethod
+    def from_frame(cls, chi_bins, right_inclusive=False):
+        # Build from a potential DataFrame with 'bin min', 'bin max' and 'E' columns
+        return cls(chi_bins['bin min'].to_numpy(), chi_bins['bin max'].to_numpy(), chi_bins['E'].to_numpy(), right_inclusive)
+
+    def __len__(self):
+        return len(self.bin_min)
+
+    def bin_index(self, angles):
+        '''
+        Arguments:
+            angles (array-like): angles to place into bins
+        Returns
+            integer array with the matching bin for every angle, or -1 when the
+            angle lies outside every bin (bin min < angle < bin max, as in process_chi_data,
+            or bin min < angle <= bin max when right_inclusive).
+        '''
+        angles = np.asarray(angles, dtype=float)
+        if len(self) == 0:
+            return np.full(angles.shape, -1, dtype=np.intp)
+
+        # Last bin whose lower edge is strictly below the angle
+        idx = np.searchsorted(self.bin_min, angles, side='left') - 1
+        safe_idx = np.clip(idx, 0, None)
+        upper = self.bin_max[safe_idx]
+        inside = angles <= upper if self.right_inclusive else angles < upper
+        matched = (idx >= 0) & inside
+        return np.where(matched, idx, -1)
+
+    def lookup(self, angles):
+        '''
+        Arguments:
+            angles (array-like): angles to assign energies to
+        Returns
+            (energy, matched): float array of E values (NaN where unmatched) and
+            the boolean mask of angles that fell inside a bin.
+        '''
+        idx = self.bin_index(angles)
+        matched = idx >= 0
+        energy = np.full(idx.shape, np.nan)
+        energy[matched] = self.energy[idx[matched]]
+        return energy, matched
+
+    def unmatched_reason(self, angles):
+        # Classify every angle that does not fall inside a bin; matched angles get None
+        angles = np.asarray(angles, dtype=float)
+        reason = np.full(angles.shape, None, dtype=object)
+        matched = self.bin_index(angles) >= 0
+        if len(self) == 0:
+            reason[:] = NO_POTENTIAL
+            return reason
+        outside = (angles <= self.bin_min[0]) | (angles >= self.bin_max[-1])
+        reason[~matched] = BIN_GAP
+        reason[~matched & outside] = OUT_OF_RANGE
+        reason[np.isnan(angles)] = NAN_ANGLE
+        return reason
+
+
+# Build one lookup table per AA_CHI key from the combined energy_bin DataFrame
+def build_energy_tables(energy_bin):
+    return {aa_chi: BinnedEnergyTable.from_frame(group) for aa_chi, group in energy_bin.groupby('AA_CHI', sort=False)}
+
+
+# AA_CHI key of every row, e.g. ARG_CHI1, built from residue_type and chi_angle.
+# Keys are formatted once per distinct pair and returned as a categorical.
+def aa_chi_keys(df):
+    residue_codes, residue_types = pd.factorize(df['residue_type'])
+    chi_codes, chi_angles = pd.factorize(df['chi_angle'])
+    n_chi = max(len(chi_angles), 1)
+    combined = np.where((residue_codes < 0) | (chi_codes < 0), -1, residue_codes * n_chi + chi_codes)
+    codes, pairs = pd.factorize(combined, use_na_sentinel=False)
+    labels = [f"{residue_types[pair // n_chi]}_{str(chi_angles[pair % n_chi]).upper()}" if pair >= 0 else None for pair in pairs]
+    categories = pd.Index(sorted({label for label in labels if label is not None}), dtype=str)
+    label_codes = categories.get_indexer(labels)
+    return pd.Series(pd.Categorical.from_codes(label_codes[codes], categories=categories), index=df.index)
+
+
+# Look up energies for rows that each carry their own AA_CHI key
+def lookup_energies(aa_chi, angles, tables):
+    '''
+    Arguments:
+        aa_chi (array-like): AA_CHI key of every angle
+        angles (array-like): angles to assign energies to
+        tables (dict): BinnedEnergyTable per AA_CHI key
+    Returns
+        (energy, matched) as in BinnedEnergyTable.lookup; keys without a table are unmatched.
+    '''
+    # Group on integer codes (free for categorical keys) rather than on the strings
+    codes, keys = pd.factorize(aa_chi)
+    angles = np.asarray(angles, dtype=float)
+    energy = np.full(angles.shape, np.nan)
+    matched = np.zeros(angles.shape, dtype=bool)
+    for code, idx in pd.Series(codes).groupby(codes, sort=False).indices.items():
+        if code >= 0 and keys[code] in tables:
+            energy[idx], matched[idx] = tables[keys[code]].lookup(angles[idx])
+    return energy, matched
+
+
+# Function to process chi data
+def process_chi_data(chi_data, chi_bins, return_unmatched=False):
+    '''
+    Vectorised replacement for the per-row loop: assigns E to every angle in
+    chi_data in a single batched lookup.
+
+    Arguments:
+        chi_data (pandas dataframe): rotamer rows with an 'angle' column
+        chi_bins (pandas dataframe or table): potential for this AA_CHI, or any
+            object with lookup() and unmatched_reason() such as BinnedEnergyTable
+        return_unmatched (bool): if True, also return the rows that did not land
+            in any bin, with a 'reason' column {default: False}
+    Returns
+        matched rows with an 'E' column (index reset), and optionally the unmatched rows.
+    '''
+    table = chi_bins if hasattr(chi_bins, 'lookup') else BinnedEnergyTable.from_frame(chi_bins)
+    angles = chi_data['angle'].to_numpy(dtype=float)
+    energy, matched = table.lookup(angles)
+
+    final_results = chi_data.loc[matched].copy()
+    final_results['E'] = energy[matched]
+    final_results = final_results.reset_index(drop=True)
+    if not return_unmatched:
+        return final_results
+
+    unmatched = chi_data.loc[~matched].copy()
+    unmatched['reason'] = table.unmatched_reason(angles[~matched])
+    return final_results, unmatched.reset_index(drop=True)
+
+
+# Assign energies to every residue type / chi angle in a combined rotamer DataFrame
+def score_rotamers(rotamer_df, energy_bin, progress=None):
+    '''
+    Arguments:
+        rotamer_df (pandas dataframe): normalised rotamer rows with residue_type,
+            chi_angle ('chi1'..'chi4') and angle columns
+        energy_bin (pandas dataframe or dict): combined potentials with an AA_CHI
+            column, or a dict of BinnedEnergyTable keyed by AA_CHI
+        progress (callable): optional wrapper for the residue type iterator, e.g. tqdm
+    Returns
+        (scored, unmatched): rows with E and AA_CHI columns, and the rows that did
+        not receive an energy with AA_CHI and reason columns.
+    '''
+    tables = energy_bin if isinstance(energy_bin, dict) else build_energy_tables(energy_bin)
+    empty_table = BinnedEnergyTable([], [], [])
+
+    process_list = []
+    unmatched_list = []
+    residue_groups = rotamer_df.groupby('residue_type', sort=False, observed=True)
+    if progress is not None:
+        residue_groups = progress(residue_groups)
+
+    # Same grouping order as the original nested loop: residue type, then chi angle
+    for amino_acid, temp_df in residue_groups:
+        for chi_angle, temp_df2 in temp_df.groupby('chi_angle', sort=False, observed=True):
+            if isinstance(chi_angle, str) and 'chi' in chi_angle:
+                energy_bins = f"{amino_acid}_{chi_angle.upper()}"
+                table = tables.get(energy_bins, empty_table)
+                process, unmatched = process_chi_data(temp_df2, table, return_unmatched=True)
+                process['AA_CHI'] = energy_bins
+                unmatched['AA_CHI'] = energy_bins
+                process_list.append(process)
+                unmatched_list.append(unmatched)
+
+    if not process_list:
+        return pd.DataFrame(), pd.DataFrame()
+    scored = pd.concat(process_list, ignore_index=True)
+    unmatched = pd.concat(unmatched_list, ignore_index=True)
+    # Compact output: AA_CHI as categorical codes, E as float32
+    scored['AA_CHI'] = scored['AA_CHI'].astype('category')
+    scored['E'] = scored['E'].astype(np.float32)
+    unmatched['AA_CHI'] = unmatched['AA_CHI'].astype('category')
+    return scored, unmatched
+
+
+# Summarise unmatched rows as counts per AA_CHI and reason
+def summarize_unmatched(unmatched):
+    if unmatched.empty:
+        return pd.DataFrame(columns=['AA_CHI', 'reason', 'count'])
+    return unmatched.groupby(['AA_CHI', 'reason'], sort=True).size().reset_index(name='count')
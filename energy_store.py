@@ -0,0 +1,256 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from energy_lookup import BinnedEnergyTable
+
+# Bump when the layout of the compiled store changes
+STORE_VERSION = 2
+
+# Columns kept from every <AA>_CHI<n>.csv table
+STORE_COLUMNS = ['bin min', 'bin max', 'bin mid', 'E']
+
+
+# Check whether an archive member or file name is one of the AA_CHI energy tables
+def is_energy_csv(name):
+    base = os.path.basename(name)
+    # Skip macOS resource forks stored alongside the tables
+    return base.endswith('.csv') and not base.startswith('._') and not name.startswith('__MACOSX')
+
+
+# Read the raw bytes of every energy table from a directory or a zip archive
+def read_energy_sources(source):
+    '''
+    Arguments:
+        source (str): backbone_independent_energy directory or .zip archive
+    Returns
+        dict of AA_CHI key -> raw CSV bytes, ordered by key.
+    '''
+    raw = {}
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in archive.namelist():
+                if is_energy_csv(name):
+                    raw[os.path.basename(name).split('.')[0]] = archive.read(name)
+    else:
+        for file_name in os.listdir(source):
+            if is_energy_csv(file_name):
+                with open(os.path.join(source, file_name), 'rb') as handle:
+                    raw[file_name.split('.')[0]] = handle.read()
+    if not raw:
+        raise FileNotFoundError(f"No energy CSV files found in {source}")
+    return dict(sorted(raw.items()))
+
+
+# Content hash of every table, and of the whole set of tables
+def hash_sources(raw):
+    table_hashes = {key: hashlib.sha256(data).hexdigest() for key, data in raw.items()}
+    combined = hashlib.sha256()
+    for key, digest in table_hashes.items():
+        combined.update(f"{key}:{digest}\n".encode())
+    return combined.hexdigest(), table_hashes
+
+
+# Size and modification time of every source file, checked before the far slower content hash
+def source_signature(source):
+    if zipfile.is_zipfile(source):
+        stats = [(os.path.basename(source), os.stat(source))]
+    else:
+        stats = [(entry.name, entry.stat()) for entry in os.scandir(source) if is_energy_csv(entry.name)]
+    return json.dumps(sorted([name, stat.st_size, stat.st_mtime_ns] for name, stat in stats))
+
+
+# Default location of the compiled store: the user cache directory, as the source directory
+# may be shared and read-only. The name includes a hash of the source path so sources never collide.
+def default_store_path(source):
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'knowledgebasedenergy')
+    name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    digest = hashlib.sha256(os.path.abspath(source).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{name}-{digest}.npz')
+
+
+# Potentials for every AA_CHI packed into contiguous arrays with an offset index
+class EnergyStore:
+    def __init__(self, keys, offsets, columns, source_hash, table_hashes, source_signature=None):
+        '''
+        Arguments:
+            keys (list of str): AA_CHI keys, in storage order
+            offsets (array): start of every table in the column arrays; offsets[-1]
+                is the total number of bins
+            columns (dict): column name -> contiguous float array over all tables
+            source_hash (str): hash over the contents of every source CSV
+            table_hashes (dict): AA_CHI key -> hash of that table's CSV
+            source_signature (str): sizes and mtimes of the source files the store was
+                last checked against, see source_signature {default: None}
+        '''
+        self.keys = list(keys)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.columns = columns
+        self.source_hash = source_hash
+        self.table_hashes = dict(table_hashes)
+        self.source_signature = source_signature
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self._tables = None
+
+    def __contains__(self, aa_chi):
+        return aa_chi in self.index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def slice(self, aa_chi):
+        # Row range of one AA_CHI table inside the column arrays
+        i = self.index[aa_chi]
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def table_frame(self, aa_chi):
+        # One AA_CHI table as a DataFrame with the original column names
+        rows = self.slice(aa_chi)
+        return pd.DataFrame({column: values[rows] for column, values in self.columns.items()})
+
+    @property
+    def tables(self):
+        # BinnedEnergyTable per AA_CHI key, built on first use
+        if self._tables is None:
+            self._tables = {}
+            for aa_chi in self.keys:
+                rows = self.slice(aa_chi)
+                self._tables[aa_chi] = BinnedEnergyTable(self.columns['bin min'][rows], self.columns['bin max'][rows], self.columns['E'][rows])
+        return self._tables
+
+    def frame(self):
+        # All tables combined with an AA_CHI column, as the scripts used to build energy_bin
+        energy_bin = pd.DataFrame(self.columns)
+        energy_bin['AA_CHI'] = np.repeat(self.keys, np.diff(self.offsets))
+        return energy_bin
+
+    @classmethod
+    def from_sources(cls, raw):
+        # Parse raw CSV bytes into the packed representation
+        source_hash, table_hashes = hash_sources(raw)
+        keys = []
+        offsets = [0]
+        parts = {column: [] for column in STORE_COLUMNS}
+        for aa_chi, data in raw.items():
+            df = pd.read_csv(io.BytesIO(data)).sort_values('bin min', kind='stable')
+            keys.append(aa_chi)
+            offsets.append(offsets[-1] + len(df))
+            for column in STORE_COLUMNS:
+                parts[column].append(df[column].to_numpy(dtype=np.float64))
+        columns = {column: np.ascontiguousarray(np.concatenate(values)) for column, values in parts.items()}
+        return cls(keys, offsets, columns, source_hash, table_hashes)
+
+    def save(self, path):
+        arrays = {f"col_{i}": values for i, values in enumerate(self.columns.values())}
+        np.savez(
+            path,
+            version=np.array(STORE_VERSION),
+            keys=np.array(self.keys),
+            offsets=self.offsets,
+            column_names=np.array(list(self.columns)),
+            source_hash=np.array(self.source_hash),
+            source_signature=np.array(self.source_signature or ''),
+            table_hash_values=np.array([self.table_hashes[key] for key in self.keys]),
+            **arrays,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != STORE_VERSION:
+                raise ValueError(f"{path} was written by an incompatible store version")
+            keys = data['keys'].tolist()
+            column_names = data['column_names'].tolist()
+            columns = {name: data[f"col_{i}"] for i, name in enumerate(column_names)}
+            table_hashes = dict(zip(keys, data['table_hash_values'].tolist()))
+            return cls(keys, data['offsets'], columns, str(data['source_hash']), table_hashes, str(data['source_signature']) or None)
+
+
+def compile_energy_store(source, store_path=None):
+    '''
+    Arguments:
+        source (str): backbone_independent_energy directory or .zip archive
+        store_path (str): where to write the compiled .npz {default: in the user cache, see default_store_path}
+    Returns
+        the compiled EnergyStore.
+    '''
+    signature = source_signature(source)
+    store = EnergyStore.from_sources(read_energy_sources(source))
+    store.source_signature = signature
+    save_store(store, store_path or default_store_path(source))
+    return store
+
+
+def save_store(store, path):
+    # Written under a temporary name unique to this call and renamed, so concurrent runs
+    # compiling the same store never write into one file or read a half-written store
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            store.save(out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_energy_store(source, store_path=None, verify=False):
+    '''
+    Load the compiled store for source. While the sizes and modification times of
+    the source files match those recorded in the store, the sources are not read
+    at all. Otherwise they are hashed, and the store is rebuilt when it is missing,
+    unreadable or its recorded content hash no longer matches them.
+
+    Arguments:
+        source (str): backbone_independent_energy directory or .zip archive
+        store_path (str): location of the compiled .npz {default: in the user cache, see default_store_path}
+        verify (bool): hash the sources even when their sizes and mtimes match {default: False}
+    Returns
+        EnergyStore.
+    '''
+    store_path = store_path or default_store_path(source)
+    signature = source_signature(source)
+
+    store = None
+    if os.path.exists(store_path):
+        try:
+            store = EnergyStore.load(store_path)
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"Rebuilding energy store {store_path}: {e}")
+    if store is not None and store.source_signature == signature and not verify:
+        return store
+
+    raw = read_energy_sources(source)
+    source_hash, _ = hash_sources(raw)
+    if store is None or store.source_hash != source_hash:
+        store = EnergyStore.from_sources(raw)
+    elif store.source_signature == signature:
+        return store
+    # Same contents with new mtimes (e.g. a fresh copy) only refresh the recorded signature
+    store.source_signature = signature
+    try:
+        save_store(store, store_path)
+    except OSError as e:
+        print(f"Could not write energy store {store_path}: {e}")
+    return store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compile the AA_CHI energy CSVs into a binary potential store.')
+    parser.add_argument('source', help='backbone_independent_energy directory or .zip archive')
+    parser.add_argument('-o', '--output', help='path of the compiled .npz store')
+    args = parser.parse_args()
+
+    store = compile_energy_store(args.source, args.output)
+    print(f"Compiled {len(store)} tables ({store.offsets[-1]} bins) to {args.output or default_store_path(args.source)}")
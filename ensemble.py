@@ -0,0 +1,131 @@
+import numpy as np
+
+from rotamer_io import fill_category
+
+# A residue (its insertion code included), and one conformer of it
+RESIDUE_KEYS = ['pdb_id', 'chain', 'residue', 'icode', 'residue_type']
+CONFORMER_KEYS = RESIDUE_KEYS + ['altloc']
+
+# kT in kcal/mol at 298 K
+KT = 0.593
+
+
+# Number of chi potentials of every residue type, e.g. {'ARG': 4, 'SER': 1}, from AA_CHI keys such as EnergyStore.keys
+def chi_counts(aa_chi_keys):
+    counts = {}
+    for aa_chi in aa_chi_keys:
+        residue_type = aa_chi.rsplit('_', 1)[0]
+        counts[residue_type] = counts.get(residue_type, 0) + 1
+    return counts
+
+
+def conformer_energies(scored, chi_counts=None):
+    '''
+    Arguments:
+        scored (pandas dataframe): scored rotamer rows (E column) with pdb_id, chain,
+            residue, icode, residue_type, altloc and optionally occupancy
+        chi_counts (dict): chi angles of a complete conformer per residue type, see
+            chi_counts; None treats every conformer as complete {default: None}
+    Returns
+        one row per conformer with E summed over its scored chi angles, the number
+        of chi angles scored (n_chi), its occupancy and whether all chi angles of its
+        residue type were scored (complete). Rows without an altloc are treated as
+        a single conformer.
+    '''
+    df = scored[RESIDUE_KEYS].copy()
+    # Energies are summed in float64 even when stored as float32
+    df['E'] = scored['E'].astype(float)
+    df['altloc'] = fill_category(scored['altloc'], '')
+    df['occupancy'] = scored['occupancy'].astype(float) if 'occupancy' in scored.columns else np.nan
+    conformers = df.groupby(CONFORMER_KEYS, sort=False, dropna=False, observed=True).agg(
+        E=('E', 'sum'),
+        n_chi=('E', 'size'),
+        occupancy=('occupancy', 'mean'),
+    ).reset_index()
+    if chi_counts is None:
+        conformers['complete'] = True
+    else:
+        # Residue types without potentials cannot be scored at all, so they never reach this point
+        expected = conformers['residue_type'].astype(object).map(chi_counts).fillna(0).to_numpy()
+        conformers['complete'] = conformers['n_chi'].to_numpy() >= expected
+    return conformers
+
+
+def residue_energies(scored, method='occupancy', kT=KT, chi_counts=None):
+    '''
+    Combine the conformers of every (pdb_id, chain, residue, icode) into one ensemble energy.
+
+    Arguments:
+        scored (pandas dataframe): scored rotamer rows, see conformer_energies
+        method (str): 'occupancy' for the occupancy-weighted mean of conformer
+            energies, or 'boltzmann' for -kT ln(sum w exp(-E/kT)) {default: 'occupancy'}
+        kT (float): thermal energy in kcal/mol for method='boltzmann' {default: 0.593}
+        chi_counts (dict): chi angles of a complete conformer per residue type; a
+            conformer with an unscored chi has a partial sum that is not comparable
+            with the others, so it is left out of the ensemble {default: None, all
+            conformers are used}
+    Returns
+        one row per residue with E_ensemble, E_min, E_max over its complete conformers,
+        the number of conformers (n_altlocs), of those left out (n_incomplete) and
+        the fewest chi angles scored in any conformer (n_chi). E_ensemble, E_min and
+        E_max are NaN when no conformer is complete. Occupancies are normalised
+        within each residue; residues with a missing occupancy weight their
+        conformers equally.
+    '''
+    conformers = conformer_energies(scored, chi_counts)
+    complete = conformers['complete'].to_numpy()
+    conformers['E_complete'] = conformers['E'].where(complete)
+    conformers['occupancy_complete'] = conformers['occupancy'].where(complete)
+    conformers['has_occupancy'] = conformers['occupancy'].notna() | ~complete
+    conformers['incomplete'] = ~complete
+    group = conformers.groupby(RESIDUE_KEYS, sort=False, dropna=False, observed=True)
+
+    # Weights over the complete conformers: normalised occupancy, or uniform when any occupancy is missing
+    n_complete = group['complete'].transform('sum')
+    has_occupancy = group['has_occupancy'].transform('all')
+    occupancy_sum = group['occupancy_complete'].transform('sum')
+    use_occupancy = has_occupancy & (occupancy_sum > 0)
+    weight = np.where(use_occupancy, conformers['occupancy'] / occupancy_sum.where(use_occupancy, 1), 1 / n_complete.where(n_complete > 0, 1))
+    weight = np.where(complete, weight, 0)
+
+    energy = conformers['E_complete'].to_numpy(dtype=float)
+    if method == 'occupancy':
+        conformers['weighted'] = np.where(complete, weight * energy, 0)
+    elif method == 'boltzmann':
+        # Shift by the lowest conformer energy so the exponentials cannot overflow
+        e_min = group['E_complete'].transform('min').to_numpy(dtype=float)
+        conformers['weighted'] = np.where(complete, weight * np.exp(-(energy - e_min) / kT), 0)
+    else:
+        raise ValueError(f"Unknown ensemble method {method!r}")
+
+    residues = conformers.groupby(RESIDUE_KEYS, sort=False, dropna=False, observed=True).agg(
+        E_ensemble=('weighted', 'sum'),
+        E_min=('E_complete', 'min'),
+        E_max=('E_complete', 'max'),
+        n_altlocs=('E', 'size'),
+        n_incomplete=('incomplete', 'sum'),
+        n_chi=('n_chi', 'min'),
+    ).reset_index()
+    if method == 'boltzmann':
+        residues['E_ensemble'] = residues['E_min'] - kT * np.log(residues['E_ensemble'].where(residues['E_ensemble'] > 0))
+    residues['E_ensemble'] = residues['E_ensemble'].where(residues['n_altlocs'] > residues['n_incomplete'])
+    return residues
+
+
+# Totals of the residue ensemble energies of every structure; residues without a complete conformer are counted in n_unscored
+def structure_energies(residues):
+    structures = residues.assign(multiconformer=residues['n_altlocs'] > 1, unscored=residues['E_ensemble'].isna()).groupby('pdb_id', sort=False, observed=True).agg(
+        E_total=('E_ensemble', 'sum'),
+        E_mean=('E_ensemble', 'mean'),
+        n_residues=('E_ensemble', 'count'),
+        n_multiconformer=('multiconformer', 'sum'),
+        n_unscored=('unscored', 'sum'),
+    )
+    return structures.reset_index()
+
+
+# Residue energies of a multiconformer model next to those of the single-conformer model
+def compare_residue_energies(qfit_residues, deposited_residues):
+    merged = qfit_residues.merge(deposited_residues, on=RESIDUE_KEYS, how='inner', suffixes=('_qFit', '_rotamers'))
+    merged['ΔE'] = merged['E_ensemble_rotamers'] - merged['E_ensemble_qFit']
+    return merged
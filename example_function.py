@@ -1,6 +1,16 @@
+from collections import namedtuple
+
+import numpy as np
+
+from energy_lookup import BinnedEnergyTable
+
+# Energies for an array of measurements, and which of them fell outside every bin
+EnergyStats = namedtuple('EnergyStats', ['energy', 'out_of_range'])
+
+
 def get_energy_from_stats(potential, measured, default_maximum=True,
                           set_maximum=None):
-    ‘’'
+    '''
     Arguments:
         potential (pandas dataframe): potential energy dataframe wih columns:
             bin min, bin max and E
@@ -12,17 +22,65 @@ def get_energy_from_stats(potential, measured, default_maximum=True,
             parameter is not found in any bins that the potential energy function covers.
     Returns
         energy value (kcal/mol).
-    ‘’'
+    '''
     if np.isnan(measured):
         return np.nan
-    dfE = potential.loc[(potential[‘bin min’] < measured)
-                        & (potential[‘bin max’] >= measured)]
+    dfE = potential.loc[(potential['bin min'] < measured)
+                        & (potential['bin max'] >= measured)]
     if len(dfE) == 0:
         if default_maximum:
-            return potential[‘E’].max()
+            return potential['E'].max()
         elif (not default_maximum) and set_maximum:
             return set_maximum
         else:
-            print(“Need to specify set_maximum if not using default maximum energy”)
+            print("Need to specify set_maximum if not using default maximum energy")
     else:
-        return dfE.iloc[0][‘E’]
+        return dfE.iloc[0]['E']
+
+
+# Potential prepared once for batch lookups: sorted bin edges and the cached maximum energy
+class StatsPotential:
+    def __init__(self, potential):
+        '''
+        Arguments:
+            potential (pandas dataframe): potential energy dataframe with columns:
+                bin min, bin max and E
+        '''
+        self.table = BinnedEnergyTable.from_frame(potential, right_inclusive=True)
+        self.maximum = potential['E'].max()
+
+
+def get_energy_from_stats_batch(potential, measured, default_maximum=True,
+                                set_maximum=None):
+    '''
+    Array version of get_energy_from_stats with the same maximum-energy rules.
+
+    Arguments:
+        potential (pandas dataframe or StatsPotential): potential energy with
+            columns bin min, bin max and E; pass a StatsPotential to reuse its
+            sorted bins and maximum across calls
+        measured (array-like): measured geometric parameters to get energies of
+        default_maximum (bool): if True, maximum energy is assigned to parameters
+            not found in any bin. If False, set_maximum is used {default: True}
+        set_maximum (float): energy assigned to parameters not found in any bin
+            when default_maximum is False
+    Returns
+        EnergyStats(energy, out_of_range): float array of energies (kcal/mol) and
+        a boolean mask of non-NaN parameters not found in any bin. NaN parameters
+        give NaN, as do misses when neither maximum option is set (where the
+        scalar function returns None).
+    '''
+    if not isinstance(potential, StatsPotential):
+        potential = StatsPotential(potential)
+    measured = np.asarray(measured, dtype=float)
+    energy, matched = potential.table.lookup(measured)
+    out_of_range = ~matched & ~np.isnan(measured)
+
+    if out_of_range.any():
+        if default_maximum:
+            energy[out_of_range] = potential.maximum
+        elif set_maximum:
+            energy[out_of_range] = set_maximum
+        else:
+            print("Need to specify set_maximum if not using default maximum energy")
+    return EnergyStats(energy, out_of_range)
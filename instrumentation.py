@@ -0,0 +1,158 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Resident set size of this process in bytes
+def current_rss():
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No /proc: fall back to the lifetime maximum
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+# Samples the RSS in a background thread while a block runs, keeping the maximum
+class PeakRSS:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, current_rss())
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+# Measurements of one pipeline stage; the stage code fills in rows_out, bytes_read, unmatched, ...
+# files_in replaces rows_in for stages that take files, and error is set when the stage raised
+class Stage:
+    def __init__(self, name, rows_in=None, **fields):
+        self.name = name
+        self.rows_in = rows_in
+        self.files_in = None
+        self.rows_out = None
+        self.bytes_read = None
+        self.unmatched = None
+        self.error = None
+        self.__dict__.update(fields)
+
+    def to_dict(self):
+        return {key: value for key, value in vars(self).items() if value is not None}
+
+
+class RunReport:
+    def __init__(self, enabled=True, profile_dir=None, trace_memory=False):
+        '''
+        Structured per-stage report of a pipeline run. When disabled, stage() only
+        hands out a Stage to fill in and measures nothing.
+
+        Arguments:
+            enabled (bool): measure the stages {default: True}
+            profile_dir (str): if given, dump a cProfile of every stage to
+                <profile_dir>/<n>_<stage>.prof {default: None}
+            trace_memory (bool): also record the tracemalloc peak and top allocation
+                sites of every stage; slows allocation-heavy stages {default: False}
+        '''
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.started = time.time()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **fields):
+        '''
+        Arguments:
+            name (str): stage name, e.g. 'ingest' or 'lookup'
+            rows_in (int): rows entering the stage {default: None}
+            fields: further values recorded with the stage, e.g. source=directory
+        Yields
+            the Stage, whose rows_out, bytes_read and unmatched the caller sets.
+        '''
+        stage = Stage(name, rows_in, **fields)
+        if not self.enabled:
+            yield stage
+            return
+
+        profiler = cProfile.Profile() if self.profile_dir else None
+        if self.trace_memory:
+            tracemalloc.start()
+        memory = PeakRSS()
+        try:
+            with memory:
+                start = time.perf_counter()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield stage
+                except BaseException as e:
+                    stage.error = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    stage.seconds = time.perf_counter() - start
+        finally:
+            # A failed stage is recorded too: it is the one the report is most needed for
+            self.finish_stage(stage, memory, profiler)
+
+    def finish_stage(self, stage, memory, profiler):
+        stage.peak_rss_bytes = memory.peak
+        stage.rss_increase_bytes = memory.peak - memory.start
+        if self.trace_memory:
+            stage.traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            stage.top_allocations = [f"{item.traceback[0].filename}:{item.traceback[0].lineno} {item.size}" for item in top]
+            tracemalloc.stop()
+        if profiler is not None:
+            stage.profile = os.path.join(self.profile_dir, f'{len(self.stages):02d}_{stage.name}.prof')
+            profiler.dump_stats(stage.profile)
+        self.stages.append(stage)
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'seconds': sum(stage.seconds for stage in self.stages),
+            'peak_rss_bytes': max((stage.peak_rss_bytes for stage in self.stages), default=current_rss()),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def summary(self):
+        # One line per stage: time, rows and peak RSS
+        lines = []
+        for stage in self.stages:
+            rows_in = stage.rows_in if stage.rows_in is not None else f"{stage.files_in} files" if stage.files_in is not None else '-'
+            rows = f"{rows_in} -> {stage.rows_out if stage.rows_out is not None else '-'}"
+            line = f"{stage.name:<12} {stage.seconds:8.3f}s rows {rows:<22} peak RSS {stage.peak_rss_bytes / 1e6:.0f} MB"
+            lines.append(line + (f" FAILED {stage.error}" if stage.error else ''))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.to_dict(), handle, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+# Shared disabled report, the default of every instrumented function
+NO_REPORT = RunReport(enabled=False)
@@ -0,0 +1,162 @@
+import numpy as np
+
+from energy_lookup import BIN_GAP, NAN_ANGLE, OUT_OF_RANGE
+
+# Widest gap between neighbouring bins, in bin widths, that the spline bridges; angles in wider gaps are unmatched
+MAX_GAP_BINS = 1.5
+
+
+# Periodic cubic spline through an energy profile sampled at the bin centres
+class PeriodicSplinePotential:
+    def __init__(self, knots, knot_values, period=360.0, max_gap=MAX_GAP_BINS):
+        '''
+        Arguments:
+            knots (array-like): angles of the knots in degrees (any range; wrapped into the period)
+            knot_values (array-like): energy at every knot; the spline passes through these values
+            period (float): period of the angle in degrees {default: 360}
+            max_gap (float): widest gap between neighbouring knots, in bin widths beyond the
+                usual knot spacing, that counts as covered; angles further from any knot are
+                unmatched {default: 1.5}
+        '''
+        self.period = float(period)
+        x = np.mod(np.asarray(knots, dtype=float), self.period)
+        y = np.asarray(knot_values, dtype=float)
+        if np.isnan(x).any() or np.isnan(y).any():
+            raise ValueError('Knots or knot values contain NaN')
+        # Knots that coincide once wrapped keep the first value
+        x, first = np.unique(x, return_index=True)
+        y = y[first]
+        n = len(x)
+        if n < 3:
+            raise ValueError('A periodic spline needs at least 3 knots')
+        self.knots = x
+        self.n_knots = n
+        # Width of segment i, from knot i to knot i + 1; the last one wraps to the first knot
+        h = np.append(np.diff(x), x[0] + self.period - x[-1])
+        self.widths = h
+
+        # Second derivatives M from the cyclic system h[i-1] M[i-1] + 2 (h[i-1] + h[i]) M[i] + h[i] M[i+1]
+        # = 6 ((y[i+1] - y[i]) / h[i] - (y[i] - y[i-1]) / h[i-1])
+        h_prev = np.roll(h, 1)
+        slope = (np.roll(y, -1) - y) / h
+        rows = np.arange(n)
+        system = np.zeros((n, n))
+        np.add.at(system, (rows, (rows - 1) % n), h_prev)
+        np.add.at(system, (rows, rows), 2 * (h_prev + h))
+        np.add.at(system, (rows, (rows + 1) % n), h)
+        M = np.linalg.solve(system, 6 * (slope - np.roll(slope, 1)))
+
+        # Per-segment polynomial a + b t + c t^2 + d t^3 in t = angle - knot
+        M_next = np.roll(M, -1)
+        self.coefficients = np.column_stack([
+            y,
+            slope - h * (2 * M + M_next) / 6,
+            M / 2,
+            (M_next - M) / (6 * h),
+        ])
+
+        # Segments up to one knot spacing plus max_gap bins wide are covered end to end; across wider
+        # ones only the half bin next to each knot is. The widest segment is outside the potential's range.
+        self.bin_width = float(np.median(h))
+        self.bridged = h <= self.bin_width * (1 + max_gap)
+        self.outside_segment = int(np.argmax(h)) if not self.bridged.all() else -1
+
+    @classmethod
+    def from_bins(cls, bin_mid, energy, period=360.0, max_gap=MAX_GAP_BINS):
+        '''
+        Arguments:
+            bin_mid (array-like): bin centres of the histogram potential (any range; wrapped into the period)
+            energy (array-like): E of every bin
+            period (float): period of the angle in degrees {default: 360}
+            max_gap (float): widest gap between bins, in bin widths, that is bridged {default: 1.5}
+        Returns
+            PeriodicSplinePotential through the energy at every bin centre.
+        '''
+        bin_mid = np.asarray(bin_mid, dtype=float)
+        energy = np.asarray(energy, dtype=float)
+        keep = ~(np.isnan(bin_mid) | np.isnan(energy))
+        return cls(bin_mid[keep], energy[keep], period, max_gap)
+
+    @classmethod
+    def from_frame(cls, chi_bins, period=360.0, max_gap=MAX_GAP_BINS):
+        # Build from a potential DataFrame with 'bin mid' and 'E' columns
+        return cls.from_bins(chi_bins['bin mid'].to_numpy(), chi_bins['E'].to_numpy(), period, max_gap)
+
+    def segment(self, angles):
+        '''
+        Arguments:
+            angles (array-like): angles in degrees, any range
+        Returns
+            (segment, t, nan): the spline segment of every angle, the offset in degrees from
+            the segment's first knot and the mask of NaN angles (placed in segment 0).
+        '''
+        angles = np.asarray(angles, dtype=float)
+        nan = np.isnan(angles)
+        wrapped = np.mod(np.where(nan, self.knots[0], angles), self.period)
+        segment = np.searchsorted(self.knots, wrapped, side='right') - 1
+        # Angles before the first knot belong to the segment wrapping round from the last one
+        before = segment < 0
+        segment[before] = self.n_knots - 1
+        t = wrapped - self.knots[segment]
+        t[before] += self.period
+        return segment, t, nan
+
+    def evaluate(self, angles):
+        '''
+        Arguments:
+            angles (array-like): angles in degrees, any range
+        Returns
+            (energy, gradient): E in kcal/mol and dE/dchi in kcal/mol per degree;
+            NaN where the angle is NaN. Angles outside the covered range (see
+            covered) still get the spline's value.
+        '''
+        segment, t, nan = self.segment(angles)
+        a, b, c, d = self.coefficients[segment].T
+        energy = a + t * (b + t * (c + t * d))
+        gradient = b + t * (2 * c + t * 3 * d)
+        energy[nan] = np.nan
+        gradient[nan] = np.nan
+        return energy, gradient
+
+    def covered(self, angles):
+        # Mask of the angles within the bins of the potential or a bridged gap between them
+        segment, t, nan = self.segment(angles)
+        near_knot = (t <= self.bin_width / 2) | (self.widths[segment] - t <= self.bin_width / 2)
+        return ~nan & (self.bridged[segment] | near_knot)
+
+    def __call__(self, angles):
+        return self.evaluate(angles)[0]
+
+    def lookup(self, angles):
+        # Same interface as BinnedEnergyTable.lookup, so the spline can be passed to score_rotamers
+        energy, _ = self.evaluate(angles)
+        matched = self.covered(angles)
+        energy[~matched] = np.nan
+        return energy, matched
+
+    def unmatched_reason(self, angles):
+        # Angles in the widest uncovered gap are out of range, in any other one in a bin gap
+        angles = np.asarray(angles, dtype=float)
+        reason = np.full(angles.shape, None, dtype=object)
+        segment, _, nan = self.segment(angles)
+        uncovered = ~self.covered(angles)
+        reason[uncovered] = BIN_GAP
+        reason[uncovered & (segment == self.outside_segment)] = OUT_OF_RANGE
+        reason[nan] = NAN_ANGLE
+        return reason
+
+
+def build_interpolated_potentials(energy_store, max_gap=MAX_GAP_BINS):
+    '''
+    Arguments:
+        energy_store (EnergyStore): compiled potentials
+        max_gap (float): widest gap between bins, in bin widths, that is bridged {default: 1.5}
+    Returns
+        dict of AA_CHI key -> PeriodicSplinePotential, usable wherever the
+        BinnedEnergyTable dict from EnergyStore.tables is.
+    '''
+    potentials = {}
+    for aa_chi in energy_store.keys:
+        rows = energy_store.slice(aa_chi)
+        potentials[aa_chi] = PeriodicSplinePotential.from_bins(energy_store.columns['bin mid'][rows], energy_store.columns['E'][rows], max_gap=max_gap)
+    return potentials
@@ -0,0 +1,463 @@
+import argparse
+import os
+import subprocess
+import sys
+
+from pipeline import DEFAULT_POTENTIALS, OUTPUT_FORMATS, QFIT_SUFFIX, ROTAMER_SUFFIX
+
+# Plot variant drawn by each subcommand
+PLOT_KIND = {'score': 'energy', 'compare-qfit': 'overlay', 'delta': 'delta', 'rescore': 'energy'}
+
+
+# Output path with the extension of the chosen format
+def with_format(path, fmt):
+    return os.path.splitext(path)[0] + '.' + fmt
+
+
+# Plotting libraries are only imported once a plot is actually requested
+def plot(data, kind, args, report=None):
+    from instrumentation import NO_REPORT
+    from plotting import render_plots
+    os.makedirs(args.plot_dir, exist_ok=True)
+    with (report or NO_REPORT).stage('plotting', len(data)) as stage:
+        paths = render_plots(data, kind, args.plot_dir, workers=args.workers)
+        stage.rows_out = len(paths)
+    print(f"Wrote {len(paths)} plots to {args.plot_dir}")
+
+
+# Run report of a scoring subcommand; a disabled one unless --report, --profile or --trace-memory is given
+def make_report(args):
+    from instrumentation import RunReport
+    return RunReport(enabled=bool(args.report or args.profile or args.trace_memory), profile_dir=args.profile, trace_memory=args.trace_memory)
+
+
+# Save the run report and print its per-stage summary
+def finish_report(report, args):
+    if not report.enabled:
+        return
+    print(report.summary())
+    if args.report:
+        report.save(args.report)
+
+
+# Load the potentials as a report stage
+def load_potentials(args, report):
+    from energy_store import load_energy_store
+    with report.stage('potentials', source=args.potentials) as stage:
+        energy_store = load_energy_store(args.potentials, verify=args.verify_potentials)
+        stage.rows_out = len(energy_store)
+    return energy_store
+
+
+# Write a table as a report stage
+def write_output(df, path, args, report):
+    from pipeline import write_table
+    path = with_format(path, args.format)
+    with report.stage('write', len(df), path=path):
+        write_table(df, path, args.format)
+
+
+# Build the memory-mapped energy database from a table or a saved CSV, if --database is given
+def write_database(data, args, report):
+    if not args.database:
+        return
+    from energy_database import build_database, build_database_from_table
+    with report.stage('database', None if isinstance(data, str) else len(data), path=args.database) as stage:
+        database = build_database_from_table(data, args.database) if isinstance(data, str) else build_database(data, args.database)
+        stage.rows_out = len(database)
+    print(f"Energy database {args.database}: {len(database)} rows")
+
+
+# Build the score store from a scored CSV of a streaming or sharded run, if --store is given
+def write_store_table(path, energy_store, args, report):
+    if not args.store:
+        return
+    from score_store import ScoreStore
+    with report.stage('store', path=args.store):
+        ScoreStore(args.store).write_table(path, energy_store)
+    print(f"Score store {args.store}: scored rows of {path} (streaming runs keep no unmatched rows)")
+
+
+# Print the unmatched-angle counts per AA_CHI and reason
+def report_unmatched(unmatched):
+    from energy_lookup import summarize_unmatched
+    print("Angles without an energy bin:", len(unmatched))
+    print(summarize_unmatched(unmatched).to_string(index=False))
+
+
+# Print the files that could not be parsed and list them next to the output in <output>.failed.csv
+def report_failed(failed, output):
+    from pipeline import failed_path, write_failed
+    write_failed(failed, failed_path(output))
+
+
+def run_score(args):
+    from pipeline import load_rotamers, score_deposited
+
+    report = make_report(args)
+    energy_store = load_potentials(args, report)
+    if args.stream:
+        from rotamer_io import list_rotamer_files
+        from streaming import stream_score
+
+        checkpoint = None
+        if args.checkpoint:
+            from checkpoint import BatchCheckpoint
+            checkpoint = BatchCheckpoint(args.checkpoint, {'energy_hash': energy_store.source_hash, 'files_per_chunk': args.files_per_chunk})
+        output = with_format(args.output, 'csv')
+        paths = list_rotamer_files(args.rotamers, args.suffix)
+        with report.stage('stream', source=args.rotamers, files_in=len(paths)) as stage:
+            aggregates, not_parsed = stream_score(paths, energy_store.tables, output, args.files_per_chunk, checkpoint=checkpoint, prefetch=args.prefetch)
+            aggregates.save(args.aggregates)
+            stage.rows_out = sum(aggregates.counts.values())
+            stage.unmatched = sum(aggregates.unmatched.values())
+            stage.failed = len(not_parsed)
+        report_failed(not_parsed, output)
+        print(aggregates.summary().to_string(index=False))
+        if os.path.exists(output):
+            write_database(output, args, report)
+            write_store_table(output, energy_store, args, report)
+        if args.plot_dir:
+            plot(aggregates.to_points(), PLOT_KIND[args.command], args, report)
+        finish_report(report, args)
+        return
+
+    from tqdm import tqdm
+    ingest = load_rotamers(args.rotamers, args.suffix, args.cache, args.workers, report)
+    report_failed(ingest.failed, args.output)
+    scored, unmatched = score_deposited(ingest.data, energy_store, args.backbone_dependent, progress=None if report.enabled else tqdm, report=report)
+    report_unmatched(unmatched)
+    write_output(scored, args.output, args, report)
+    write_database(scored, args, report)
+    if args.store:
+        from score_store import ScoreStore
+        with report.stage('store', len(scored) + len(unmatched), path=args.store):
+            ScoreStore(args.store).write(scored, unmatched, energy_store)
+    if args.plot_dir:
+        plot(scored, PLOT_KIND[args.command], args, report)
+    finish_report(report, args)
+
+
+def run_rescore(args):
+    from score_store import ScoreStore
+
+    report = make_report(args)
+    energy_store = load_potentials(args, report)
+    store = ScoreStore(args.store)
+    with report.stage('rescore', source=args.store) as stage:
+        diff = store.update(energy_store)
+        stage.rows_out = int(diff['n_rows'].sum())
+    if not diff.empty:
+        print(diff[['AA_CHI', 'n_rows', 'n_changed', 'mean_before', 'mean_after', 'mean_shift', 'max_abs_delta']].to_string(index=False))
+    if args.diff_report:
+        diff.to_csv(args.diff_report, index=False)
+
+    scored, unmatched = store.load()
+    write_output(scored, args.output, args, report)
+    write_database(scored, args, report)
+    if args.plot_dir:
+        plot(scored, PLOT_KIND[args.command], args, report)
+    finish_report(report, args)
+
+
+def run_compare_qfit(args):
+    import pandas as pd
+    from pipeline import compare_qfit, load_rotamers
+
+    report = make_report(args)
+    qfit = load_rotamers(args.qfit_rotamers, QFIT_SUFFIX, args.qfit_cache, args.workers, report)
+    deposited = load_rotamers(args.rotamers, ROTAMER_SUFFIX, args.rotamers_cache, args.workers, report)
+    report_failed(pd.concat([qfit.failed, deposited.failed], ignore_index=True), args.output)
+    energy_store = load_potentials(args, report)
+
+    scored, unmatched, residues, structures = compare_qfit(qfit.data, deposited.data, energy_store, args.method, report)
+    report_unmatched(unmatched)
+    write_output(scored, args.output, args, report)
+    write_database(scored, args, report)
+    write_output(residues, args.residue_output, args, report)
+    write_output(structures, args.structure_output, args, report)
+    if args.plot_dir:
+        plot(scored, PLOT_KIND[args.command], args, report)
+    finish_report(report, args)
+
+
+def run_delta(args):
+    import pandas as pd
+    from pipeline import delta_pairs, load_rotamers
+
+    report = make_report(args)
+    qfit = load_rotamers(args.qfit_rotamers, QFIT_SUFFIX, args.qfit_cache, args.workers, report)
+    deposited = load_rotamers(args.rotamers, ROTAMER_SUFFIX, args.rotamers_cache, args.workers, report)
+    report_failed(pd.concat([qfit.failed, deposited.failed], ignore_index=True), args.output)
+    energy_store = load_potentials(args, report)
+
+    subset_data = delta_pairs(qfit.data, deposited.data, energy_store, report)
+    write_output(subset_data, args.output, args, report)
+    write_database(subset_data, args, report)
+    if args.plot_dir:
+        plot(subset_data, PLOT_KIND[args.command], args, report)
+    finish_report(report, args)
+
+
+def run_rotamers(args):
+    from pipeline import assign_rotamers, load_rotamer_library, load_rotamers, write_table
+
+    report = make_report(args)
+    energy_store = load_potentials(args, report)
+    library = load_rotamer_library(energy_store, args.library)
+    print(f"Rotamer library: {len(library)} rotamers of {len(library.residues)} residue types")
+    if args.library_output:
+        write_table(library.frame, args.library_output)
+    if args.rotamers:
+        ingest = load_rotamers(args.rotamers, args.suffix, args.cache, args.workers, report)
+        report_failed(ingest.failed, args.output)
+        assigned = assign_rotamers(ingest.data, library, report)
+        print(f"Conformers: {len(assigned)}, without a rotamer: {assigned['rotamer'].isna().sum()}, outside every well: {(~assigned['in_well']).sum()}")
+        write_output(assigned, args.output, args, report)
+        write_database(assigned, args, report)
+    finish_report(report, args)
+
+
+def run_shard(args):
+    from sharding import slurm_shard
+
+    if args.local:
+        # Every shard in its own process, as the SLURM array tasks would run them
+        command = [sys.executable, os.path.abspath(__file__), 'shard', args.rotamers, '--out-dir', args.out_dir,
+                   '--suffix', args.suffix, '--files-per-chunk', str(args.files_per_chunk), '--potentials', args.potentials,
+                   '--n-shards', str(args.local), '--prefetch', str(args.prefetch)] + (['--resume'] if args.resume else [])
+        processes = [subprocess.Popen(command + ['--shard-index', str(i)]) for i in range(args.local)]
+        failed = [i for i, process in enumerate(processes) if process.wait() != 0]
+        if failed:
+            sys.exit(f"Shards failed: {failed}")
+        return
+
+    if args.n_shards is not None and args.shard_index is not None:
+        shard_index, n_shards = args.shard_index, args.n_shards
+    elif slurm_shard() is not None:
+        shard_index, n_shards = slurm_shard()
+    else:
+        sys.exit('Give --n-shards and --shard-index, --local, or run inside a SLURM array job')
+
+    from energy_store import load_energy_store
+    from rotamer_io import list_rotamer_files
+    from sharding import run_shard as score_shard
+
+    energy_store = load_energy_store(args.potentials)
+    record = score_shard(list_rotamer_files(args.rotamers, args.suffix), energy_store, args.out_dir, n_shards, shard_index, args.files_per_chunk, args.resume, args.prefetch)
+    print(f"Shard {shard_index + 1}/{n_shards}: {record['n_files']} files, {record['n_scored']} rows scored, {record['n_failed']} not parsed")
+
+
+def run_reduce(args):
+    from sharding import reduce_shards
+
+    aggregates, not_parsed = reduce_shards(args.out_dir, args.output, args.aggregates)
+    report_failed(not_parsed, args.output)
+    print(aggregates.summary().to_string(index=False))
+    if args.store and os.path.exists(args.output):
+        from energy_store import load_energy_store
+        from instrumentation import NO_REPORT
+        write_store_table(args.output, load_energy_store(args.potentials), args, NO_REPORT)
+    if args.plot_dir:
+        plot(aggregates.to_points(), 'energy', args)
+
+
+def run_index(args):
+    from energy_database import build_database_from_table
+
+    database = build_database_from_table(args.input, args.database, args.chunksize)
+    print(f"Energy database {args.database}: {len(database)} rows, columns {', '.join(database.columns)}")
+
+
+# --where COL:LOW:HIGH (either bound may be empty) or COL=LABEL[,LABEL...] as an EnergyDatabase.select filter
+def parse_where(conditions):
+    where = {}
+    for condition in conditions or []:
+        if '=' in condition:
+            name, labels = condition.split('=', 1)
+            where[name] = labels.split(',')
+        else:
+            name, low, high = condition.split(':')
+            where[name] = (float(low) if low else None, float(high) if high else None)
+    return where
+
+
+def run_query(args):
+    import pandas as pd
+    from energy_database import EnergyDatabase
+
+    database = EnergyDatabase(args.database)
+    where = parse_where(args.where)
+    unknown = [name for name in list(where) + (args.columns or []) + [args.histogram] if name and name not in database.columns]
+    if unknown:
+        sys.exit(f"No column {', '.join(unknown)} in {args.database}; columns: {', '.join(database.columns)}")
+    if args.histogram:
+        counts, edges = database.histogram(args.histogram, args.aa_chi, args.pdb_id, where, bins=args.bins)
+        print(pd.DataFrame({'low': edges[:-1], 'high': edges[1:], 'count': counts}).to_string(index=False))
+        return
+    rows = database.rows(args.aa_chi, args.pdb_id, where, args.columns)
+    print(f"Rows: {len(rows)}")
+    if args.output:
+        from pipeline import write_table
+        write_table(rows, args.output)
+    else:
+        print(rows.head(args.head).to_string(index=False))
+
+
+def run_plot(args):
+    if args.input.endswith('.npz'):
+        from streaming import ScoreAggregates
+        data = ScoreAggregates.load(args.input).to_points()
+    else:
+        from pipeline import read_table
+        data = read_table(args.input)
+    plot(data, args.kind, args)
+
+
+# Options shared by the subcommands that score rotamer tables
+def add_common_arguments(parser, output, plots=True):
+    parser.add_argument('--potentials', default=DEFAULT_POTENTIALS, help='backbone-independent energy directory or .zip {default: the bundled zip}')
+    parser.add_argument('--verify-potentials', action='store_true', help='hash the potential CSVs even when their sizes and mtimes match the compiled store')
+    parser.add_argument('--workers', type=int, help='parsing and plotting processes {default: all cores}')
+    parser.add_argument('-o', '--output', default=output, help=f'scored table {{default: {output}}}')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv', help='format of the output tables {default: csv}')
+    if plots:
+        parser.add_argument('--plot-dir', help='also draw the plots into this directory')
+    parser.add_argument('--database', metavar='DIR', help='also persist the output as a memory-mapped energy database for query')
+    parser.add_argument('--report', metavar='JSON', help='write a per-stage run report (time, rows, bytes, peak RSS, unmatched)')
+    parser.add_argument('--profile', metavar='DIR', help='dump a cProfile of every stage into DIR (enables the report)')
+    parser.add_argument('--trace-memory', action='store_true', help='record tracemalloc peaks and top allocations per stage (enables the report)')
+
+
+# Options of the subcommands that pair qFit altlocs with the deposited model
+def add_pair_arguments(parser):
+    parser.add_argument('qfit_rotamers', help='directory of *_qFit_rotamers_output.csv files')
+    parser.add_argument('rotamers', help='directory of *_rotamers_output.csv files')
+    parser.add_argument('--qfit-cache', help='Parquet cache of the qFit tables')
+    parser.add_argument('--rotamers-cache', help='Parquet cache of the deposited tables')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Knowledge-based energies of rotamer chi angles.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    score = subparsers.add_parser('score', help='assign energies to the chi angles of a directory of rotamer tables')
+    score.add_argument('rotamers', help='directory of rotamer CSV files')
+    score.add_argument('--suffix', default='.csv', help='file name suffix of the rotamer tables {default: .csv}')
+    score.add_argument('--cache', help='Parquet cache of the normalised tables')
+    score.add_argument('--backbone-dependent', help='directory or .zip of backbone-dependent (phi/psi/chi) potentials')
+    score.add_argument('--stream', action='store_true', help='score files in chunks and write results incrementally (csv only)')
+    score.add_argument('--files-per-chunk', type=int, default=256)
+    score.add_argument('--prefetch', type=int, default=2, help='in streaming mode, chunks read ahead while the current one is scored; 0 reads sequentially {default: 2}')
+    score.add_argument('--checkpoint', metavar='DIR', help='in streaming mode, save every chunk here and resume from the chunks already done')
+    score.add_argument('--aggregates', default='E_rotamer_assignment_aggregates.npz', help='aggregates written in streaming mode')
+    score.add_argument('--store', metavar='DIR', help='also keep the scored rows in a score store that rescore can update incrementally')
+    add_common_arguments(score, 'E_rotamer_assignment_scored.csv')
+    score.set_defaults(func=run_score)
+
+    rescore = subparsers.add_parser('rescore', help='rescore the AA_CHI keys of a score store whose potentials changed')
+    rescore.add_argument('store', help='score store written by score --store')
+    rescore.add_argument('--diff-report', metavar='CSV', help='write how the energy distribution of every rescored AA_CHI moved')
+    add_common_arguments(rescore, 'E_rotamer_assignment_scored.csv')
+    rescore.set_defaults(func=run_rescore)
+
+    compare = subparsers.add_parser('compare-qfit', help='score qFit altlocs next to the deposited rotamers')
+    add_pair_arguments(compare)
+    compare.add_argument('--method', choices=['occupancy', 'boltzmann'], default='occupancy', help='ensemble weighting {default: occupancy}')
+    compare.add_argument('--residue-output', default='qFit_ensemble_residue_energy.csv')
+    compare.add_argument('--structure-output', default='qFit_ensemble_structure_energy.csv')
+    add_common_arguments(compare, 'qFit_knowledge_based_energy_scored.csv')
+    compare.set_defaults(func=run_compare_qfit)
+
+    delta = subparsers.add_parser('delta', help='ΔE and Δangle between qFit altlocs and the deposited rotamers')
+    add_pair_arguments(delta)
+    add_common_arguments(delta, 'E_vs_angle_knowledge_based_energy.csv')
+    delta.set_defaults(func=run_delta)
+
+    rotamers = subparsers.add_parser('rotamers', help='label every conformer with its nearest library rotamer and that rotamer\'s energy')
+    rotamers.add_argument('rotamers', nargs='?', help='directory of rotamer CSV files; omit to only build the library')
+    rotamers.add_argument('--suffix', default='.csv', help='file name suffix of the rotamer tables {default: .csv}')
+    rotamers.add_argument('--cache', help='Parquet cache of the normalised tables')
+    rotamers.add_argument('--library', help='.csv/.parquet rotamer library (residue_type, rotamer, chi1..chi4, chi1_width..chi4_width) {default: derived from the potentials}')
+    rotamers.add_argument('--library-output', help='write the library with its per-rotamer energies here')
+    add_common_arguments(rotamers, 'rotamer_assignment.csv', plots=False)
+    rotamers.set_defaults(func=run_rotamers)
+
+    shard = subparsers.add_parser('shard', help='score one shard of the rotamer files (streaming mode) into partial results')
+    shard.add_argument('rotamers', help='directory of rotamer CSV files')
+    shard.add_argument('--out-dir', required=True, help='directory of the partial results of all shards')
+    shard.add_argument('--n-shards', type=int, help='number of shards {default: SLURM_ARRAY_TASK_COUNT}')
+    shard.add_argument('--shard-index', type=int, help='shard to run {default: SLURM_ARRAY_TASK_ID - SLURM_ARRAY_TASK_MIN}')
+    shard.add_argument('--local', type=int, metavar='N', help='run all N shards here as subprocesses')
+    shard.add_argument('--suffix', default='.csv', help='file name suffix of the rotamer tables {default: .csv}')
+    shard.add_argument('--files-per-chunk', type=int, default=256)
+    shard.add_argument('--prefetch', type=int, default=2, help='chunks read ahead while the current one is scored; 0 reads sequentially {default: 2}')
+    shard.add_argument('--resume', action='store_true', help='checkpoint every chunk and reuse the chunks a killed earlier attempt completed')
+    shard.add_argument('--potentials', default=DEFAULT_POTENTIALS, help='backbone-independent energy directory or .zip {default: the bundled zip}')
+    shard.set_defaults(func=run_shard)
+
+    reduce = subparsers.add_parser('reduce', help='combine the partial results of all shards')
+    reduce.add_argument('out_dir', help='directory the shards wrote to')
+    reduce.add_argument('-o', '--output', default='E_rotamer_assignment_scored.csv', help='scored rows {default: E_rotamer_assignment_scored.csv}')
+    reduce.add_argument('--aggregates', default='E_rotamer_assignment_aggregates.npz')
+    reduce.add_argument('--store', metavar='DIR', help='also keep the scored rows in a score store that rescore can update incrementally')
+    reduce.add_argument('--potentials', default=DEFAULT_POTENTIALS, help='potentials the shards were scored with, for --store {default: the bundled zip}')
+    reduce.add_argument('--plot-dir', help='also draw the plots into this directory')
+    reduce.add_argument('--workers', type=int, help='plotting processes {default: all cores}')
+    reduce.set_defaults(func=run_reduce)
+
+    index = subparsers.add_parser('index', help='build an energy database from a saved scored table')
+    index.add_argument('input', help='scored .csv/.parquet table')
+    index.add_argument('database', help='database directory to write')
+    index.add_argument('--chunksize', type=int, default=1000000, help='CSV rows read at a time {default: 1000000}')
+    index.set_defaults(func=run_index)
+
+    query = subparsers.add_parser('query', help='select rows or a histogram from an energy database')
+    query.add_argument('database', help='database directory written by index or --database')
+    query.add_argument('--aa-chi', help='only rows of this AA_CHI key, e.g. ARG_CHI3')
+    query.add_argument('--pdb-id', help='only rows of this structure')
+    query.add_argument('--where', action='append', metavar='COND', help='COL:LOW:HIGH (inclusive, either bound may be empty) or COL=LABEL[,LABEL...]; repeatable')
+    query.add_argument('--columns', nargs='+', help='columns to return {default: all}')
+    query.add_argument('--histogram', metavar='COL', help='print the histogram of this numeric column instead of rows')
+    query.add_argument('--bins', type=int, default=50, help='histogram bins {default: 50}')
+    query.add_argument('--head', type=int, default=20, help='rows printed {default: 20}')
+    query.add_argument('-o', '--output', help='write the selected rows to this .csv/.parquet instead of printing them')
+    query.set_defaults(func=run_query)
+
+    plot_parser = subparsers.add_parser('plot', help='draw the plots from a saved table or aggregates .npz')
+    plot_parser.add_argument('input', help='scored .csv/.parquet table or streaming aggregates .npz')
+    plot_parser.add_argument('--kind', choices=sorted(set(PLOT_KIND.values())), default='energy')
+    plot_parser.add_argument('--plot-dir', default='.', help='directory the plots are written to {default: .}')
+    plot_parser.add_argument('--workers', type=int, help='plotting processes {default: all cores}')
+    plot_parser.set_defaults(func=run_plot)
+    return parser
+
+
+# Reject score options that the chosen mode would otherwise silently ignore
+def check_score_arguments(parser, args):
+    if args.store and args.backbone_dependent:
+        parser.error('--store needs the backbone-independent score')
+    if args.stream:
+        ignored = [option for option, given in [
+            ('--backbone-dependent', args.backbone_dependent),
+            ('--cache', args.cache),
+            ('--format parquet', args.format == 'parquet'),
+            # In streaming mode the workers only draw the plots
+            ('--workers without --plot-dir', args.workers is not None and not args.plot_dir),
+        ] if given]
+        if ignored:
+            parser.error(f"--stream scores backbone-independent CSV in one process and does not support {', '.join(ignored)}")
+    elif args.checkpoint:
+        parser.error('--checkpoint needs --stream')
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'score':
+        check_score_arguments(parser, args)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
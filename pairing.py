@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+from energy_lookup import aa_chi_keys, lookup_energies
+from rotamer_io import unify_categories
+
+# A qFit altloc and its deposited counterpart share these keys; icode keeps 52 and 52A apart
+PAIR_KEYS = ['pdb_id', 'chain', 'residue', 'icode', 'chi_angle']
+
+# Columns carried from each side into the pair table
+PAIR_COLUMNS = PAIR_KEYS + ['residue_type', 'angle', 'altloc']
+
+
+# Hash index over the pairing keys of a rotamer table
+def pair_index(df):
+    return pd.MultiIndex.from_frame(df[PAIR_KEYS])
+
+
+# Signed minimum angular distance b - a, wrapped into [-180, 180)
+def angular_difference(a, b):
+    return (np.asarray(b, dtype=float) - np.asarray(a, dtype=float) + 180) % 360 - 180
+
+
+def paired_rows(qfit_df, deposited_df):
+    '''
+    Arguments:
+        qfit_df (pandas dataframe): normalised qFit rotamer rows with pdb_id and altloc
+        deposited_df (pandas dataframe): normalised deposited rotamer rows with pdb_id
+    Returns
+        (qfit_rows, deposited_rows): the qFit altloc rows that have a deposited
+        counterpart on (pdb_id, chain, residue, icode, chi_angle), and the deposited rows
+        that have at least one such altloc.
+    '''
+    qfit = qfit_df[qfit_df['altloc'].notna()]
+    qfit_index = pair_index(qfit)
+    deposited_index = pair_index(deposited_df)
+    qfit_rows = qfit[qfit_index.isin(deposited_index)]
+    deposited_rows = deposited_df[deposited_index.isin(qfit_index)]
+    return qfit_rows, deposited_rows
+
+
+def pair_altlocs(qfit_df, deposited_df):
+    '''
+    Join every qFit altloc to its deposited counterpart in a single hash join on
+    (pdb_id, chain, residue, icode, chi_angle).
+
+    Arguments:
+        qfit_df (pandas dataframe): normalised qFit rotamer rows with pdb_id and altloc
+        deposited_df (pandas dataframe): normalised deposited rotamer rows with pdb_id
+    Returns
+        one row per (qFit altloc, deposited row) pair with the key columns,
+        residue_type, AA_CHI and angle/altloc suffixed _qFit and _rotamers.
+    '''
+    qfit = qfit_df.loc[qfit_df['altloc'].notna(), PAIR_COLUMNS]
+    deposited = deposited_df[PAIR_COLUMNS]
+    # Shared categories, so the join compares integer codes
+    categorical = [column for column in PAIR_KEYS + ['residue_type'] if isinstance(qfit[column].dtype, pd.CategoricalDtype) or isinstance(deposited[column].dtype, pd.CategoricalDtype)]
+    qfit, deposited = unify_categories([qfit, deposited], categorical)
+    pairs = qfit.merge(deposited, on=PAIR_KEYS + ['residue_type'], how='inner', suffixes=('_qFit', '_rotamers'))
+    pairs = pairs[pairs['chi_angle'].astype('category').str.contains('chi').fillna(False).astype(bool)]
+    pairs['AA_CHI'] = aa_chi_keys(pairs)
+    return pairs.reset_index(drop=True)
+
+
+def score_pairs(pairs, tables):
+    '''
+    Arguments:
+        pairs (pandas dataframe): output of pair_altlocs
+        tables (dict): BinnedEnergyTable per AA_CHI key
+    Returns
+        the pairs where both angles fall inside an energy bin, with E_qFit,
+        E_rotamers, ΔE (E_rotamers - E_qFit) and Δangle (signed minimum angular
+        distance from the qFit to the deposited angle, across the 0/360 wrap).
+    '''
+    keys = pairs['AA_CHI']
+    energy_qfit, matched_qfit = lookup_energies(keys, pairs['angle_qFit'], tables)
+    energy_rotamers, matched_rotamers = lookup_energies(keys, pairs['angle_rotamers'], tables)
+    matched = matched_qfit & matched_rotamers
+
+    scored = pairs.loc[matched].copy()
+    scored['E_qFit'] = energy_qfit[matched].astype(np.float32)
+    scored['E_rotamers'] = energy_rotamers[matched].astype(np.float32)
+    scored['ΔE'] = (energy_rotamers[matched] - energy_qfit[matched]).astype(np.float32)
+    scored['Δangle'] = angular_difference(scored['angle_qFit'], scored['angle_rotamers']).astype(np.float32)
+    return scored.reset_index(drop=True)
@@ -0,0 +1,232 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from energy_lookup import score_rotamers
+from ensemble import chi_counts, compare_residue_energies, residue_energies, structure_energies
+from instrumentation import NO_REPORT
+from pairing import pair_altlocs, paired_rows, score_pairs
+from rotamer_cache import load_cached_rotamers
+from rotamer_io import concat_rotamers, fill_category, list_rotamer_files, load_rotamer_files
+
+# Energy potentials shipped with the repository
+DEFAULT_POTENTIALS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backbone_independent_energy.zip')
+
+# File name suffixes of the deposited and qFit rotamer tables
+ROTAMER_SUFFIX = 'rotamers_output.csv'
+QFIT_SUFFIX = 'qFit_rotamers_output.csv'
+
+# Table formats the scored output can be written in
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+# Columns of the ΔE vs Δangle table
+DELTA_COLUMNS = ['pdb_id', 'chain', 'residue', 'icode', 'residue_type', 'chi_angle', 'altloc_qFit', 'AA_CHI', 'ΔE', 'Δangle']
+
+
+# Table format of a path from its extension, csv unless it ends in .parquet
+def table_format(path):
+    return 'parquet' if path.endswith('.parquet') else 'csv'
+
+
+def write_table(df, path, fmt=None):
+    '''
+    Arguments:
+        df (pandas dataframe): table to write
+        path (str): output file
+        fmt (str): 'csv' or 'parquet' {default: from the file extension}
+    '''
+    fmt = fmt or table_format(path)
+    if fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    elif fmt == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f"Unknown output format {fmt!r}")
+
+
+# Read a table written by write_table
+def read_table(path):
+    if table_format(path) == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+# Failed-files list written next to an output table, e.g. scored.csv -> scored.failed.csv
+def failed_path(output_path):
+    return os.path.splitext(output_path)[0] + '.failed.csv'
+
+
+def write_failed(failed, path, n_shown=5):
+    '''
+    Print how many rotamer files could not be parsed, with the first reasons, and
+    write every (file, reason) pair to a CSV. The CSV is written even when nothing
+    failed, so a rerun never leaves the list of an earlier run behind.
+
+    Arguments:
+        failed (pandas dataframe): file and reason columns, e.g. IngestResult.failed
+        path (str): CSV the failed files are written to
+        n_shown (int): reasons printed {default: 5}
+    '''
+    print("Not parsed:", len(failed))
+    for row in failed.head(n_shown).itertuples(index=False):
+        print(f"  {row.file}: {row.reason}")
+    if len(failed) > n_shown:
+        print(f"  ... {len(failed) - n_shown} more in {path}")
+    failed.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+# Categorical column holding one value on every row
+def constant_category(value, n_rows):
+    return pd.Categorical.from_codes(np.zeros(n_rows, dtype=np.int8), categories=[value])
+
+
+# <residue><icode>_<altloc> label of every row, e.g. 52A_B, formatted once per distinct combination
+def residue_altloc_labels(df):
+    residue_codes, residues = pd.factorize(df['residue'], use_na_sentinel=False)
+    icode_codes, icodes = pd.factorize(fill_category(df['icode'], ''))
+    altloc_codes, altlocs = pd.factorize(fill_category(df['altloc'], ''))
+    codes, combinations = pd.factorize((residue_codes * len(icodes) + icode_codes) * len(altlocs) + altloc_codes)
+    labels = pd.Index([f"{residues[combination // len(altlocs) // len(icodes)]}{icodes[combination // len(altlocs) % len(icodes)]}_{altlocs[combination % len(altlocs)]}"
+                       for combination in combinations], dtype=str)
+    categories = labels.unique()
+    return pd.Categorical.from_codes(categories.get_indexer(labels)[codes], categories=categories)
+
+
+def load_rotamers(directory, suffix='.csv', cache_dir=None, workers=None, report=NO_REPORT):
+    '''
+    Arguments:
+        directory (str): directory of per-PDB rotamer CSVs
+        suffix (str): file name suffix of the tables to read {default: '.csv'}
+        cache_dir (str): Parquet cache to read through; None parses every file {default: None}
+        workers (int): parsing processes {default: os.cpu_count()}
+        report (RunReport): records the 'ingest' stage {default: disabled}
+    Returns
+        IngestResult with the normalised rows and the files that could not be parsed.
+    '''
+    with report.stage('ingest', source=directory) as stage:
+        paths = list_rotamer_files(directory, suffix)
+        if cache_dir:
+            ingest = load_cached_rotamers(paths, cache_dir, workers=workers)
+        else:
+            ingest = load_rotamer_files(paths, workers=workers)
+        stage.files_in = ingest.n_files
+        stage.rows_out = len(ingest.data)
+        stage.bytes_read = ingest.n_bytes
+        stage.failed = len(ingest.failed)
+    return ingest
+
+
+def score_deposited(rotamer_df, energy_store, backbone_dependent=None, progress=None, report=NO_REPORT):
+    '''
+    Arguments:
+        rotamer_df (pandas dataframe): normalised rotamer rows
+        energy_store (EnergyStore): backbone-independent potentials
+        backbone_dependent (str): directory or .zip of backbone-dependent potentials,
+            scored first with the backbone-independent tables as fallback {default: None}
+        progress (callable): optional wrapper for the residue type iterator, e.g. tqdm
+        report (RunReport): records the 'lookup' stage {default: disabled}
+    Returns
+        (scored, unmatched) as in score_rotamers.
+    '''
+    with report.stage('lookup', len(rotamer_df)) as stage:
+        if backbone_dependent:
+            from backbone_dependent import load_backbone_dependent_tables, score_rotamers_backbone
+            grids = load_backbone_dependent_tables(backbone_dependent)
+            scored, unmatched = score_rotamers_backbone(rotamer_df, grids, energy_store.tables)
+        else:
+            scored, unmatched = score_rotamers(rotamer_df, energy_store.tables, progress=progress)
+        stage.rows_out = len(scored)
+        stage.unmatched = len(unmatched)
+    return scored, unmatched
+
+
+def compare_qfit(qfit_df, deposited_df, energy_store, method='occupancy', report=NO_REPORT):
+    '''
+    Score the qFit altlocs and their deposited counterparts side by side.
+
+    Arguments:
+        qfit_df (pandas dataframe): normalised qFit rotamer rows
+        deposited_df (pandas dataframe): normalised deposited rotamer rows
+        energy_store (EnergyStore): backbone-independent potentials
+        method (str): ensemble weighting, see residue_energies {default: 'occupancy'}
+        report (RunReport): records the 'pairing', 'lookup' and 'ensemble' stages {default: disabled}
+    Returns
+        (scored, unmatched, residues, structures): scored rows of both models told
+        apart by source_file, the unmatched rows, and the qFit vs deposited ensemble
+        energies per residue and per structure.
+    '''
+    with report.stage('pairing', len(qfit_df) + len(deposited_df)) as stage:
+        # Keep only qFit altlocs and deposited rows that pair on (pdb_id, chain, residue, chi)
+        qfit_rows, deposited_rows = paired_rows(qfit_df, deposited_df)
+        qfit_rows = qfit_rows.assign(residue_altloc=residue_altloc_labels(qfit_rows), source_file=constant_category('qFit_rotamers_output', len(qfit_rows)))
+        deposited_rows = deposited_rows.assign(source_file=constant_category('rotamers_output', len(deposited_rows)))
+        combined = concat_rotamers([qfit_rows, deposited_rows])
+        stage.rows_out = len(combined)
+
+    with report.stage('lookup', len(combined)) as stage:
+        scored, unmatched = score_rotamers(combined, energy_store.tables)
+        stage.rows_out = len(scored)
+        stage.unmatched = len(unmatched)
+
+    with report.stage('ensemble', len(scored)) as stage:
+        counts = chi_counts(energy_store.keys)
+        qfit_residues = residue_energies(scored[scored['source_file'] == 'qFit_rotamers_output'], method, chi_counts=counts)
+        deposited_residues = residue_energies(scored[scored['source_file'] == 'rotamers_output'], method, chi_counts=counts)
+        residues = compare_residue_energies(qfit_residues, deposited_residues)
+        structures = structure_energies(qfit_residues).merge(structure_energies(deposited_residues), on='pdb_id', how='outer', suffixes=('_qFit', '_rotamers'))
+        stage.rows_out = len(residues)
+    return scored, unmatched, residues, structures
+
+
+def delta_pairs(qfit_df, deposited_df, energy_store, report=NO_REPORT):
+    '''
+    Arguments:
+        qfit_df (pandas dataframe): normalised qFit rotamer rows
+        deposited_df (pandas dataframe): normalised deposited rotamer rows
+        energy_store (EnergyStore): backbone-independent potentials
+        report (RunReport): records the 'pairing' and 'lookup' stages {default: disabled}
+    Returns
+        ΔE and Δangle of every scored (qFit altloc, deposited) pair, DELTA_COLUMNS only.
+    '''
+    with report.stage('pairing', len(qfit_df) + len(deposited_df)) as stage:
+        pairs = pair_altlocs(qfit_df, deposited_df)
+        stage.rows_out = len(pairs)
+    with report.stage('lookup', len(pairs)) as stage:
+        merged = score_pairs(pairs, energy_store.tables)
+        stage.rows_out = len(merged)
+        stage.unmatched = len(pairs) - len(merged)
+    print("Pairs:", len(pairs), "scored:", len(merged))
+    return merged[DELTA_COLUMNS]
+
+
+def load_rotamer_library(energy_store, path=None):
+    '''
+    Arguments:
+        energy_store (EnergyStore): potentials the rotamer energies are computed from
+        path (str): .csv/.parquet library with residue_type, rotamer, chi1..chi4 centres
+            and optional chi1_width..chi4_width {default: derive the library from the potentials}
+    Returns
+        RotamerLibrary with E_chi1..E_chi4 and the summed E of every rotamer.
+    '''
+    from rotamer_library import RotamerLibrary
+    if path:
+        return RotamerLibrary.from_frame(read_table(path), energy_store)
+    return RotamerLibrary.from_potentials(energy_store)
+
+
+def assign_rotamers(rotamer_df, library, report=NO_REPORT):
+    '''
+    Arguments:
+        rotamer_df (pandas dataframe): normalised rotamer rows
+        library (RotamerLibrary): rotamers to classify against
+        report (RunReport): records the 'rotamers' stage {default: disabled}
+    Returns
+        one row per conformer with its nearest rotamer and the rotamer energy, see RotamerLibrary.assign.
+    '''
+    with report.stage('rotamers', len(rotamer_df)) as stage:
+        assigned = library.assign(rotamer_df)
+        stage.rows_out = len(assigned)
+        stage.unmatched = int(assigned['rotamer'].isna().sum())
+    return assigned
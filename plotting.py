@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Above this many points in one figure, draw a hexbin density instead of a scatter
+DENSITY_THRESHOLD = 200000
+
+# Plot variants of the three scripts: column on x, column on y, output file name pattern
+PLOT_KINDS = {
+    'energy': ('angle', 'E', 'knowledge_based_energy{amino_acid}_{chi_angle}.png'),
+    'overlay': ('angle', 'E', 'qFit_knowledge_based_energy{amino_acid}_{chi_angle}.png'),
+    'delta': ('ΔE', 'Δangle', 'E_vs_angle_knowledge_based_energy_{amino_acid}_{chi_angle}.png'),
+}
+
+# Series of the overlay plot: source_file value and legend label, drawn in this order
+OVERLAY_SERIES = [('rotamers_output', 'Rotamers Output'), ('qFit_rotamers_output', 'qFit Rotamers Output')]
+
+
+def prepare_jobs(data, kind, output_dir='.', density_threshold=DENSITY_THRESHOLD):
+    '''
+    Group the points of every AA_CHI once into compact arrays, one job per figure.
+
+    Arguments:
+        data (pandas dataframe): rows with AA_CHI and the columns of the plot kind;
+            'overlay' also needs source_file. An optional count column weights the
+            points in density plots (e.g. ScoreAggregates.to_points()).
+        kind (str): 'energy', 'overlay' or 'delta'
+        output_dir (str): directory the figures are written to {default: '.'}
+        density_threshold (int): points above which a hexbin density is drawn
+    Returns
+        list of job dicts for render_job.
+    '''
+    x_column, y_column, file_pattern = PLOT_KINDS[kind]
+    jobs = []
+    for aa_chi, group in data.groupby('AA_CHI', sort=False, observed=True):
+        amino_acid, chi_angle = aa_chi.split('_')
+        chi_angle = chi_angle.replace('CHI', 'χ')
+        if kind == 'overlay':
+            sources = group['source_file'].to_numpy()
+            parts = [(label, group[sources == source]) for source, label in OVERLAY_SERIES]
+        else:
+            parts = [(None, group)]
+        series = [(label, part[x_column].to_numpy(np.float32), part[y_column].to_numpy(np.float32),
+                   part['count'].to_numpy(np.float32) if 'count' in part.columns else None) for label, part in parts]
+        jobs.append({
+            'kind': kind,
+            'amino_acid': amino_acid,
+            'chi_angle': chi_angle,
+            'series': series,
+            'density': len(group) > density_threshold,
+            'path': os.path.join(output_dir, file_pattern.format(amino_acid=amino_acid, chi_angle=chi_angle)),
+        })
+    return jobs
+
+
+# Draw one set of points as a scatter, or as a hexbin density for very large sets
+def draw_points(ax, x, y, weights, density, color, cmap, label, scatter_style):
+    if density:
+        ax.hexbin(x, y, C=weights, reduce_C_function=np.sum if weights is not None else np.mean,
+                  gridsize=120, bins='log', cmap=cmap, mincnt=1, alpha=0.8)
+        ax.scatter([], [], color=color, label=label)
+    else:
+        ax.scatter(x, y, color=color, label=label, **scatter_style)
+
+
+def render_job(job):
+    # Render one figure on the Agg backend and close it; runs inside a pool worker
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set(style='whitegrid', palette='muted')
+    amino_acid, chi_angle = job['amino_acid'], job['chi_angle']
+    density = job['density']
+
+    if job['kind'] == 'energy':
+        fig, ax = plt.subplots(figsize=(5, 3))
+        (_, x, y, weights), = job['series']
+        draw_points(ax, x, y, weights, density, 'dodgerblue', 'Blues', None, dict(s=100, edgecolor='w', alpha=0.8))
+        ax.set_title(f'Knowledge-based ΔE({amino_acid} {chi_angle})', fontsize=15, fontweight='bold', color='gray')
+        ax.set_xlabel(f"{amino_acid} {chi_angle}(°)", fontsize=14)
+        ax.set_ylabel('ΔE(kcal/mol)', fontsize=14)
+        ax.set_xlim(0, 360)
+        ax.set_xticks([0, 120, 240, 360])
+        ax.tick_params(labelsize=12)
+        ax.grid(True, linestyle='--', alpha=0.7)
+    elif job['kind'] == 'overlay':
+        fig, ax = plt.subplots(figsize=(10, 6))
+        palette = sns.color_palette('muted')
+        styles = {'Rotamers Output': (palette[3], 'Reds'), 'qFit Rotamers Output': (palette[0], 'Blues')}
+        for label, x, y, weights in job['series']:
+            color, cmap = styles[label]
+            draw_points(ax, x, y, weights, density, color, cmap, label, dict(s=100, edgecolor='gray', alpha=0.9))
+        ax.set_title(f'Knowledge-based ΔE ({amino_acid} {chi_angle})', fontsize=16, fontweight='bold')
+        ax.set_xlabel(f"{amino_acid} {chi_angle}(°)", fontsize=14, fontweight='bold')
+        ax.set_ylabel('ΔE (kcal/mol)', fontsize=14, fontweight='bold')
+        ax.set_xlim(0, 360)
+        ax.set_xticks([0, 120, 240, 360])
+        ax.tick_params(labelsize=12)
+        ax.grid(True, linestyle='--', alpha=0.5)
+        ax.legend(title='Source File', title_fontsize='13', fontsize='12', loc='upper right')
+    else:
+        fig, ax = plt.subplots(figsize=(6, 6))
+        (_, x, y, weights), = job['series']
+        draw_points(ax, x, y, weights, density, 'dodgerblue', 'Blues', None, dict(s=100, edgecolor='w', alpha=0.8))
+        ax.set_title(f'ΔE vs Δangle for {amino_acid} {chi_angle}', fontsize=15, fontweight='bold')
+        ax.set_xlabel('ΔE (kcal/mol)', fontsize=14)
+        ax.set_ylabel(f'{chi_angle} Δangle (°)', fontsize=14)
+        ax.tick_params(labelsize=12)
+        ax.grid(True, linestyle='--', alpha=0.7)
+
+    fig.tight_layout()
+    fig.savefig(job['path'])
+    plt.close(fig)
+    return job['path']
+
+
+def render_plots(data, kind, output_dir='.', workers=None, density_threshold=DENSITY_THRESHOLD):
+    '''
+    Arguments:
+        data (pandas dataframe): points to plot, see prepare_jobs
+        kind (str): 'energy' (E vs angle), 'overlay' (qFit vs deposited E vs angle)
+            or 'delta' (ΔE vs Δangle)
+        output_dir (str): directory the figures are written to {default: '.'}
+        workers (int): rendering processes; 1 renders in this process {default: os.cpu_count()}
+        density_threshold (int): points above which a hexbin density is drawn
+    Returns
+        list of the written figure paths.
+    '''
+    jobs = prepare_jobs(data, kind, output_dir, density_threshold)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        return [render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(render_job, jobs))
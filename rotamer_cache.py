@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from rotamer_io import COMPACT_DTYPES, IngestResult, chunked, compact_rotamers, normalize_rotamers, pdb_id_from_path, read_rotamer_file
+
+# Bump when the cached column layout changes; older caches are rebuilt from scratch
+CACHE_VERSION = 7
+MANIFEST_NAME = 'manifest.json'
+
+# Already-normalised columns stored in every partition, in the compact in-memory schema.
+# Angles are stored as float64, so a cached rescore bins edge angles exactly like the CSV path.
+CACHE_DTYPES = COMPACT_DTYPES
+
+
+# Cast normalised rotamer rows to the cached schema
+def to_cache_schema(df):
+    df = df[list(CACHE_DTYPES)].copy()
+    df['chi_angle'] = df['chi_angle'].astype(str)
+    return compact_rotamers(df)
+
+
+# Partition file of one source CSV, grouped by PDB ID
+def partition_path(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(f"pdb_id={pdb_id_from_path(path)}", f"{stem}.parquet")
+
+
+# Parse a batch of source files and write one partition each; runs inside a pool worker
+def build_partitions(items, cache_dir):
+    results = []
+    for path, partition in items:
+        target = os.path.join(cache_dir, partition)
+        try:
+            df = to_cache_schema(normalize_rotamers(read_rotamer_file(path)))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            df.to_parquet(target + '.tmp', index=False)
+            os.replace(target + '.tmp', target)
+            results.append((path, len(df), None))
+        except Exception as e:
+            # The file changed and no longer parses: its old partition must not be served again
+            remove_file(target)
+            remove_file(target + '.tmp')
+            results.append((path, 0, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME)) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != CACHE_VERSION:
+        return {}
+    return manifest['files']
+
+
+def write_manifest(cache_dir, files):
+    target = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(target + '.tmp', 'w') as handle:
+        json.dump({'version': CACHE_VERSION, 'files': files}, handle)
+    os.replace(target + '.tmp', target)
+
+
+def load_cached_rotamers(paths, cache_dir, workers=None, chunk_size=64, verbose=True):
+    '''
+    Load normalised rotamer rows from a Parquet cache partitioned by PDB ID, parsing
+    only the source files that are new or whose mtime or size changed since the
+    cache was written. Requires pyarrow.
+
+    Arguments:
+        paths (list of str): rotamer CSV files that make up the table
+        cache_dir (str): directory holding the partitions and manifest.json
+        workers (int): number of processes used to parse changed files {default: os.cpu_count()}
+        chunk_size (int): files parsed together by one worker {default: 64}
+        verbose (bool): print how many files were reused and reparsed {default: True}
+    Returns
+        IngestResult with the rows of every parsed file (in input file order) and
+        the files that could not be parsed.
+    '''
+    start = time.perf_counter()
+    paths = list(paths)
+    os.makedirs(cache_dir, exist_ok=True)
+    cached = read_manifest(cache_dir)
+    if not cached:
+        # Unknown or outdated cache layout: drop any old partitions
+        for entry in os.listdir(cache_dir):
+            if entry.startswith('pdb_id='):
+                shutil.rmtree(os.path.join(cache_dir, entry))
+
+    files = {}
+    stale = []
+    failed = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            # Listed but gone (or unreadable) by now; its partition is dropped below
+            failed.append((path, f"{type(e).__name__}: {e}"))
+            continue
+        entry = cached.get(path)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            files[path] = entry
+        else:
+            files[path] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'partition': partition_path(path), 'rows': None}
+            stale.append(path)
+
+    n_reused = len(files) - len(stale)
+
+    # Partitions of sources that no longer exist
+    for path, entry in cached.items():
+        if path not in files:
+            remove_file(os.path.join(cache_dir, entry['partition']))
+
+    # Parse new and modified files into their partitions
+    batches = chunked([(path, files[path]['partition']) for path in stale], max(1, chunk_size))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(batches) <= 1:
+        outcomes = [build_partitions(batch, cache_dir) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(build_partitions, batches, [cache_dir] * len(batches)))
+    for path, n_rows, error in (item for batch in outcomes for item in batch):
+        if error is None:
+            files[path]['rows'] = n_rows
+        else:
+            failed.append((path, error))
+            del files[path]
+    write_manifest(cache_dir, files)
+
+    # Read every partition back in columnar form, in input file order
+    partitions = [os.path.join(cache_dir, files[path]['partition']) for path in paths if path in files]
+    if partitions:
+        data = compact_rotamers(ds.dataset(partitions, format='parquet').to_table().to_pandas())
+    else:
+        data = to_cache_schema(pd.DataFrame(columns=list(CACHE_DTYPES)))
+    n_bytes = sum(files[path]['size'] for path in stale if path in files)
+
+    result = IngestResult(data, pd.DataFrame(failed, columns=['file', 'reason']), len(paths), n_bytes, time.perf_counter() - start)
+    if verbose:
+        print(f"Rotamer cache {cache_dir}: reused {n_reused} files, parsed {len(stale)}")
+        print(result.summary())
+    return result
@@ -0,0 +1,268 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+# Columns read from every per-PDB rotamer CSV and the dtypes they are parsed with.
+# altloc, occupancy and the backbone phi/psi angles are optional. Numeric columns are coerced in normalize_rotamers
+# so a stray value becomes NaN instead of failing the whole file.
+ROTAMER_DTYPES = {
+    'chain': str,
+    'residue': str,
+    'residue_name': str,
+    'nchi': str,
+    'rotamer_value': str,
+    'altloc': str,
+    'occupancy': str,
+    'phi': str,
+    'psi': str,
+}
+OPTIONAL_NUMERIC_COLUMNS = ['occupancy', 'phi', 'psi']
+REQUIRED_COLUMNS = ['chain', 'residue', 'residue_name', 'nchi', 'rotamer_value']
+
+# Renaming and chi labels applied by all of the scoring scripts
+RENAME_COLUMNS = {'residue_name': 'residue_type', 'rotamer_value': 'angle', 'nchi': 'chi_angle'}
+CHI_LABELS = {0: 'chi1', 1: 'chi2', 2: 'chi3', 3: 'chi4'}
+
+# Compact in-memory schema of normalised rows: the repeated labels and keys as categorical
+# codes, residue numbers as 32-bit integers and occupancies as float32. The chi and backbone
+# angles stay float64: they are compared against float64 bin edges, and float32 rounding
+# would move an angle lying exactly on an edge (e.g. 60.1 -> 60.0999985) into the bin below.
+COMPACT_DTYPES = {
+    'pdb_id': 'category',
+    'chain': 'category',
+    'residue': 'Int32',
+    'icode': 'category',
+    'residue_type': 'category',
+    'chi_angle': 'category',
+    'angle': 'float64',
+    'altloc': 'category',
+    'occupancy': 'float32',
+    'phi': 'float64',
+    'psi': 'float64',
+}
+
+# Column order of every normalised frame, whatever the columns and their order in the source file,
+# so chunks written one after another under a single header line up
+NORMALIZED_COLUMNS = list(COMPACT_DTYPES)
+
+
+# Residue number with an optional PDB insertion code, e.g. 52 or 52A
+RESIDUE_PATTERN = r'^\s*(-?\d+)\s*([A-Za-z]?)\s*$'
+
+
+# List the rotamer CSVs in a directory, optionally restricted to a file name suffix
+def list_rotamer_files(directory, suffix='.csv'):
+    return sorted(os.path.join(directory, item) for item in os.listdir(directory) if item.endswith(suffix))
+
+
+# PDB ID encoded at the start of the file name, e.g. 1abc_qFit_rotamers_output.csv
+def pdb_id_from_path(path):
+    return os.path.basename(path).split('_')[0].split('.')[0]
+
+
+# Read one rotamer CSV with the explicit schema
+def read_rotamer_file(path):
+    df = pd.read_csv(path, usecols=lambda column: column in ROTAMER_DTYPES, dtype=ROTAMER_DTYPES)
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"missing columns {missing}")
+    df['pdb_id'] = pdb_id_from_path(path)
+    return df
+
+
+def split_residue(values):
+    '''
+    Arguments:
+        values (pandas series): residue labels as read, e.g. '52' or '52A'
+    Returns
+        (residue, icode): the residue numbers (Int64, NA where unparseable) and
+        the insertion codes ('' when there is none). Parsed once per distinct label.
+    '''
+    codes, labels = pd.factorize(values)
+    parts = pd.Series(labels, dtype=object).astype(str).str.extract(RESIDUE_PATTERN)
+    numbers = pd.array(pd.to_numeric(parts[0], errors='coerce'), dtype='Int64')
+    icodes = np.append(parts[1].fillna('').to_numpy(dtype=object), '')
+    return pd.Series(numbers.take(codes, allow_fill=True), index=values.index), pd.Series(icodes[codes], index=values.index)
+
+
+def normalize_rotamers(df):
+    '''
+    Arguments:
+        df (pandas dataframe): raw rows as returned by read_rotamer_file
+    Returns
+        dataframe with residue_type, chi_angle ('chi1'..'chi4') and angle
+        (numeric, wrapped into 0-360) columns, as the scoring scripts expect.
+        Residue labels with an insertion code are split into residue and icode,
+        so 52 and 52A stay distinct residues. The columns come in NORMALIZED_COLUMNS
+        order, followed by any other columns of the input.
+    '''
+    df = df.rename(columns=RENAME_COLUMNS)
+    df['residue'], df['icode'] = split_residue(df['residue'])
+    df['angle'] = pd.to_numeric(df['angle'], errors='coerce') % 360
+    chi_index = pd.to_numeric(df['chi_angle'], errors='coerce')
+    df['chi_angle'] = chi_index.map(CHI_LABELS).astype(object).where(chi_index.isin(list(CHI_LABELS)), df['chi_angle'])
+    if 'altloc' not in df.columns:
+        df['altloc'] = np.nan
+    for column in OPTIONAL_NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce') if column in df.columns else np.nan
+    return df[NORMALIZED_COLUMNS + [column for column in df.columns if column not in NORMALIZED_COLUMNS]]
+
+
+# Cast normalised rows to the compact schema; columns not in it are left as they are
+def compact_rotamers(df):
+    df = df.astype({column: dtype for column, dtype in COMPACT_DTYPES.items() if column in df.columns})
+    for column, dtype in COMPACT_DTYPES.items():
+        # An all-missing column (e.g. altloc of a single-conformer model) gets string categories like the others
+        if dtype == 'category' and column in df.columns and len(df[column].cat.categories) == 0:
+            df[column] = df[column].astype(pd.CategoricalDtype(pd.Index([], dtype=str)))
+    return df
+
+
+def unify_categories(frames, columns=None):
+    '''
+    Give the categorical columns of several frames one shared, sorted set of
+    categories, so that concat and merge keep working on the integer codes
+    instead of falling back to object strings.
+
+    Arguments:
+        frames (list of pandas dataframe): frames to combine; a frame without one
+            of the columns gets it as all-missing
+        columns (list of str): columns to unify {default: every categorical column of the first frame}
+    Returns
+        list of the frames with recoded categorical columns.
+    '''
+    frames = list(frames)
+    if not frames:
+        return frames
+    if columns is None:
+        columns = [column for column, dtype in frames[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    for column in columns:
+        parts = []
+        for df in frames:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            parts.append(values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else pd.Index(values.dropna().unique()))
+        categories = parts[0].append(parts[1:]).unique()
+        try:
+            categories = categories.sort_values()
+        except TypeError:
+            pass
+        dtype = pd.CategoricalDtype(categories)
+        frames = [df.assign(**{column: df[column].astype(dtype) if column in df.columns else pd.Categorical.from_codes(np.full(len(df), -1, dtype=np.int8), dtype=dtype)}) for df in frames]
+    return frames
+
+
+# Concatenate compact frames without losing their categorical codes
+def concat_rotamers(frames):
+    return pd.concat(unify_categories(frames), ignore_index=True)
+
+
+# Replace missing values of a categorical column, adding the fill value as a category if needed
+def fill_category(values, fill_value):
+    values = values.astype('category')
+    if fill_value not in values.cat.categories:
+        values = values.cat.add_categories([fill_value])
+    return values.fillna(fill_value)
+
+
+# Read and normalise one batch of files; runs inside a pool worker
+def read_rotamer_batch(paths, compact=True):
+    dfs = []
+    failed = []
+    n_bytes = 0
+    for path in paths:
+        try:
+            dfs.append(read_rotamer_file(path))
+            n_bytes += os.path.getsize(path)
+        except Exception as e:
+            failed.append((path, f"{type(e).__name__}: {e}"))
+    batch = normalize_rotamers(pd.concat(dfs, ignore_index=True)) if dfs else None
+    if batch is not None and compact:
+        batch = compact_rotamers(batch)
+    return batch, failed, n_bytes
+
+
+# Combined rotamer rows plus a report of every file that could not be read
+class IngestResult:
+    def __init__(self, data, failed, n_files, n_bytes, seconds):
+        self.data = data
+        self.failed = failed
+        self.n_files = n_files
+        self.n_bytes = n_bytes
+        self.seconds = seconds
+
+    @property
+    def n_parsed(self):
+        return self.n_files - len(self.failed)
+
+    def summary(self):
+        rate = self.n_files / self.seconds if self.seconds else float('inf')
+        return (f"Read {self.n_parsed}/{self.n_files} files, {len(self.data)} rows, "
+                f"{self.n_bytes / 1e6:.1f} MB in {self.seconds:.1f}s ({rate:.0f} files/s); "
+                f"not parsed: {len(self.failed)}")
+
+
+def chunked(items, chunk_size):
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def load_rotamer_files(paths, workers=None, chunk_size=64, executor='process', log_every=50, verbose=True, compact=True):
+    '''
+    Arguments:
+        paths (list of str): rotamer CSV files to read
+        workers (int): number of pool workers; 1 reads in the calling process
+            {default: os.cpu_count()}
+        chunk_size (int): files read and normalised together by one worker {default: 64}
+        executor (str): 'process' or 'thread' pool {default: 'process'}
+        log_every (int): print throughput after this many completed batches {default: 50}
+        verbose (bool): print throughput and the final summary {default: True}
+        compact (bool): return the COMPACT_DTYPES schema instead of object strings
+            and float64 {default: True}
+    Returns
+        IngestResult with the normalised rows (in input file order) in .data and a
+        DataFrame of failed files with their reasons in .failed.
+    '''
+    paths = list(paths)
+    batches = chunked(paths, max(1, chunk_size))
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    results = [None] * len(batches)
+
+    def report(done, n_files):
+        if verbose and log_every and done % log_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"Ingested {n_files}/{len(paths)} files in {elapsed:.1f}s ({n_files / elapsed:.0f} files/s)")
+
+    n_files = 0
+    if workers == 1 or len(batches) <= 1:
+        for i, batch in enumerate(batches):
+            results[i] = read_rotamer_batch(batch, compact)
+            n_files += len(batch)
+            report(i + 1, n_files)
+    else:
+        pool_class = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            futures = {pool.submit(read_rotamer_batch, batch, compact): i for i, batch in enumerate(batches)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                results[i] = future.result()
+                n_files += len(batches[i])
+                report(done, n_files)
+
+    frames = [batch for batch, _, _ in results if batch is not None]
+    if frames:
+        data = concat_rotamers(frames) if compact else pd.concat(frames, ignore_index=True)
+    else:
+        data = normalize_rotamers(pd.DataFrame(columns=REQUIRED_COLUMNS + ['pdb_id']))
+        data = compact_rotamers(data) if compact else data
+    failed = pd.DataFrame([item for _, batch_failed, _ in results for item in batch_failed], columns=['file', 'reason'])
+    n_bytes = sum(n for _, _, n in results)
+
+    result = IngestResult(data, failed, len(paths), n_bytes, time.perf_counter() - start)
+    if verbose:
+        print(result.summary())
+    return result
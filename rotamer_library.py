@@ -0,0 +1,292 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from ensemble import CONFORMER_KEYS, RESIDUE_KEYS
+from rotamer_io import CHI_LABELS, fill_category
+
+# Chi angles of a rotamer, in order
+CHI_COLUMNS = list(CHI_LABELS.values())
+
+# Half-width in degrees of a library rotamer when the library does not give one
+DEFAULT_WIDTH = 30.0
+
+# Conventional names of the staggered sp3 wells: plus (60°), trans (180°) and minus (300°)
+STAGGERED_NAMES = {'p': 60.0, 't': 180.0, 'm': 300.0}
+
+
+# Absolute periodic difference of angles in degrees, in 0-180
+def periodic_difference(a, b):
+    difference = np.abs(np.asarray(a, dtype=float) - b) % 360
+    return np.minimum(difference, 360 - difference)
+
+
+# Angle wrapped into (-180, 180], as written in the rotamer output
+def signed_angle(angle):
+    return 180 - (180 - np.asarray(angle, dtype=float)) % 360
+
+
+# Name of one chi well: p, t or m near a staggered position, otherwise the signed centre, e.g. -85
+def well_name(centre, tolerance=20.0):
+    for name, position in STAGGERED_NAMES.items():
+        if periodic_difference(centre, position) <= tolerance:
+            return name
+    return f"{signed_angle(centre):+.0f}"
+
+
+# Energy of one potential at each angle, from the bin whose centre is periodically nearest
+def chi_energy(energy_store, aa_chi, angles):
+    rows = energy_store.slice(aa_chi)
+    bin_mid = energy_store.columns['bin mid'][rows]
+    energy = energy_store.columns['E'][rows]
+    nearest = periodic_difference(np.asarray(angles, dtype=float)[:, None], bin_mid[None, :]).argmin(axis=1)
+    return energy[nearest]
+
+
+def potential_wells(bin_mid, energy, smoothing=10.0, min_depth=0.5):
+    '''
+    Find the wells of one chi potential on a 1° periodic grid.
+
+    Arguments:
+        bin_mid (array-like): bin centres of the potential (any range; wrapped into 0-360)
+        energy (array-like): E of every bin
+        smoothing (float): standard deviation in degrees of the periodic Gaussian the
+            profile is smoothed with before looking for minima {default: 10}
+        min_depth (float): lowest barrier, in kcal/mol above the well bottom, on either
+            side of a well; the deepest well is always kept {default: 0.5}
+    Returns
+        (centres, widths): well centres in 0-360 and their half-widths, the distance
+        in degrees from the centre to the nearer barrier.
+    '''
+    bin_mid = np.asarray(bin_mid, dtype=float) % 360
+    energy = np.asarray(energy, dtype=float)
+    keep = ~np.isnan(energy)
+    order = np.argsort(bin_mid[keep])
+    grid = np.arange(360.0)
+    profile = np.interp(grid, bin_mid[keep][order], energy[keep][order], period=360)
+
+    distance = np.minimum(grid, 360 - grid)
+    kernel = np.exp(-0.5 * (distance / smoothing) ** 2)
+    profile = np.real(np.fft.ifft(np.fft.fft(profile) * np.fft.fft(kernel / kernel.sum())))
+
+    minima = np.flatnonzero((profile < np.roll(profile, 1)) & (profile <= np.roll(profile, -1)))
+    maxima = np.flatnonzero((profile > np.roll(profile, 1)) & (profile >= np.roll(profile, -1)))
+    if len(minima) == 0 or len(maxima) == 0:
+        # A flat profile: one well at its lowest point spanning the whole circle
+        return np.array([float(profile.argmin())]), np.array([180.0])
+
+    # Barriers on either side of every minimum, wrapping around the circle
+    right = np.searchsorted(maxima, minima) % len(maxima)
+    left = (right - 1) % len(maxima)
+    to_right = (maxima[right] - minima) % 360
+    to_left = (minima - maxima[left]) % 360
+    depth = np.minimum(profile[maxima[left]], profile[maxima[right]]) - profile[minima]
+    wells = (depth >= min_depth) | (np.arange(len(minima)) == profile[minima].argmin())
+    return minima[wells].astype(float), np.minimum(to_left, to_right)[wells].astype(float)
+
+
+# Every residue type with potentials, with its AA_CHI keys in chi order
+def residue_chi_keys(energy_store):
+    residues = {}
+    for aa_chi in energy_store.keys:
+        residue_type = aa_chi.rsplit('_', 1)[0]
+        residues.setdefault(residue_type, []).append(aa_chi)
+    return {residue_type: sorted(keys) for residue_type, keys in residues.items()}
+
+
+# Canonical rotamers of every residue type with their summed multi-chi energies
+class RotamerLibrary:
+    def __init__(self, frame):
+        '''
+        Arguments:
+            frame (pandas dataframe): one row per rotamer with residue_type, rotamer,
+                chi1..chi4 centres and, optionally, chi1_width..chi4_width half-widths
+                (missing widths are DEFAULT_WIDTH), E_chi1..E_chi4 and E. All rotamers
+                of a residue type must give the same chi angles, chi1 up to chi<n>;
+                otherwise ValueError is raised
+        '''
+        frame = frame.reset_index(drop=True).copy()
+        for column in CHI_COLUMNS:
+            if column not in frame.columns:
+                frame[column] = np.nan
+            if f'{column}_width' not in frame.columns:
+                frame[f'{column}_width'] = np.nan
+            frame[f'{column}_width'] = frame[f'{column}_width'].where(frame[column].isna(), frame[f'{column}_width'].fillna(DEFAULT_WIDTH))
+        frame['n_chi'] = frame[CHI_COLUMNS].notna().sum(axis=1)
+        self.frame = frame
+
+        # Centre, width and energy arrays per residue type for the nearest-rotamer search,
+        # and the periodic KD-tree over the centres, built on first use
+        self.residues = {}
+        self.trees = {}
+        for residue_type, rotamers in frame.groupby('residue_type', sort=True):
+            # Up to the last chi angle any rotamer of the type gives
+            n_chi = int(np.flatnonzero(rotamers[CHI_COLUMNS].notna().any(axis=0).to_numpy()).max(initial=-1)) + 1
+            chi = CHI_COLUMNS[:n_chi]
+            # A centre missing from one rotamer would put NaN into the KD-tree of the whole residue type
+            incomplete = rotamers[rotamers[chi].isna().any(axis=1)]
+            if len(incomplete):
+                raise ValueError(f"Every {residue_type} rotamer needs {', '.join(chi)}; missing in rotamers {incomplete['rotamer'].astype(str).tolist()}")
+            self.residues[residue_type] = (
+                rotamers['rotamer'].to_numpy(dtype=object),
+                rotamers[chi].to_numpy(dtype=float) % 360,
+                rotamers[[f'{column}_width' for column in chi]].to_numpy(dtype=float),
+                rotamers['E'].to_numpy(dtype=float) if 'E' in rotamers.columns else np.full(len(rotamers), np.nan),
+            )
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, residue_type):
+        return residue_type in self.residues
+
+    @classmethod
+    def from_frame(cls, frame, energy_store=None):
+        '''
+        Arguments:
+            frame (pandas dataframe): library table, see RotamerLibrary
+            energy_store (EnergyStore): if given, E_chi1..E_chi4 and E are recomputed
+                from these potentials at the rotamer centres {default: keep the table's}
+        Returns
+            RotamerLibrary.
+        '''
+        frame = frame.copy()
+        if energy_store is not None:
+            energy = np.zeros(len(frame))
+            for i, column in enumerate(CHI_COLUMNS):
+                if column not in frame.columns:
+                    continue
+                chi_energies = np.full(len(frame), np.nan)
+                centres = frame[column].to_numpy(dtype=float)
+                for residue_type, idx in frame.groupby('residue_type', sort=False).indices.items():
+                    aa_chi = f"{residue_type}_CHI{i + 1}"
+                    idx = idx[~np.isnan(centres[idx])]
+                    if aa_chi in energy_store and len(idx):
+                        chi_energies[idx] = chi_energy(energy_store, aa_chi, centres[idx])
+                frame[f'E_{column}'] = chi_energies
+                energy = energy + np.where(frame[column].isna(), 0, chi_energies)
+            frame['E'] = energy
+        return cls(frame)
+
+    @classmethod
+    def from_potentials(cls, energy_store, smoothing=10.0, min_depth=0.5):
+        '''
+        Derive a library from the potentials themselves: the wells of every chi
+        potential (see potential_wells), combined over the chi angles of each residue
+        type, with E the sum of the per-chi energies at the well centres.
+
+        Arguments:
+            energy_store (EnergyStore): backbone-independent potentials
+            smoothing (float): see potential_wells {default: 10}
+            min_depth (float): see potential_wells {default: 0.5}
+        Returns
+            RotamerLibrary named with p/t/m for staggered wells and the signed
+            centre otherwise, e.g. mt, m-85 or +24-31+25.
+        '''
+        rows = []
+        for residue_type, keys in residue_chi_keys(energy_store).items():
+            wells = []
+            for aa_chi in keys:
+                table = energy_store.slice(aa_chi)
+                centres, widths = potential_wells(energy_store.columns['bin mid'][table], energy_store.columns['E'][table], smoothing, min_depth)
+                wells.append(list(zip(centres, widths)))
+            for combination in itertools.product(*wells):
+                row = {'residue_type': residue_type, 'rotamer': ''.join(well_name(centre) for centre, _ in combination)}
+                for column, (centre, width) in zip(CHI_COLUMNS, combination):
+                    row[column] = float(signed_angle(centre))
+                    row[f'{column}_width'] = width
+                rows.append(row)
+        return cls.from_frame(pd.DataFrame(rows), energy_store)
+
+    def nearest(self, residue_type, chi):
+        '''
+        Arguments:
+            residue_type (str): residue type of every chi vector
+            chi (array): (n, n_chi) observed chi angles in degrees, any range
+        Returns
+            (index, deviation, in_well): index of the nearest rotamer by periodic
+            Euclidean distance (-1 where a chi angle is missing), the RMS deviation from
+            its centre in degrees, and whether every chi lies within the rotamer's width.
+        '''
+        from scipy.spatial import cKDTree
+
+        _, centres, widths, _ = self.residues[residue_type]
+        chi = np.asarray(chi, dtype=float)[:, :centres.shape[1]]
+        index = np.full(len(chi), -1, dtype=np.intp)
+        deviation = np.full(len(chi), np.nan)
+        in_well = np.zeros(len(chi), dtype=bool)
+        complete = np.flatnonzero(~np.isnan(chi).any(axis=1))
+        if len(complete) == 0:
+            return index, deviation, in_well
+
+        # KD-tree on the torus: boxsize makes every chi axis wrap at 360°
+        if residue_type not in self.trees:
+            self.trees[residue_type] = cKDTree(centres, boxsize=360.0)
+        _, best = self.trees[residue_type].query(chi[complete] % 360)
+        difference = periodic_difference(chi[complete], centres[best])
+        index[complete] = best
+        deviation[complete] = np.sqrt((difference ** 2).mean(axis=1))
+        in_well[complete] = (difference <= widths[best]).all(axis=1)
+        return index, deviation, in_well
+
+    def assign(self, rotamer_df):
+        '''
+        Label every conformer with its nearest library rotamer in one batched pass.
+
+        Arguments:
+            rotamer_df (pandas dataframe): normalised rotamer rows (residue_type,
+                chi_angle, angle and the CONFORMER_KEYS columns)
+        Returns
+            one row per conformer with chi1..chi4, rotamer, rotamer_deviation (RMS
+            degrees), in_well and E_rotamer (the library energy of the rotamer).
+            Residue types outside the library and conformers missing a chi angle
+            get no rotamer.
+        '''
+        conformers, chi = chi_vectors(rotamer_df)
+        rotamer = np.full(len(conformers), None, dtype=object)
+        deviation = np.full(len(conformers), np.nan)
+        in_well = np.zeros(len(conformers), dtype=bool)
+        energy = np.full(len(conformers), np.nan)
+
+        for residue_type, idx in conformers.groupby('residue_type', sort=False, observed=True).indices.items():
+            if residue_type not in self:
+                continue
+            names, _, _, energies = self.residues[residue_type]
+            index, deviation[idx], in_well[idx] = self.nearest(residue_type, chi[idx])
+            found = index >= 0
+            rotamer[idx[found]] = names[index[found]]
+            energy[idx[found]] = energies[index[found]]
+
+        for i, column in enumerate(CHI_COLUMNS):
+            conformers[column] = chi[:, i].astype(np.float32)
+        conformers['rotamer'] = pd.Categorical(rotamer)
+        conformers['rotamer_deviation'] = deviation.astype(np.float32)
+        conformers['in_well'] = in_well
+        conformers['E_rotamer'] = energy.astype(np.float32)
+        return conformers
+
+
+def chi_vectors(rotamer_df):
+    '''
+    Arguments:
+        rotamer_df (pandas dataframe): normalised rotamer rows, one per chi angle
+    Returns
+        (conformers, chi): the CONFORMER_KEYS of every conformer (missing altlocs as '')
+        in order of first appearance, and an (n, 4) array of its chi1..chi4 angles
+        with NaN where a chi angle is absent.
+    '''
+    keys = rotamer_df[RESIDUE_KEYS].assign(altloc=fill_category(rotamer_df['altloc'], ''))
+    conformer = keys.groupby(CONFORMER_KEYS, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    conformers = keys.drop_duplicates().reset_index(drop=True)
+
+    codes, labels = pd.factorize(rotamer_df['chi_angle'])
+    position = {label: i for i, label in CHI_LABELS.items()}
+    # Trailing -1 so that missing chi labels (code -1) map to -1
+    label_index = np.array([position.get(label, -1) for label in labels] + [-1], dtype=np.intp)
+    chi_index = label_index[codes]
+
+    chi = np.full((len(conformers), len(CHI_COLUMNS)), np.nan)
+    valid = (chi_index >= 0) & (conformer >= 0)
+    chi[conformer[valid], chi_index[valid]] = rotamer_df['angle'].to_numpy(dtype=float)[valid]
+    return conformers, chi
@@ -0,0 +1,267 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from energy_database import TEXT_COLUMNS
+from energy_lookup import BinnedEnergyTable
+from rotamer_io import concat_rotamers
+
+# Bump when the layout of the store changes
+SCORE_STORE_VERSION = 2
+
+# Partition of the rows without an AA_CHI key; they are kept but never rescored
+NO_KEY = '__no_aa_chi__'
+
+# Position of every row in the scoring output, so load returns the rows in their original order
+ORDER_COLUMN = 'store_row'
+
+# Columns of the diff report written by ScoreStore.update
+DIFF_COLUMNS = ['AA_CHI', 'residue_type', 'old_table_hash', 'new_table_hash', 'n_rows', 'n_scored_before', 'n_scored_after',
+                'n_changed', 'mean_before', 'mean_after', 'mean_shift', 'median_before', 'median_after', 'std_before', 'std_after',
+                'mean_abs_delta', 'max_abs_delta']
+
+
+# Scored rows partitioned by AA_CHI, each partition tagged with the hash of the potential that scored it
+class ScoreStore:
+    def __init__(self, directory):
+        '''
+        The store holds <AA_CHI>.parquet per key: every row of that key, scored
+        (E set, reason missing) or not (E NaN, reason set), with an E_table_hash
+        column naming the potential table that produced E and a store_row column
+        with its position in the scoring output. Rows without an AA_CHI go to
+        __no_aa_chi__.parquet. manifest.json, written last, lists the keys with
+        their table hash and row counts.
+
+        Arguments:
+            directory (str): store directory, created on the first write
+        '''
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def manifest(self):
+        with open(self.manifest_path) as handle:
+            manifest = json.load(handle)
+        if manifest.get('version') != SCORE_STORE_VERSION:
+            raise ValueError(f"{self.directory} was written by an incompatible score store version")
+        return manifest
+
+    def key_path(self, aa_chi):
+        return os.path.join(self.directory, f'{aa_chi}.parquet')
+
+    def read_key(self, aa_chi):
+        return pd.read_parquet(self.key_path(aa_chi))
+
+    def write_key(self, aa_chi, rows):
+        rows.to_parquet(self.key_path(aa_chi) + '.tmp', index=False)
+        os.replace(self.key_path(aa_chi) + '.tmp', self.key_path(aa_chi))
+
+    def save_manifest(self, keys, source_hash):
+        manifest = {'version': SCORE_STORE_VERSION, 'source_hash': source_hash, 'keys': keys}
+        with open(self.manifest_path + '.tmp', 'w') as handle:
+            json.dump(manifest, handle, indent=1, sort_keys=True)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def clear(self):
+        # Remove the partitions and manifest of an earlier write
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            keys = self.manifest()['keys']
+        except ValueError:
+            keys = [name[:-len('.parquet')] for name in os.listdir(self.directory) if name.endswith('.parquet')]
+        for aa_chi in keys:
+            if os.path.exists(self.key_path(aa_chi)):
+                os.remove(self.key_path(aa_chi))
+        os.remove(self.manifest_path)
+
+    def write(self, scored, unmatched, energy_store):
+        '''
+        Replace the store with the output of one scoring run.
+
+        Arguments:
+            scored, unmatched (pandas dataframe): output of score_rotamers
+            energy_store (EnergyStore): potentials the rows were scored with
+        '''
+        self.clear()
+        keys = {}
+        frames = [frame for frame in (scored.assign(reason=None), unmatched.assign(E=np.float32(np.nan))) if not frame.empty]
+        rows = concat_rotamers(frames) if frames else pd.DataFrame(columns=['AA_CHI'])
+        rows[ORDER_COLUMN] = np.arange(len(rows))
+        for aa_chi, key_rows in partitions(rows):
+            table_hash = energy_store.table_hashes.get(aa_chi)
+            key_rows = key_rows.assign(E_table_hash=pd.Categorical([table_hash] * len(key_rows)))
+            self.write_key(aa_chi, key_rows.reset_index(drop=True))
+            keys[aa_chi] = key_record(key_rows, table_hash)
+        self.save_manifest(keys, energy_store.source_hash)
+
+    def write_table(self, path, energy_store, chunksize=1000000):
+        '''
+        Replace the store with a scored CSV, e.g. the output of a streaming or
+        sharded run, read in chunks so the table never has to fit in memory.
+        Streaming runs do not keep their unmatched rows, so the store holds only
+        the scored rows: a rescore updates or unmatches them, but cannot score
+        angles that no bin covered at the time.
+
+        Arguments:
+            path (str): scored CSV with AA_CHI, angle and E columns
+            energy_store (EnergyStore): potentials the rows were scored with
+            chunksize (int): CSV rows read at a time {default: 1000000}
+        '''
+        self.clear()
+        header = pd.read_csv(path, nrows=0).columns
+        dtype = {column: str for column in TEXT_COLUMNS if column in header}
+        if 'residue' in header:
+            dtype['residue'] = 'Int32'
+
+        # One Parquet writer per key, all with the schema of their first chunk; the dtypes are pinned so it never changes
+        writers = {}
+        counts = {}
+        offset = 0
+        try:
+            # Exact float parsing: a rescore must see the same angles, down to the bin edges
+            for chunk in pd.read_csv(path, dtype=dtype, chunksize=chunksize, float_precision='round_trip'):
+                chunk = chunk.astype({column: float for column in chunk.columns if column not in dtype})
+                chunk['reason'] = pd.Series(np.nan, index=chunk.index, dtype=str)
+                chunk[ORDER_COLUMN] = np.arange(offset, offset + len(chunk))
+                offset += len(chunk)
+                for aa_chi, key_rows in partitions(chunk):
+                    table_hash = energy_store.table_hashes.get(aa_chi)
+                    key_rows = key_rows.assign(E_table_hash=pd.Series(table_hash, index=key_rows.index, dtype=str))
+                    table = pa.Table.from_pandas(key_rows, preserve_index=False)
+                    if aa_chi not in writers:
+                        writers[aa_chi] = pq.ParquetWriter(self.key_path(aa_chi) + '.tmp', table.schema)
+                    writers[aa_chi].write_table(table.cast(writers[aa_chi].schema))
+                    counts[aa_chi] = counts.get(aa_chi, 0) + len(key_rows)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        keys = {}
+        for aa_chi in writers:
+            os.replace(self.key_path(aa_chi) + '.tmp', self.key_path(aa_chi))
+            keys[aa_chi] = {'table_hash': energy_store.table_hashes.get(aa_chi), 'n_scored': counts[aa_chi], 'n_unmatched': 0}
+        self.save_manifest(keys, energy_store.source_hash)
+
+    def changed_keys(self, energy_store):
+        # Keys whose potential was added, removed or changed since their rows were scored
+        return sorted(aa_chi for aa_chi, record in self.manifest()['keys'].items()
+                      if aa_chi != NO_KEY and record['table_hash'] != energy_store.table_hashes.get(aa_chi))
+
+    def update(self, energy_store):
+        '''
+        Rescore only the keys whose potential table changed; every other partition
+        is reused as it is.
+
+        Arguments:
+            energy_store (EnergyStore): the new potentials
+        Returns
+            diff report with one row per rescored AA_CHI, see distribution_diff;
+            empty when no table changed.
+        '''
+        manifest = self.manifest()
+        keys = manifest['keys']
+        empty_table = BinnedEnergyTable([], [], [])
+        reports = []
+        for aa_chi in self.changed_keys(energy_store):
+            rows = self.read_key(aa_chi)
+            old_hash = keys[aa_chi]['table_hash']
+            new_hash = energy_store.table_hashes.get(aa_chi)
+            table = energy_store.tables.get(aa_chi, empty_table)
+
+            # Same lookup as score_rotamers, row by row in place so old and new E line up
+            angles = rows['angle'].to_numpy(dtype=float)
+            energy, matched = table.lookup(angles)
+            reason = np.full(len(rows), None, dtype=object)
+            reason[~matched] = table.unmatched_reason(angles[~matched])
+            updated = rows.assign(E=energy.astype(np.float32), reason=reason, E_table_hash=pd.Categorical([new_hash] * len(rows)))
+
+            reports.append(distribution_diff(aa_chi, rows, updated, old_hash, new_hash))
+            self.write_key(aa_chi, updated)
+            keys[aa_chi] = key_record(updated, new_hash)
+        self.save_manifest(keys, energy_store.source_hash)
+        print(f"Score store {self.directory}: rescored {len(reports)}/{len(keys)} AA_CHI keys")
+        return pd.DataFrame(reports, columns=DIFF_COLUMNS)
+
+    def load(self):
+        '''
+        Returns
+            (scored, unmatched) in the layout of score_rotamers, scored with an
+            E_table_hash column, each in the row order of the scoring output.
+        '''
+        keys = sorted(self.manifest()['keys'])
+        if not keys:
+            return pd.DataFrame(), pd.DataFrame()
+        rows = concat_rotamers([self.read_key(aa_chi) for aa_chi in keys])
+        rows = rows.sort_values(ORDER_COLUMN, kind='stable').drop(columns=ORDER_COLUMN)
+        matched = rows['reason'].isna().to_numpy()
+        scored = rows[matched].drop(columns='reason').reset_index(drop=True)
+        unmatched = rows[~matched].drop(columns=['E', 'E_table_hash']).reset_index(drop=True)
+        return scored, unmatched
+
+
+# (key, rows) of every partition of a table: one per AA_CHI, plus NO_KEY for rows without one
+def partitions(rows):
+    for aa_chi, key_rows in rows.groupby('AA_CHI', sort=True, observed=True):
+        yield aa_chi, key_rows
+    missing = rows['AA_CHI'].isna()
+    if missing.any():
+        yield NO_KEY, rows[missing]
+
+
+# Manifest entry of one partition
+def key_record(rows, table_hash):
+    n_scored = int(rows['reason'].isna().sum())
+    return {'table_hash': table_hash, 'n_scored': n_scored, 'n_unmatched': len(rows) - n_scored}
+
+
+def distribution_diff(aa_chi, before, after, old_hash, new_hash):
+    '''
+    Arguments:
+        aa_chi (str): key of the rows
+        before, after (pandas dataframe): the same rows, in the same order, scored
+            with the old and with the new potential (E NaN where unmatched)
+        old_hash, new_hash (str): table hashes of the two potentials (None if absent)
+    Returns
+        dict with the DIFF_COLUMNS: row counts, how many rows changed E or their
+        matched state, summary statistics of E before and after, and the mean and
+        largest |ΔE| over rows scored by both.
+    '''
+    old = before['E'].to_numpy(dtype=float)
+    new = after['E'].to_numpy(dtype=float)
+    both = ~np.isnan(old) & ~np.isnan(new)
+    delta = np.abs(new[both] - old[both])
+    changed = np.isnan(old) != np.isnan(new)
+    changed[both] |= delta > 1e-6
+
+    def stat(function, values):
+        values = values[~np.isnan(values)]
+        return float(function(values)) if len(values) else np.nan
+
+    mean_before, mean_after = stat(np.mean, old), stat(np.mean, new)
+    return {
+        'AA_CHI': aa_chi,
+        'residue_type': aa_chi.rsplit('_', 1)[0],
+        'old_table_hash': old_hash,
+        'new_table_hash': new_hash,
+        'n_rows': len(old),
+        'n_scored_before': int((~np.isnan(old)).sum()),
+        'n_scored_after': int((~np.isnan(new)).sum()),
+        'n_changed': int(changed.sum()),
+        'mean_before': mean_before,
+        'mean_after': mean_after,
+        'mean_shift': mean_after - mean_before,
+        'median_before': stat(np.median, old),
+        'median_after': stat(np.median, new),
+        'std_before': stat(np.std, old),
+        'std_after': stat(np.std, new),
+        'mean_abs_delta': float(delta.mean()) if len(delta) else np.nan,
+        'max_abs_delta': float(delta.max()) if len(delta) else np.nan,
+    }
@@ -0,0 +1,167 @@
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from checkpoint import BatchCheckpoint, append_csv
+from rotamer_io import chunked
+from streaming import ScoreAggregates, stream_score
+
+
+# Deterministic slice of the input files handled by one shard
+def shard_paths(paths, n_shards, shard_index, files_per_chunk=256):
+    '''
+    Split the files into n_shards contiguous runs of whole chunks, so the shards
+    read exactly the chunks a single streaming run over all files would.
+
+    Arguments:
+        paths (list of str): every input file, in the order of a single-process run
+        n_shards (int): number of shards
+        shard_index (int): shard to return, 0 <= shard_index < n_shards
+        files_per_chunk (int): files read and scored together {default: 256}
+    Returns
+        list of the files of this shard (may be empty when there are more shards than chunks).
+    '''
+    if not 0 <= shard_index < n_shards:
+        raise ValueError(f"Shard index {shard_index} outside 0-{n_shards - 1}")
+    chunks = chunked(list(paths), max(1, files_per_chunk))
+    start = len(chunks) * shard_index // n_shards
+    stop = len(chunks) * (shard_index + 1) // n_shards
+    return [path for chunk in chunks[start:stop] for path in chunk]
+
+
+# (shard_index, n_shards) of this SLURM array task, or None outside an array job
+def slurm_shard():
+    if 'SLURM_ARRAY_TASK_ID' not in os.environ:
+        return None
+    task = int(os.environ['SLURM_ARRAY_TASK_ID'])
+    first = int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+    return task - first, int(os.environ['SLURM_ARRAY_TASK_COUNT'])
+
+
+# Fingerprint of the input file list, so a reduce never mixes shards of different listings
+def hash_paths(paths):
+    return hashlib.sha256('\n'.join(paths).encode()).hexdigest()
+
+
+# Common file name prefix of the partial results of one shard
+def shard_prefix(output_dir, shard_index, n_shards):
+    return os.path.join(output_dir, f'shard-{shard_index:05d}-of-{n_shards:05d}')
+
+
+def run_shard(paths, energy_store, output_dir, n_shards, shard_index, files_per_chunk=256, resume=False, prefetch=0):
+    '''
+    Score one shard of the input files and write its partial results:
+    <prefix>.csv (scored rows), <prefix>.npz (ScoreAggregates), <prefix>.failed.csv
+    and, last, <prefix>.json marking the shard as complete.
+
+    Arguments:
+        paths (list of str): every input file, in the order of a single-process run
+        energy_store (EnergyStore): backbone-independent potentials
+        output_dir (str): directory of the partial results
+        n_shards (int): number of shards
+        shard_index (int): shard to run
+        files_per_chunk (int): files read and scored together {default: 256}
+        resume (bool): checkpoint every chunk under <prefix>.batches/ and reuse the
+            chunks a killed earlier attempt completed {default: False}
+        prefetch (int): chunks read ahead while the current one is scored {default: 0}
+    Returns
+        the shard's completion record (also written to <prefix>.json).
+    '''
+    paths = list(paths)
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = shard_prefix(output_dir, shard_index, n_shards)
+    shard = shard_paths(paths, n_shards, shard_index, files_per_chunk)
+
+    # Results are written under temporary names and renamed, so a killed shard leaves no partial output behind.
+    # The completion record of an earlier attempt goes first: until this attempt finishes the shard is incomplete.
+    if os.path.exists(prefix + '.json'):
+        os.remove(prefix + '.json')
+    checkpoint = None
+    if resume:
+        checkpoint = BatchCheckpoint(prefix + '.batches', {'energy_hash': energy_store.source_hash, 'files_per_chunk': files_per_chunk})
+    aggregates, failed = stream_score(shard, energy_store.tables, prefix + '.csv.tmp', files_per_chunk, checkpoint=checkpoint, prefetch=prefetch)
+    if os.path.exists(prefix + '.csv.tmp'):
+        os.replace(prefix + '.csv.tmp', prefix + '.csv')
+    elif os.path.exists(prefix + '.csv'):
+        # No rows scored this time: rows of an earlier attempt must not be reduced
+        os.remove(prefix + '.csv')
+    aggregates.save(prefix + '.tmp.npz')
+    os.replace(prefix + '.tmp.npz', prefix + '.npz')
+    failed.to_csv(prefix + '.failed.csv.tmp', index=False)
+    os.replace(prefix + '.failed.csv.tmp', prefix + '.failed.csv')
+
+    record = {
+        'shard_index': shard_index,
+        'n_shards': n_shards,
+        'files_per_chunk': files_per_chunk,
+        'n_files': len(shard),
+        'n_failed': len(failed),
+        'n_scored': int(sum(aggregates.counts.values())),
+        'paths_hash': hash_paths(paths),
+        'energy_hash': energy_store.source_hash,
+    }
+    with open(prefix + '.json.tmp', 'w') as handle:
+        json.dump(record, handle)
+    os.replace(prefix + '.json.tmp', prefix + '.json')
+    return record
+
+
+# Completion records of every shard in a directory, checked to belong to one run
+def read_shard_records(output_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(output_dir, 'shard-*-of-*.json'))):
+        with open(path) as handle:
+            records.append(json.load(handle))
+    if not records:
+        raise ValueError(f"No completed shards in {output_dir}")
+
+    for key in ('n_shards', 'files_per_chunk', 'paths_hash', 'energy_hash'):
+        values = {record[key] for record in records}
+        if len(values) > 1:
+            raise ValueError(f"Shards in {output_dir} come from different runs ({key} differs)")
+    n_shards = records[0]['n_shards']
+    missing = sorted(set(range(n_shards)) - {record['shard_index'] for record in records})
+    if missing:
+        raise ValueError(f"Shards not completed: {missing}")
+    return sorted(records, key=lambda record: record['shard_index'])
+
+
+def reduce_shards(output_dir, output_path, aggregates_path=None):
+    '''
+    Combine the partial results of every shard into the output of a single
+    streaming run over all files with the same files_per_chunk.
+
+    Arguments:
+        output_dir (str): directory the shards wrote to
+        output_path (str): CSV of all scored rows
+        aggregates_path (str): where to save the merged ScoreAggregates {default: not saved}
+    Returns
+        (aggregates, failed): the merged ScoreAggregates and a DataFrame of unreadable files.
+    '''
+    records = read_shard_records(output_dir)
+    aggregates = ScoreAggregates()
+    failed = []
+
+    # Shards hold consecutive chunks, so their rows concatenate in single-run order under one header
+    header = True
+    with open(output_path + '.tmp', 'wb') as out:
+        for record in records:
+            prefix = shard_prefix(output_dir, record['shard_index'], record['n_shards'])
+            if os.path.exists(prefix + '.csv'):
+                append_csv(out, prefix + '.csv', header)
+                header = False
+            aggregates.merge(ScoreAggregates.load(prefix + '.npz'))
+            failed.append(pd.read_csv(prefix + '.failed.csv', dtype=str, keep_default_na=False))
+    if header:
+        os.remove(output_path + '.tmp')
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    else:
+        os.replace(output_path + '.tmp', output_path)
+
+    if aggregates_path:
+        aggregates.save(aggregates_path)
+    return aggregates, pd.concat(failed, ignore_index=True)
@@ -0,0 +1,243 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from energy_lookup import score_rotamers
+from rotamer_io import chunked, read_rotamer_batch
+
+# Fixed histogram edges so aggregates from different runs can be merged
+ANGLE_EDGES = np.linspace(0, 360, 361)
+ENERGY_EDGES = np.linspace(-5, 10, 301)
+
+
+def read_batches(batches, prefetch=0):
+    '''
+    Read batches of rotamer files in order, optionally reading the next ones in the
+    background while the caller works on the current one.
+
+    Arguments:
+        batches (list of list of str): batches of rotamer CSV files
+        prefetch (int): batches read ahead of the one handed out; 0 reads each batch
+            only when it is asked for. The reader never runs further ahead, so at most
+            prefetch + 1 batches are held in memory {default: 0}
+    Yields
+        read_rotamer_batch results (data, failed, n_bytes), one per batch in input order.
+    '''
+    if prefetch <= 0:
+        for batch in batches:
+            yield read_rotamer_batch(batch)
+        return
+
+    # Reader threads: the per-file latency of a networked filesystem and the C CSV parser both release the GIL
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    pending = deque(pool.submit(read_rotamer_batch, batch) for batch in batches[:prefetch])
+    try:
+        for index in range(len(batches)):
+            result = pending.popleft().result()
+            # Refill the queue before handing out the batch, so reading overlaps the caller's work
+            if index + prefetch < len(batches):
+                pending.append(pool.submit(read_rotamer_batch, batches[index + prefetch]))
+            yield result
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+# Read rotamer files a few at a time and yield one normalised DataFrame per chunk
+def iter_rotamer_chunks(paths, files_per_chunk=256, failed=None, prefetch=0):
+    '''
+    Arguments:
+        paths (list of str): rotamer CSV files to read
+        files_per_chunk (int): files combined into one chunk {default: 256}
+        failed (list): if given, (file, reason) pairs of unreadable files are appended to it
+        prefetch (int): chunks read ahead in background threads, see read_batches {default: 0}
+    Yields
+        normalised rotamer rows of one chunk of files.
+    '''
+    for data, batch_failed, _ in read_batches(chunked(list(paths), max(1, files_per_chunk)), prefetch):
+        if failed is not None:
+            failed.extend(batch_failed)
+        if data is not None:
+            yield data
+
+
+# Score every chunk against the energy potentials
+def score_chunks(chunks, tables):
+    for chunk in chunks:
+        yield score_rotamers(chunk, tables)
+
+
+# Running per-AA_CHI counts and histograms of scored rows
+class ScoreAggregates:
+    def __init__(self, angle_edges=ANGLE_EDGES, energy_edges=ENERGY_EDGES):
+        self.angle_edges = np.asarray(angle_edges, dtype=float)
+        self.energy_edges = np.asarray(energy_edges, dtype=float)
+        self.counts = {}
+        self.unmatched = {}
+        self.joint = {}
+
+    def _bin(self, values, edges):
+        # Histogram bin of every value; values beyond the edges go into the end bins
+        idx = np.searchsorted(edges, values, side='right') - 1
+        return np.clip(idx, 0, len(edges) - 2)
+
+    def add(self, scored, unmatched=None):
+        # Fold one scored chunk (and optionally its unmatched rows) into the aggregates
+        n_angle = len(self.angle_edges) - 1
+        n_energy = len(self.energy_edges) - 1
+        if not scored.empty:
+            for aa_chi, group in scored.groupby('AA_CHI', sort=False, observed=True):
+                angle_idx = self._bin(group['angle'].to_numpy(dtype=float), self.angle_edges)
+                energy_idx = self._bin(group['E'].to_numpy(dtype=float), self.energy_edges)
+                cells = np.bincount(angle_idx * n_energy + energy_idx, minlength=n_angle * n_energy)
+                if aa_chi not in self.joint:
+                    self.joint[aa_chi] = np.zeros((n_angle, n_energy), dtype=np.int64)
+                    self.counts[aa_chi] = 0
+                self.joint[aa_chi] += cells.reshape(n_angle, n_energy)
+                self.counts[aa_chi] += len(group)
+        if unmatched is not None and not unmatched.empty:
+            for aa_chi, n in unmatched.groupby('AA_CHI', sort=False, observed=True).size().items():
+                self.unmatched[aa_chi] = self.unmatched.get(aa_chi, 0) + int(n)
+        return self
+
+    def merge(self, other):
+        # Combine with aggregates built over other rows with the same histogram edges
+        if not (np.array_equal(self.angle_edges, other.angle_edges) and np.array_equal(self.energy_edges, other.energy_edges)):
+            raise ValueError('Cannot merge aggregates with different histogram edges')
+        for aa_chi, joint in other.joint.items():
+            if aa_chi in self.joint:
+                self.joint[aa_chi] = self.joint[aa_chi] + joint
+            else:
+                self.joint[aa_chi] = joint.copy()
+            self.counts[aa_chi] = self.counts.get(aa_chi, 0) + other.counts[aa_chi]
+        for aa_chi, n in other.unmatched.items():
+            self.unmatched[aa_chi] = self.unmatched.get(aa_chi, 0) + n
+        return self
+
+    def angle_histogram(self, aa_chi):
+        return self.joint[aa_chi].sum(axis=1)
+
+    def energy_histogram(self, aa_chi):
+        return self.joint[aa_chi].sum(axis=0)
+
+    def summary(self):
+        # Scored and unmatched row counts per AA_CHI
+        keys = sorted(set(self.counts) | set(self.unmatched))
+        return pd.DataFrame({
+            'AA_CHI': keys,
+            'scored': [self.counts.get(key, 0) for key in keys],
+            'unmatched': [self.unmatched.get(key, 0) for key in keys],
+        })
+
+    def to_points(self):
+        '''
+        Returns
+            dataframe with one row per occupied (angle, E) histogram cell: AA_CHI,
+            angle and E at the cell centre and the number of rows in it. It has
+            the columns plot_data expects, so plots can be drawn without the raw rows.
+        '''
+        angle_mid = (self.angle_edges[:-1] + self.angle_edges[1:]) / 2
+        energy_mid = (self.energy_edges[:-1] + self.energy_edges[1:]) / 2
+        frames = []
+        for aa_chi in sorted(self.joint):
+            angle_idx, energy_idx = np.nonzero(self.joint[aa_chi])
+            frames.append(pd.DataFrame({
+                'AA_CHI': aa_chi,
+                'angle': angle_mid[angle_idx],
+                'E': energy_mid[energy_idx],
+                'count': self.joint[aa_chi][angle_idx, energy_idx],
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['AA_CHI', 'angle', 'E', 'count'])
+        return pd.concat(frames, ignore_index=True)
+
+    def save(self, path):
+        keys = sorted(self.joint)
+        unmatched_keys = sorted(self.unmatched)
+        np.savez_compressed(
+            path,
+            angle_edges=self.angle_edges,
+            energy_edges=self.energy_edges,
+            keys=np.array(keys, dtype=str),
+            counts=np.array([self.counts[key] for key in keys], dtype=np.int64),
+            joint=np.stack([self.joint[key] for key in keys]) if keys else np.zeros((0, len(self.angle_edges) - 1, len(self.energy_edges) - 1), dtype=np.int64),
+            unmatched_keys=np.array(unmatched_keys, dtype=str),
+            unmatched=np.array([self.unmatched[key] for key in unmatched_keys], dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            aggregates = cls(data['angle_edges'], data['energy_edges'])
+            for key, n, joint in zip(data['keys'].tolist(), data['counts'], data['joint']):
+                aggregates.counts[key] = int(n)
+                aggregates.joint[key] = joint
+            for key, n in zip(data['unmatched_keys'].tolist(), data['unmatched']):
+                aggregates.unmatched[key] = int(n)
+        return aggregates
+
+
+def stream_score(paths, tables, output_path, files_per_chunk=256, aggregates=None, checkpoint=None, prefetch=0):
+    '''
+    Score rotamer files chunk by chunk, appending the scored rows to a CSV and
+    folding them into running aggregates, so memory is bounded by the chunk size.
+
+    Arguments:
+        paths (list of str): rotamer CSV files to score
+        tables (dict): BinnedEnergyTable per AA_CHI key, e.g. EnergyStore.tables
+        output_path (str): CSV the scored rows are appended to (overwritten at the start)
+        files_per_chunk (int): files read and scored together {default: 256}
+        aggregates (ScoreAggregates): aggregates to add to {default: a new one}
+        checkpoint (BatchCheckpoint): if given, every chunk is saved there when scored
+            and chunks completed by an earlier run are reused instead of rescored;
+            the output is identical to an uninterrupted run {default: None}
+        prefetch (int): chunks read ahead in background threads while the current one
+            is scored and written; the output does not depend on it {default: 0}
+    Returns
+        (aggregates, failed): the ScoreAggregates and a DataFrame of unreadable files.
+    '''
+    aggregates = aggregates if aggregates is not None else ScoreAggregates()
+    failed = []
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    if checkpoint is not None:
+        return stream_score_checkpointed(paths, tables, output_path, files_per_chunk, aggregates, checkpoint, prefetch)
+
+    header = True
+    for scored, unmatched in score_chunks(iter_rotamer_chunks(paths, files_per_chunk, failed, prefetch), tables):
+        aggregates.add(scored, unmatched)
+        if not scored.empty:
+            scored.to_csv(output_path, mode='a', header=header, index=False)
+            header = False
+    return aggregates, pd.DataFrame(failed, columns=['file', 'reason'])
+
+
+# stream_score through a BatchCheckpoint: score the unfinished chunks, then assemble every chunk in order
+def stream_score_checkpointed(paths, tables, output_path, files_per_chunk, aggregates, checkpoint, prefetch=0):
+    from checkpoint import append_csv
+
+    failed = []
+    batches = chunked(list(paths), max(1, files_per_chunk))
+    complete = [checkpoint.is_complete(index, batch) for index, batch in enumerate(batches)]
+    n_reused = sum(complete)
+    # Only the unfinished batches are read, in order, ahead of their scoring
+    reads = read_batches([batch for batch, done in zip(batches, complete) if not done], prefetch)
+    header = True
+    with open(output_path, 'wb') as out:
+        for index, batch in enumerate(batches):
+            if not complete[index]:
+                data, batch_failed, _ = next(reads)
+                scored, unmatched = score_rotamers(data, tables) if data is not None else (pd.DataFrame(), pd.DataFrame())
+                checkpoint.save(index, batch, scored, unmatched, batch_failed)
+            csv_path, batch_aggregates, batch_failed = checkpoint.load(index)
+            aggregates.merge(batch_aggregates)
+            failed.extend(batch_failed)
+            if csv_path is not None:
+                append_csv(out, csv_path, header)
+                header = False
+    if header:
+        os.remove(output_path)
+    print(f"Checkpoint {checkpoint.directory}: reused {n_reused}/{len(batches)} batches")
+    return aggregates, pd.DataFrame(failed, columns=['file', 'reason'])
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the top level of the repository
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+
+from energy_store import load_energy_store  # noqa: E402
+
+# Energy potentials shipped with the repository
+ENERGY_ZIP = os.path.join(REPO_DIR, 'backbone_independent_energy.zip')
+
+
+@pytest.fixture(scope='session')
+def energy_store(tmp_path_factory):
+    # Compiled into a temporary directory so the tests never write next to the sources
+    return load_energy_store(ENERGY_ZIP, str(tmp_path_factory.mktemp('energy') / 'store.npz'))
+
+
+# Bin edges of a potential that wrap to themselves, i.e. lie in [0, 360)
+def bin_edges(table):
+    edges = np.unique(np.concatenate([table.bin_min, table.bin_max]))
+    return edges[(edges >= 0) & (edges < 360)]
+
+
+# One deposited rotamer CSV with a row per (residue type, chi, angle)
+def write_rotamer_csv(path, rows):
+    pd.DataFrame(rows, columns=['chain', 'residue', 'residue_name', 'nchi', 'rotamer_value']).to_csv(path, index=False)
+
+
+# Rotamer rows with an angle on every bin edge of every potential
+def edge_rows(energy_store):
+    rows = []
+    for aa_chi, table in energy_store.tables.items():
+        residue_type, chi = aa_chi.split('_CHI')
+        rows.extend(('A', i + 1, residue_type, int(chi) - 1, repr(float(edge))) for i, edge in enumerate(bin_edges(table)))
+    return rows
+
+
+# Several deposited rotamer CSVs with random angles of a few residue types; returns their paths
+def write_rotamer_files(directory, n_files, rows_per_file=20, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n_files):
+        residue_types = rng.choice(['ARG', 'LEU', 'SER', 'PHE', 'PRO'], rows_per_file)
+        rows = [('A', j + 1, residue_type, int(rng.integers(0, 2)), repr(float(angle)))
+                for j, (residue_type, angle) in enumerate(zip(residue_types, rng.uniform(-180, 180, rows_per_file)))]
+        path = os.path.join(str(directory), f'{i:04d}_rotamers_output.csv')
+        write_rotamer_csv(path, rows)
+        paths.append(path)
+    return paths
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backbone_dependent import BackboneDependentGrid, grid_step, score_rotamers_backbone
+from energy_lookup import BinnedEnergyTable
+
+
+# Backbone-dependent table over every (phi, psi, chi) cell of the given edges, E numbering the rows
+def grid_table(phi_edges, psi_edges, chi_edges, chi_width):
+    phi, psi, chi = (axis.ravel() for axis in np.meshgrid(phi_edges, psi_edges, chi_edges, indexing='ij'))
+    return pd.DataFrame({'phi': phi, 'psi': psi, 'bin min': chi, 'bin max': chi + chi_width, 'E': np.arange(len(phi), dtype=float)})
+
+
+def test_uniform_grid_looks_up_every_cell():
+    table = grid_table(np.arange(-180, 180, 30.0), np.arange(-180, 180, 30.0), np.arange(0, 360, 60.0), 60.0)
+    grid = BackboneDependentGrid.from_frame(table)
+    assert grid.energy.shape == (12, 12, 6)
+    energy, matched = grid.lookup(table['phi'] + 15, table['psi'] + 15, table['bin min'] + 30)
+    assert matched.all()
+    np.testing.assert_array_equal(energy, table['E'])
+
+
+def test_empty_cells_are_allowed():
+    table = grid_table(np.array([-180.0, -150.0, -60.0]), np.array([0.0]), np.array([0.0, 120.0]), 60.0)
+    grid = BackboneDependentGrid.from_frame(table)
+    assert grid.energy.shape == (5, 1, 3)
+    energy, matched = grid.lookup([-170.0, -100.0, -50.0], [10.0, 10.0, 10.0], [10.0, 10.0, 130.0])
+    assert matched.tolist() == [True, False, True]
+    assert energy[2] == 5.0
+
+
+def test_grid_step_rejects_off_grid_edges():
+    assert grid_step(np.array([-180.0, -170.0, -140.0])) == 10.0
+    with pytest.raises(ValueError, match='phi edges are not on a uniform grid'):
+        grid_step(np.array([-180.0, -170.0, -155.0]), 'phi')
+
+
+@pytest.mark.parametrize('column', ['phi', 'psi'])
+def test_off_grid_backbone_edge_raises(column):
+    table = grid_table(np.arange(-180, 180, 30.0), np.arange(-180, 180, 30.0), np.arange(0, 360, 60.0), 60.0)
+    table.loc[table[column] == 0.0, column] = 10.0
+    with pytest.raises(ValueError, match=f'{column} edges'):
+        BackboneDependentGrid.from_frame(table)
+
+
+def test_step_not_dividing_the_circle_raises():
+    table = grid_table(np.arange(-180, 180, 70.0), np.array([0.0]), np.array([0.0]), 60.0)
+    with pytest.raises(ValueError, match='phi bin width 70.0 does not divide 360'):
+        BackboneDependentGrid.from_frame(table)
+
+
+def test_non_uniform_chi_bins_raise():
+    table = grid_table(np.array([0.0]), np.array([0.0]), np.arange(0, 360, 60.0), 60.0)
+    table.loc[0, 'bin max'] = 50.0
+    with pytest.raises(ValueError, match='chi bins are not of uniform width'):
+        BackboneDependentGrid.from_frame(table)
+
+
+def test_off_grid_chi_edge_raises():
+    table = grid_table(np.array([0.0]), np.array([0.0]), np.arange(0, 360, 60.0), 60.0)
+    table.loc[table['bin min'] == 120.0, ['bin min', 'bin max']] = [130.0, 190.0]
+    with pytest.raises(ValueError, match='chi edges off the grid'):
+        BackboneDependentGrid.from_frame(table)
+
+
+def test_duplicate_cells_raise():
+    table = grid_table(np.arange(-180, 180, 30.0), np.array([0.0]), np.array([0.0]), 60.0)
+    with pytest.raises(ValueError, match='1 \\(phi, psi, chi\\) cells appear more than once'):
+        BackboneDependentGrid.from_frame(pd.concat([table, table.iloc[[3]]], ignore_index=True))
+    # 180 wraps onto the -180 bin
+    wrapped = pd.concat([table, table.iloc[[0]].assign(phi=180.0)], ignore_index=True)
+    with pytest.raises(ValueError, match='more than once'):
+        BackboneDependentGrid.from_frame(wrapped)
+
+
+# SER_CHI1 on a 30° phi/psi grid with 60° chi bins; E is 100 plus the row number, one cell left empty
+@pytest.fixture
+def ser_grid():
+    table = grid_table(np.arange(-180, 180, 30.0), np.arange(-180, 180, 30.0), np.arange(0, 360, 60.0), 60.0)
+    empty = (table['phi'] == 0) & (table['psi'] == 0) & (table['bin min'] == 60)
+    table['E'] += 100
+    return {'SER_CHI1': BackboneDependentGrid.from_frame(table[~empty])}, table
+
+
+@pytest.fixture
+def fallback_tables():
+    edges = np.arange(0, 361, 60.0)
+    return {aa_chi: BinnedEnergyTable(edges[:-1], edges[1:], -np.arange(1, 7.0)) for aa_chi in ('SER_CHI1', 'LEU_CHI1')}
+
+
+def test_chi_edges_follow_the_backbone_independent_rule(ser_grid, fallback_tables):
+    grids, _ = ser_grid
+    chi = np.array([0.0, 60.0, 120.0, 359.0, 360.0, 30.0, 61.0])
+    _, matched = grids['SER_CHI1'].lookup(np.full(len(chi), -165.0), np.full(len(chi), -165.0), chi)
+    _, fallback_matched = fallback_tables['SER_CHI1'].lookup(chi)
+    assert matched.tolist() == fallback_matched.tolist() == [False, False, False, True, False, True, True]
+    # The backbone bins include their lower edge
+    _, matched = grids['SER_CHI1'].lookup([-180.0, 0.0, 30.0], [-180.0, 30.0, 0.0], [30.0, 30.0, 30.0])
+    assert matched.all()
+
+
+def test_score_falls_back_to_backbone_independent_tables(ser_grid, fallback_tables):
+    grids, table = ser_grid
+    df = pd.DataFrame({
+        'residue_type': ['SER', 'SER', 'SER', 'LEU', 'SER', 'SER'],
+        'chi_angle': 'chi1',
+        'angle': [90.0, 90.0, 90.0, 90.0, 60.0, 200.0],
+        'phi': [-170.0, np.nan, 10.0, -170.0, -170.0, -170.0],
+        'psi': [-170.0, -170.0, 10.0, -170.0, -170.0, np.nan],
+    })
+    scored, unmatched = score_rotamers_backbone(df, grids, fallback_tables)
+
+    cell = table[(table['phi'] == -180) & (table['psi'] == -180) & (table['bin min'] == 60)]
+    by_angle = scored.set_index(['residue_type', 'phi', 'angle'])
+    assert by_angle.loc[('SER', -170.0, 90.0), 'E'] == pytest.approx(cell['E'].item())
+    assert by_angle.loc[('SER', -170.0, 90.0), 'E_source'] == 'backbone_dependent'
+    # Missing phi or psi, the empty cell and a residue type without a grid use the fallback
+    fallback = scored[scored['E_source'] == 'backbone_independent']
+    assert sorted(zip(fallback['residue_type'], fallback['angle'], fallback['E'])) == [
+        ('LEU', 90.0, -2.0), ('SER', 90.0, -2.0), ('SER', 90.0, -2.0), ('SER', 200.0, -4.0)]
+    assert fallback['phi'].isna().sum() == 1 and fallback['psi'].isna().sum() == 1
+    # A chi on a bin edge has no energy in either potential
+    assert unmatched['angle'].tolist() == [60.0]
+    assert set(scored['E_source'].cat.categories) == {'backbone_dependent', 'backbone_independent'}
+
+
+def test_inexact_chi_edges_match_the_binned_table():
+    # Edges that are not exact binary fractions, e.g. 0.1, 1.0, 1.9, ...
+    chi_min = np.round(0.1 + np.arange(400) * 0.9, 6)
+    table = pd.DataFrame({'phi': 0.0, 'psi': 0.0, 'bin min': chi_min, 'bin max': np.round(chi_min + 0.9, 6), 'E': np.arange(400.0)})
+    grid = BackboneDependentGrid.from_frame(table)
+    binned = BinnedEnergyTable(table['bin min'], table['bin max'], table['E'])
+    chi = np.concatenate([chi_min, table['bin max'], chi_min + 0.45, np.nextafter(chi_min, np.inf)])
+    # normalize_rotamers wraps the angles into [0, 360)
+    chi = chi[chi < 360]
+    energy, matched = grid.lookup(np.zeros(len(chi)), np.zeros(len(chi)), chi)
+    binned_energy, binned_matched = binned.lookup(chi)
+    np.testing.assert_array_equal(matched, binned_matched)
+    np.testing.assert_array_equal(energy, binned_energy)
@@ -0,0 +1,52 @@
+import glob
+import os
+
+import numpy as np
+
+from checkpoint import BatchCheckpoint
+from conftest import write_rotamer_files
+from streaming import stream_score
+
+
+# Scored CSV bytes, aggregates and failed files of one streaming run
+def run(paths, energy_store, output, checkpoint=None):
+    aggregates, failed = stream_score(paths, energy_store.tables, str(output), files_per_chunk=3, checkpoint=checkpoint)
+    return output.read_bytes(), aggregates, failed
+
+
+def assert_same_run(first, second):
+    assert first[0] == second[0]
+    assert first[1].counts == second[1].counts
+    assert first[1].unmatched == second[1].unmatched
+    for key in first[1].joint:
+        np.testing.assert_array_equal(first[1].joint[key], second[1].joint[key])
+    assert first[2].equals(second[2])
+
+
+def test_restarted_run_matches_uninterrupted_run(energy_store, tmp_path):
+    paths = write_rotamer_files(tmp_path, 10)
+    reference = run(paths, energy_store, tmp_path / 'reference.csv')
+
+    directory = str(tmp_path / 'batches')
+    settings = {'energy_hash': energy_store.source_hash, 'files_per_chunk': 3}
+    assert_same_run(reference, run(paths, energy_store, tmp_path / 'first.csv', BatchCheckpoint(directory, settings)))
+
+    # A kill before these batches finished leaves them without their manifest entry
+    for path in sorted(glob.glob(os.path.join(directory, 'batch-*.json')))[1::2]:
+        os.remove(path)
+    assert_same_run(reference, run(paths, energy_store, tmp_path / 'restarted.csv', BatchCheckpoint(directory, settings)))
+
+
+def test_deleted_input_is_reported_as_failed(energy_store, tmp_path):
+    paths = write_rotamer_files(tmp_path, 7)
+    directory = str(tmp_path / 'batches')
+    run(paths, energy_store, tmp_path / 'first.csv', BatchCheckpoint(directory))
+
+    os.remove(paths[4])
+    reference = run(paths, energy_store, tmp_path / 'reference.csv')
+    assert reference[2]['file'].tolist() == [paths[4]]
+    assert_same_run(reference, run(paths, energy_store, tmp_path / 'restarted.csv', BatchCheckpoint(directory)))
+    # The batch with the missing file completed and is reused as it is
+    checkpoint = BatchCheckpoint(directory)
+    assert checkpoint.is_complete(1, paths[3:6])
+    assert_same_run(reference, run(paths, energy_store, tmp_path / 'again.csv', checkpoint))
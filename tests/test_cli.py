@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import write_rotamer_csv, write_rotamer_files
+from knowledge_based_energy import build_parser, check_score_arguments, main
+
+
+@pytest.mark.parametrize('options, message', [
+    (['--stream', '--backbone-dependent', 'bbdep.zip'], '--backbone-dependent'),
+    (['--stream', '--cache', 'cache'], '--cache'),
+    (['--stream', '--format', 'parquet'], '--format parquet'),
+    (['--stream', '--workers', '4'], '--workers without --plot-dir'),
+    (['--stream', '--cache', 'cache', '--format', 'parquet'], '--cache, --format parquet'),
+    (['--checkpoint', 'batches'], '--checkpoint needs --stream'),
+    (['--store', 'store', '--backbone-dependent', 'bbdep.zip'], '--store needs the backbone-independent score'),
+])
+def test_score_rejects_ignored_options(tmp_path, capsys, options, message):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['score', str(tmp_path), '-o', str(tmp_path / 'scored.csv')] + options)
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
+    assert not (tmp_path / 'scored.csv').exists()
+
+
+def test_stream_accepts_workers_for_plots(tmp_path):
+    parser = build_parser()
+    args = parser.parse_args(['score', str(tmp_path), '--stream', '--workers', '2', '--plot-dir', str(tmp_path)])
+    check_score_arguments(parser, args)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_score_lists_unparsed_files(tmp_path, capsys, monkeypatch, stream):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    rotamers = tmp_path / 'rotamers'
+    rotamers.mkdir()
+    paths = write_rotamer_files(rotamers, 3)
+    with open(paths[1], 'w') as handle:
+        handle.write('not,a,rotamer,table\n')
+
+    output = tmp_path / 'scored.csv'
+    main(['score', str(rotamers), '-o', str(output)] + (['--stream', '--aggregates', str(tmp_path / 'aggregates.npz')] if stream else ['--workers', '1']))
+    failed = pd.read_csv(tmp_path / 'scored.failed.csv')
+    assert failed['file'].tolist() == [paths[1]]
+    assert failed['reason'].str.startswith('ValueError: missing columns').all()
+    out = capsys.readouterr().out
+    assert 'Not parsed: 1' in out
+    assert f"{paths[1]}: ValueError: missing columns" in out
+
+    # A clean rerun replaces the list of the earlier run
+    write_rotamer_files(rotamers, 3)
+    main(['score', str(rotamers), '-o', str(output)] + (['--stream', '--aggregates', str(tmp_path / 'aggregates.npz')] if stream else ['--workers', '1']))
+    assert pd.read_csv(tmp_path / 'scored.failed.csv').empty
+
+
+def test_pair_commands_list_unparsed_files_of_both_inputs(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    rotamers, qfit = tmp_path / 'rotamers', tmp_path / 'qfit'
+    rotamers.mkdir()
+    qfit.mkdir()
+    write_rotamer_csv(rotamers / '1abc_rotamers_output.csv', [('A', 1, 'SER', 0, '62.0')])
+    (rotamers / '2xyz_rotamers_output.csv').write_text('broken\n')
+    (qfit / '1abc_qFit_rotamers_output.csv').write_text('chain,residue,residue_name,nchi,rotamer_value,altloc,occupancy\nA,1,SER,0,64.0,A,1.0\n')
+    (qfit / '3def_qFit_rotamers_output.csv').write_text('broken\n')
+
+    for command, output in [('delta', 'delta.csv'), ('compare-qfit', 'compare.csv')]:
+        options = ['--workers', '1', '-o', str(tmp_path / output)]
+        if command == 'compare-qfit':
+            options += ['--residue-output', str(tmp_path / 'residues.csv'), '--structure-output', str(tmp_path / 'structures.csv')]
+        main([command, str(qfit), str(rotamers)] + options)
+        failed = pd.read_csv(tmp_path / output.replace('.csv', '.failed.csv'))
+        assert sorted(os.path.basename(path) for path in failed['file']) == ['2xyz_rotamers_output.csv', '3def_qFit_rotamers_output.csv']
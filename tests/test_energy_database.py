@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from energy_database import EnergyDatabase, build_database
+
+
+@pytest.fixture
+def table():
+    rng = np.random.default_rng(0)
+    n = 400
+    residue = pd.array(rng.integers(1, 300, n), dtype='Int32')
+    residue[::37] = pd.NA
+    reason = rng.choice(['bin_gap', 'out_of_range'], n).astype(object)
+    reason[rng.random(n) < 0.5] = None
+    return pd.DataFrame({
+        'AA_CHI': pd.Categorical(rng.choice(['ARG_CHI1', 'ARG_CHI3', 'LEU_CHI2', 'SER_CHI1'], n)),
+        'pdb_id': rng.choice(['1abc', '2xyz', '3def'], n),
+        'residue': residue,
+        'angle': rng.uniform(0, 360, n).round(1),
+        'E': rng.normal(0, 2, n).astype(np.float32),
+        'reason': reason,
+    })
+
+
+@pytest.fixture
+def database(table, tmp_path):
+    return build_database(table, str(tmp_path / 'db'))
+
+
+def reference(table, mask):
+    return table[mask].sort_values(['AA_CHI', 'pdb_id'], kind='stable').reset_index(drop=True)
+
+
+def assert_same_rows(result, expected):
+    assert len(result) == len(expected)
+    for name in ['AA_CHI', 'pdb_id', 'reason']:
+        assert result[name].astype(object).where(result[name].notna(), None).tolist() == expected[name].astype(object).where(expected[name].notna(), None).tolist()
+    assert result['residue'].tolist() == expected['residue'].tolist()
+    np.testing.assert_array_equal(result['E'].to_numpy(), expected['E'].to_numpy())
+
+
+def test_index_slices(table, database):
+    assert isinstance(database.select(aa_chi='ARG_CHI3'), slice)
+    assert_same_rows(database.rows(aa_chi='ARG_CHI3'), reference(table, table['AA_CHI'] == 'ARG_CHI3'))
+    assert_same_rows(database.rows(pdb_id='2xyz'), reference(table, table['pdb_id'] == '2xyz'))
+
+    # A structure within one AA_CHI is a sub-slice of that key
+    rows = database.select(aa_chi='LEU_CHI2', pdb_id='3def')
+    assert isinstance(rows, slice)
+    assert_same_rows(database.rows(aa_chi='LEU_CHI2', pdb_id='3def'), reference(table, (table['AA_CHI'] == 'LEU_CHI2') & (table['pdb_id'] == '3def')))
+    assert len(database.rows(aa_chi='TRP_CHI1')) == 0
+    assert len(EnergyDatabase(database.directory)) == len(table)
+    assert len(database.rows(aa_chi='ARG_CHI1', pdb_id='9zzz')) == 0
+
+
+def test_label_filters(table, database):
+    assert_same_rows(database.rows(where={'reason': 'bin_gap'}), reference(table, table['reason'] == 'bin_gap'))
+    assert_same_rows(database.rows(pdb_id='1abc', where={'reason': ['bin_gap', 'out_of_range']}),
+                     reference(table, (table['pdb_id'] == '1abc') & table['reason'].notna()))
+    # An unknown label matches nothing, not the rows whose label is missing
+    assert len(database.rows(where={'reason': 'no such reason'})) == 0
+    assert len(database.rows(aa_chi='ARG_CHI1', where={'reason': ['no such reason']})) == 0
+    assert_same_rows(database.rows(where={'reason': ['no such reason', 'out_of_range']}), reference(table, table['reason'] == 'out_of_range'))
+
+
+def test_range_filters(table, database):
+    assert_same_rows(database.rows(where={'E': (2.0, None)}), reference(table, table['E'] >= 2.0))
+    assert_same_rows(database.rows(aa_chi='SER_CHI1', where={'E': (-1.0, 1.0)}), reference(table, (table['AA_CHI'] == 'SER_CHI1') & table['E'].between(-1.0, 1.0)))
+    # Missing integers never satisfy a bound
+    assert_same_rows(database.rows(where={'residue': (None, 150)}), reference(table, (table['residue'] <= 150).fillna(False)))
+
+    # Inclusive bounds hold at the stored float32 precision
+    angle = float(table['angle'].iloc[0])
+    assert len(database.rows(where={'angle': (angle, angle)})) == int((table['angle'] == angle).sum())
+
+
+def test_histogram(table, database):
+    counts, edges = database.histogram('E', aa_chi='ARG_CHI3', bins=10, range=(-6, 6))
+    expected, expected_edges = np.histogram(table.loc[table['AA_CHI'] == 'ARG_CHI3', 'E'].to_numpy(dtype=float), bins=10, range=(-6, 6))
+    np.testing.assert_array_equal(counts, expected)
+    np.testing.assert_array_equal(edges, expected_edges)
+
+    counts, _ = database.histogram('E', pdb_id='1abc', where={'reason': 'no such reason'}, bins=5, range=(-6, 6))
+    assert counts.sum() == 0
+    assert database.counts().to_dict() == table['AA_CHI'].value_counts().sort_index().to_dict()
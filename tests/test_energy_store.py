@@ -0,0 +1,105 @@
+import os
+import zipfile
+
+import pytest
+
+import energy_store as energy_store_module
+from conftest import ENERGY_ZIP
+from energy_store import EnergyStore, default_store_path, load_energy_store, save_store
+
+KEYS = ['ARG_CHI1', 'SER_CHI1']
+
+
+@pytest.fixture
+def source(tmp_path):
+    directory = tmp_path / 'potentials'
+    directory.mkdir()
+    with zipfile.ZipFile(ENERGY_ZIP) as archive:
+        for key in KEYS:
+            (directory / f'{key}.csv').write_bytes(archive.read(f'backbone_independent_energy/{key}.csv'))
+    return str(directory)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+# Make every read of the source CSVs fail, to check a load does not need them
+def forbid_reads(monkeypatch):
+    def read_energy_sources(source):
+        raise AssertionError('source CSVs were read')
+    monkeypatch.setattr(energy_store_module, 'read_energy_sources', read_energy_sources)
+
+
+def test_default_path_is_in_user_cache(source, cache):
+    path = default_store_path(source)
+    assert path.startswith(str(cache / 'knowledgebasedenergy'))
+    assert default_store_path(source + '_other') != path
+
+    store = load_energy_store(source)
+    assert store.keys == KEYS
+    assert os.path.exists(path)
+    assert not [name for name in os.listdir(source) if name.endswith('.npz')]
+
+
+def test_unchanged_sources_are_not_read(source, cache, monkeypatch):
+    first = load_energy_store(source)
+    forbid_reads(monkeypatch)
+    second = load_energy_store(source)
+    assert second.source_hash == first.source_hash
+    with pytest.raises(AssertionError):
+        load_energy_store(source, verify=True)
+
+
+def test_touched_and_changed_sources(source, cache, monkeypatch):
+    first = load_energy_store(source)
+    path = os.path.join(source, 'SER_CHI1.csv')
+
+    # New mtime, same contents: rehashed once, not rebuilt, and skipped again afterwards
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load_energy_store(source).source_hash == first.source_hash
+    with monkeypatch.context() as patch:
+        forbid_reads(patch)
+        load_energy_store(source)
+
+    # New contents: rebuilt with the new table hash
+    with open(path, 'a') as handle:
+        handle.write('\n')
+    changed = load_energy_store(source)
+    assert changed.source_hash != first.source_hash
+    assert changed.table_hashes['SER_CHI1'] != first.table_hashes['SER_CHI1']
+    assert changed.table_hashes['ARG_CHI1'] == first.table_hashes['ARG_CHI1']
+
+
+@pytest.mark.parametrize('keep', [0.5, 0.0])
+def test_truncated_store_is_rebuilt(source, cache, keep):
+    first = load_energy_store(source)
+    path = default_store_path(source)
+    data = open(path, 'rb').read()
+    with open(path, 'wb') as handle:
+        handle.write(data[:int(len(data) * keep)])
+
+    rebuilt = load_energy_store(source)
+    assert rebuilt.source_hash == first.source_hash
+    assert open(path, 'rb').read() == data
+
+
+def test_overlapping_saves_do_not_share_a_temporary_file(source, cache, monkeypatch):
+    store = load_energy_store(source)
+    path = default_store_path(source)
+    os.remove(path)
+    save = EnergyStore.save
+
+    # A second run saves the same store after the first wrote its copy but before it renamed it
+    def interleaved_save(self, out):
+        save(self, out)
+        monkeypatch.setattr(EnergyStore, 'save', save)
+        save_store(self, path)
+    monkeypatch.setattr(EnergyStore, 'save', interleaved_save)
+    save_store(store, path)
+
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+    assert EnergyStore.load(path).source_hash == store.source_hash
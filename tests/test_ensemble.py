@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ensemble import KT, chi_counts, residue_energies, structure_energies
+
+
+@pytest.fixture
+def scored():
+    # ARG 1: altloc A complete, altloc B with chi3 and chi4 unscored; LEU 2: complete; SER 3: chi1 unscored in its only conformer
+    rows = [('A', 0.6, 'chi1', 1.0), ('A', 0.6, 'chi2', 1.0), ('A', 0.6, 'chi3', 1.0), ('A', 0.6, 'chi4', 1.0),
+            ('B', 0.4, 'chi1', 0.5), ('B', 0.4, 'chi2', 0.5)]
+    arg = pd.DataFrame(rows, columns=['altloc', 'occupancy', 'chi_angle', 'E']).assign(residue=1, residue_type='ARG')
+    leu = pd.DataFrame({'altloc': ['A', 'A', 'B', 'B'], 'occupancy': [0.5] * 4, 'chi_angle': ['chi1', 'chi2'] * 2,
+                        'E': [0.2, 0.3, 1.0, 1.5], 'residue': 2, 'residue_type': 'LEU'})
+    df = pd.concat([arg, leu], ignore_index=True).assign(pdb_id='1abc', chain='A', icode='')
+    return df
+
+
+def by_residue(residues):
+    return residues.set_index('residue')
+
+
+def test_incomplete_conformers_are_left_out(scored):
+    counts = chi_counts(['ARG_CHI1', 'ARG_CHI2', 'ARG_CHI3', 'ARG_CHI4', 'LEU_CHI1', 'LEU_CHI2', 'SER_CHI1'])
+    residues = by_residue(residue_energies(scored, chi_counts=counts))
+    assert residues.loc[1, 'E_ensemble'] == pytest.approx(4.0)
+    assert residues.loc[1, 'n_altlocs'] == 2
+    assert residues.loc[1, 'n_incomplete'] == 1
+    assert residues.loc[1, 'E_min'] == residues.loc[1, 'E_max'] == pytest.approx(4.0)
+    assert residues.loc[2, 'E_ensemble'] == pytest.approx(0.5 * 0.5 + 0.5 * 2.5)
+
+    boltzmann = by_residue(residue_energies(scored, 'boltzmann', chi_counts=counts))
+    assert boltzmann.loc[1, 'E_ensemble'] == pytest.approx(4.0)
+    assert boltzmann.loc[2, 'E_ensemble'] == pytest.approx(-KT * np.log(0.5 * np.exp(-0.5 / KT) + 0.5 * np.exp(-2.5 / KT)))
+
+
+def test_residue_without_complete_conformer(scored):
+    counts = {'ARG': 4, 'LEU': 3}
+    for method in ['occupancy', 'boltzmann']:
+        residues = by_residue(residue_energies(scored, method, chi_counts=counts))
+        assert np.isnan(residues.loc[2, 'E_ensemble'])
+        assert np.isnan(residues.loc[2, 'E_min'])
+        assert residues.loc[2, 'n_incomplete'] == 2
+
+    structures = structure_energies(residue_energies(scored, chi_counts=counts))
+    assert structures.loc[0, 'E_total'] == pytest.approx(4.0)
+    assert structures.loc[0, 'n_residues'] == 1
+    assert structures.loc[0, 'n_unscored'] == 1
+
+
+def test_without_chi_counts_every_conformer_is_used(scored):
+    residues = by_residue(residue_energies(scored))
+    assert residues.loc[1, 'E_ensemble'] == pytest.approx(0.6 * 4.0 + 0.4 * 1.0)
+    assert residues.loc[1, 'n_incomplete'] == 0
@@ -0,0 +1,70 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from conftest import ENERGY_ZIP
+from energy_store import EnergyStore, read_energy_sources
+from example_function import StatsPotential, get_energy_from_stats, get_energy_from_stats_batch
+
+# (default_maximum, set_maximum) combinations covering every branch of the scalar function
+MAXIMUM_OPTIONS = [(True, None), (True, 9.0), (False, 9.0), (False, 0), (False, None)]
+
+AA_CHI_KEYS = EnergyStore.from_sources(read_energy_sources(ENERGY_ZIP)).keys
+
+
+# Measurements on every bin edge, one ulp either side of it, at the bin centres, beyond the table and NaN
+def edge_case_angles(potential):
+    edges = np.unique(np.concatenate([potential['bin min'], potential['bin max']]))
+    return np.concatenate([
+        edges,
+        np.nextafter(edges, np.inf),
+        np.nextafter(edges, -np.inf),
+        potential['bin mid'],
+        [edges.min() - 1, edges.max() + 1, np.nan, -np.inf, np.inf],
+    ])
+
+
+def scalar_energies(potential, angles, default_maximum=True, set_maximum=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        values = [get_energy_from_stats(potential, angle, default_maximum, set_maximum) for angle in angles]
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+@pytest.mark.parametrize('aa_chi', AA_CHI_KEYS)
+def test_batch_matches_scalar_on_every_potential(energy_store, aa_chi):
+    potential = energy_store.table_frame(aa_chi)
+    angles = edge_case_angles(potential)
+    # Without a maximum the scalar function returns None (NaN here) exactly for the misses
+    expected = scalar_energies(potential, angles, False, None)
+    missed = np.isnan(expected) & ~np.isnan(angles)
+
+    prepared = StatsPotential(potential)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for result in (get_energy_from_stats_batch(potential, angles, False, None), get_energy_from_stats_batch(prepared, angles, False, None)):
+            np.testing.assert_array_equal(result.energy, expected)
+            np.testing.assert_array_equal(result.out_of_range, missed)
+    assert np.isnan(expected[np.isnan(angles)]).all()
+
+
+@pytest.mark.parametrize('default_maximum, set_maximum', MAXIMUM_OPTIONS)
+def test_maximum_options_match_scalar(energy_store, default_maximum, set_maximum):
+    for aa_chi in ['ARG_CHI1', 'SER_CHI1', 'PRO_CHI3']:
+        potential = energy_store.table_frame(aa_chi)
+        angles = edge_case_angles(potential)
+        expected = scalar_energies(potential, angles, default_maximum, set_maximum)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = get_energy_from_stats_batch(StatsPotential(potential), angles, default_maximum, set_maximum)
+        np.testing.assert_array_equal(result.energy, expected)
+        assert np.isnan(result.energy[np.isnan(angles)]).all()
+        assert not result.out_of_range[np.isnan(angles)].any()
+
+
+def test_edges_follow_scalar_convention(energy_store):
+    # Bins are bin min < value <= bin max: an upper edge belongs to its bin, a lower edge does not
+    potential = energy_store.table_frame('ARG_CHI1')
+    first = potential.sort_values('bin min').iloc[0]
+    result = get_energy_from_stats_batch(potential, [first['bin max'], first['bin min']], False, None)
+    assert result.energy[0] == get_energy_from_stats(potential, first['bin max'])
+    assert result.out_of_range.tolist() == [False, True]
@@ -0,0 +1,33 @@
+import json
+import os
+import tracemalloc
+
+import pytest
+
+from instrumentation import RunReport
+
+
+def test_failed_stage_is_recorded(tmp_path):
+    report = RunReport(profile_dir=str(tmp_path / 'profile'), trace_memory=True)
+    with report.stage('ingest', source='rotamers') as stage:
+        stage.files_in = 3
+        stage.rows_out = 10
+    with pytest.raises(ValueError):
+        with report.stage('lookup', 10):
+            raise ValueError('broken potential')
+
+    assert not tracemalloc.is_tracing()
+    assert [stage.name for stage in report.stages] == ['ingest', 'lookup']
+    failed = report.stages[1]
+    assert failed.error == 'ValueError: broken potential'
+    assert failed.seconds >= 0 and failed.peak_rss_bytes > 0
+    assert 'traced_peak_bytes' in failed.to_dict()
+    assert os.path.exists(failed.profile)
+    assert 'FAILED ValueError' in report.summary()
+    assert '3 files -> 10' in report.summary()
+
+    report.save(str(tmp_path / 'report.json'))
+    with open(tmp_path / 'report.json') as handle:
+        saved = json.load(handle)
+    assert saved['stages'][1]['error'] == 'ValueError: broken potential'
+    assert 'error' not in saved['stages'][0]
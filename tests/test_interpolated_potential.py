@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from energy_lookup import BIN_GAP, NAN_ANGLE, OUT_OF_RANGE, score_rotamers
+from interpolated_potential import PeriodicSplinePotential, build_interpolated_potentials
+
+
+@pytest.fixture(scope='module')
+def potentials(energy_store):
+    return build_interpolated_potentials(energy_store)
+
+
+def test_spline_passes_through_bin_mids(energy_store, potentials):
+    for aa_chi in energy_store.keys:
+        rows = energy_store.slice(aa_chi)
+        mid = energy_store.columns['bin mid'][rows]
+        energy, matched = potentials[aa_chi].lookup(mid)
+        assert matched.all(), aa_chi
+        np.testing.assert_allclose(energy, energy_store.columns['E'][rows], atol=1e-9, err_msg=aa_chi)
+
+
+@pytest.mark.parametrize('aa_chi', ['ARG_CHI1', 'PRO_CHI1', 'PHE_CHI2', 'SER_CHI1'])
+def test_periodic_and_smooth_across_the_wrap(potentials, aa_chi):
+    spline = potentials[aa_chi]
+    angles = np.linspace(-10, 10, 41)
+    energy, gradient = spline.evaluate(angles)
+    for shift in (360, -360, 720):
+        shifted_energy, shifted_gradient = spline.evaluate(angles + shift)
+        np.testing.assert_allclose(shifted_energy, energy, atol=1e-9)
+        np.testing.assert_allclose(shifted_gradient, gradient, atol=1e-9)
+    # Value and slope agree on both sides of 0°/360° and of every knot
+    for angle in np.append(spline.knots, 0.0):
+        below, above = spline.evaluate([angle - 1e-9, angle + 1e-9])
+        np.testing.assert_allclose(below[0], below[1], atol=1e-6)
+        np.testing.assert_allclose(above[0], above[1], atol=1e-6)
+
+
+@pytest.mark.parametrize('aa_chi', ['ARG_CHI1', 'PRO_CHI1', 'TRP_CHI2'])
+def test_gradient_matches_finite_differences(potentials, aa_chi):
+    spline = potentials[aa_chi]
+    angles = np.random.default_rng(0).uniform(-180, 540, 500)
+    step = 1e-5
+    _, gradient = spline.evaluate(angles)
+    numeric = (spline(angles + step) - spline(angles - step)) / (2 * step)
+    np.testing.assert_allclose(gradient, numeric, rtol=1e-5, atol=1e-5)
+
+
+def test_angles_far_from_the_bins_are_unmatched(energy_store, potentials):
+    # PRO_CHI1 only has bins from about -44° to 48°
+    spline = potentials['PRO_CHI1']
+    energy, matched = spline.lookup([180.0, 0.0, 30.0, np.nan])
+    assert matched.tolist() == [False, True, True, False]
+    assert np.isnan(energy[0])
+    assert spline.unmatched_reason([180.0, 0.0, np.nan]).tolist() == [OUT_OF_RANGE, None, NAN_ANGLE]
+
+    # Scored like the binned table: the rows beyond the potential are reported, not given energies
+    df = pd.DataFrame({'residue_type': 'PRO', 'chi_angle': 'chi1', 'angle': [180.0, 30.0]})
+    scored, unmatched = score_rotamers(df, potentials)
+    assert scored['angle'].tolist() == [30.0]
+    assert unmatched['reason'].tolist() == [OUT_OF_RANGE]
+
+
+def test_only_narrow_gaps_are_bridged():
+    # Bins of width 2 everywhere except one missing bin (20-22) and a missing run (100-140)
+    mids = np.array([mid for mid in np.arange(1, 360, 2.0) if mid != 21 and not 100 < mid < 140])
+    spline = PeriodicSplinePotential.from_bins(mids, np.cos(np.radians(mids)))
+    energy, matched = spline.lookup([21.0, 99.9, 120.0, 140.1, 250.0])
+    assert matched.tolist() == [True, True, False, True, True]
+    assert spline.unmatched_reason([120.0]).tolist() == [OUT_OF_RANGE]
+
+    # With a second wide gap, the narrower one is a bin gap
+    mids = mids[(mids < 200) | (mids > 220)]
+    spline = PeriodicSplinePotential.from_bins(mids, np.cos(np.radians(mids)))
+    assert spline.unmatched_reason([120.0, 210.0]).tolist() == [OUT_OF_RANGE, BIN_GAP]
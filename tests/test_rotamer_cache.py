@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from conftest import edge_rows, write_rotamer_csv
+from energy_lookup import score_rotamers
+from rotamer_cache import load_cached_rotamers
+from rotamer_io import read_rotamer_batch
+
+
+# Angles on every bin edge plus one inside every bin
+def cache_rows(energy_store):
+    rows = edge_rows(energy_store)
+    for aa_chi, table in energy_store.tables.items():
+        residue_type, chi = aa_chi.split('_CHI')
+        mids = (table.bin_min + table.bin_max) / 2 % 360
+        rows.extend(('B', i + 1, residue_type, int(chi) - 1, repr(float(mid))) for i, mid in enumerate(mids))
+    return rows
+
+
+def sorted_scores(scored):
+    return scored.sort_values(['chain', 'residue', 'AA_CHI']).reset_index(drop=True)
+
+
+def test_cached_scores_match_csv_path(energy_store, tmp_path):
+    path = str(tmp_path / '1abc_rotamers_output.csv')
+    write_rotamer_csv(path, cache_rows(energy_store))
+
+    direct, _, _ = read_rotamer_batch([path])
+    cached = load_cached_rotamers([path], str(tmp_path / 'cache'), workers=1, verbose=False).data
+    assert cached['angle'].dtype == np.float64
+    direct_scored, direct_unmatched = score_rotamers(direct, energy_store.tables)
+    cached_scored, cached_unmatched = score_rotamers(cached, energy_store.tables)
+
+    assert len(cached_unmatched) == len(direct_unmatched)
+    direct_scored, cached_scored = sorted_scores(direct_scored), sorted_scores(cached_scored)
+    np.testing.assert_array_equal(cached_scored['angle'].to_numpy(), direct_scored['angle'].to_numpy())
+    np.testing.assert_array_equal(cached_scored['E'].to_numpy(), direct_scored['E'].to_numpy())
+
+
+def test_failed_reparse_drops_old_partition(tmp_path):
+    path = str(tmp_path / '1abc_rotamers_output.csv')
+    cache_dir = str(tmp_path / 'cache')
+    write_rotamer_csv(path, [('A', 1, 'SER', 0, '62.0')])
+    assert len(load_cached_rotamers([path], cache_dir, workers=1, verbose=False).data) == 1
+
+    # Rewritten without the required columns, with a different size so the cache notices
+    pd.DataFrame({'chain': ['A', 'A'], 'residue': [1, 2]}).to_csv(path, index=False)
+    result = load_cached_rotamers([path], cache_dir, workers=1, verbose=False)
+    assert result.data.empty
+    assert result.failed['file'].tolist() == [path]
+    assert not [name for _, _, names in os.walk(cache_dir) for name in names if name.endswith('.parquet')]
+
+
+def test_missing_source_is_reported(tmp_path):
+    path = str(tmp_path / '1abc_rotamers_output.csv')
+    cache_dir = str(tmp_path / 'cache')
+    write_rotamer_csv(path, [('A', 1, 'SER', 0, '62.0')])
+    load_cached_rotamers([path], cache_dir, workers=1, verbose=False)
+
+    os.remove(path)
+    result = load_cached_rotamers([path], cache_dir, workers=1, verbose=False)
+    assert result.data.empty
+    assert result.failed['file'].tolist() == [path]
+    assert 'FileNotFoundError' in result.failed['reason'].iloc[0]
+    assert not [name for _, _, names in os.walk(cache_dir) for name in names if name.endswith('.parquet')]
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import bin_edges, edge_rows, write_rotamer_csv
+from energy_lookup import score_rotamers
+from rotamer_io import compact_rotamers, normalize_rotamers, read_rotamer_batch
+
+
+def test_angles_on_bin_edges_stay_unmatched_after_compaction(energy_store, tmp_path):
+    path = tmp_path / '1abc_rotamers_output.csv'
+    rows = edge_rows(energy_store)
+    write_rotamer_csv(path, rows)
+
+    batch, failed, _ = read_rotamer_batch([str(path)])
+    assert not failed
+    assert batch['angle'].dtype == np.float64
+    scored, unmatched = score_rotamers(batch, energy_store.tables)
+    assert scored.empty
+    assert len(unmatched) == len(rows)
+    assert set(unmatched['reason']) <= {'bin_gap', 'out_of_range'}
+
+
+def test_compaction_keeps_angles_exact(energy_store):
+    table = energy_store.tables['ARG_CHI1']
+    edges = bin_edges(table)
+    df = normalize_rotamers(pd.DataFrame({
+        'chain': 'A', 'residue': [str(i) for i in range(len(edges))], 'residue_name': 'ARG',
+        'nchi': '0', 'rotamer_value': [repr(float(edge)) for edge in edges], 'pdb_id': '1abc',
+    }))
+    compact = compact_rotamers(df)
+    np.testing.assert_array_equal(compact['angle'].to_numpy(), edges)
+    assert (table.bin_index(compact['angle'].to_numpy()) == -1).all()
+
+
+def test_insertion_codes_stay_distinct_residues(tmp_path):
+    from ensemble import residue_energies
+    from pairing import pair_altlocs
+
+    rows = [('A', '52', 'SER', 0, '62.0'), ('A', '52A', 'SER', 0, '181.0'), ('A', '53', 'SER', 0, '300.0')]
+    write_rotamer_csv(tmp_path / '1abc_rotamers_output.csv', rows)
+    deposited, failed, _ = read_rotamer_batch([str(tmp_path / '1abc_rotamers_output.csv')])
+    assert not failed
+    assert deposited['residue'].tolist() == [52, 52, 53]
+    assert deposited['icode'].astype(str).tolist() == ['', 'A', '']
+
+    qfit = deposited[deposited['icode'] == 'A'].assign(altloc=pd.Categorical(['B']), occupancy=np.float32(1.0))
+    pairs = pair_altlocs(qfit, deposited)
+    assert len(pairs) == 1
+    assert pairs.loc[0, 'angle_rotamers'] == pytest.approx(181.0)
+
+    residues = residue_energies(deposited.assign(E=[1.0, 2.0, 3.0]))
+    assert len(residues) == 3
+    assert sorted(residues['E_ensemble'].tolist()) == [1.0, 2.0, 3.0]
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rotamer_library import CHI_COLUMNS, DEFAULT_WIDTH, RotamerLibrary, periodic_difference, residue_chi_keys
+
+
+@pytest.fixture(scope='module')
+def library(energy_store):
+    return RotamerLibrary.from_potentials(energy_store)
+
+
+# Normalised rotamer rows, one per (residue, altloc, chi) given as (residue, residue_type, altloc, chi angles)
+def rotamer_rows(conformers):
+    rows = []
+    for residue, residue_type, altloc, angles in conformers:
+        for i, angle in enumerate(angles):
+            rows.append({'pdb_id': '1abc', 'chain': 'A', 'residue': residue, 'icode': '', 'residue_type': residue_type,
+                         'chi_angle': CHI_COLUMNS[i], 'angle': angle % 360, 'altloc': altloc})
+    return pd.DataFrame(rows)
+
+
+def test_library_from_potentials(energy_store, library):
+    frame = library.frame
+    keys = residue_chi_keys(energy_store)
+    assert set(frame['residue_type']) == set(keys)
+    for residue_type, rotamers in frame.groupby('residue_type'):
+        assert (rotamers['n_chi'] == len(keys[residue_type])).all()
+        assert rotamers['rotamer'].is_unique
+    assert set(frame.loc[frame['residue_type'] == 'SER', 'rotamer']) == {'p', 't', 'm'}
+    assert 'mt' in set(frame.loc[frame['residue_type'] == 'LEU', 'rotamer'])
+
+    centres = frame[CHI_COLUMNS].to_numpy(dtype=float)
+    present = ~np.isnan(centres)
+    assert ((centres[present] > -180) & (centres[present] <= 180)).all()
+    assert (frame[[f'{column}_width' for column in CHI_COLUMNS]].to_numpy(dtype=float)[present] > 0).all()
+    per_chi = frame[[f'E_{column}' for column in CHI_COLUMNS]].to_numpy(dtype=float)
+    np.testing.assert_allclose(frame['E'], np.where(present, per_chi, 0).sum(axis=1))
+
+
+def test_nearest_wraps_and_skips_missing_chi(library):
+    names, centres, widths, _ = library.residues['LEU']
+    index, deviation, in_well = library.nearest('LEU', np.vstack([centres, centres + 360, centres - 720]))
+    np.testing.assert_array_equal(index, np.tile(np.arange(len(centres)), 3))
+    np.testing.assert_allclose(deviation, 0, atol=1e-9)
+    assert in_well.all()
+
+    mt = list(names).index('mt')
+    # Across the ±180° seam: a chi2 of -178° is 8° from the trans centre, not 352°
+    chi = np.array([[centres[mt, 0] + 5, -178.0], [centres[mt, 0], np.nan], [centres[mt, 0] + 100, centres[mt, 1]]])
+    index, deviation, in_well = library.nearest('LEU', chi)
+    assert index[0] == mt
+    assert deviation[0] == pytest.approx(np.sqrt((5 ** 2 + (182 - centres[mt, 1]) ** 2) / 2))
+    assert index[1] == -1 and np.isnan(deviation[1]) and not in_well[1]
+    # In a well only while every chi lies within the nearest rotamer's width
+    assert in_well[2] == (periodic_difference(chi[2], centres[index[2]]) <= widths[index[2]]).all()
+    _, _, in_well = library.nearest('LEU', centres[[mt]] + widths[[mt]] * [0.9, -0.9])
+    assert in_well.tolist() == [True]
+
+
+def test_assign_labels_every_conformer(library):
+    frame = library.frame.set_index(['residue_type', 'rotamer'])
+    leu_mt = frame.loc[('LEU', 'mt'), ['chi1', 'chi2']].to_numpy(dtype=float)
+    ser_t = frame.loc[('SER', 't'), 'chi1']
+    df = rotamer_rows([
+        (1, 'LEU', 'A', leu_mt + [3.0, -4.0]),
+        (1, 'LEU', 'B', [float(ser_t), 60.0]),
+        (2, 'SER', np.nan, [ser_t + 360 - 2]),
+        (3, 'LEU', np.nan, [leu_mt[0]]),
+        (4, 'XYZ', np.nan, [60.0]),
+    ])
+    assigned = library.assign(df)
+
+    assert len(assigned) == 5
+    assert assigned['altloc'].astype(str).tolist() == ['A', 'B', '', '', '']
+    assert assigned['rotamer'].astype(object).tolist()[0] == 'mt'
+    assert assigned['rotamer'].astype(object).tolist()[2] == 't'
+    assert assigned['rotamer'].isna().tolist() == [False, False, False, True, True]
+    assert assigned.loc[0, 'E_rotamer'] == pytest.approx(frame.loc[('LEU', 'mt'), 'E'], rel=1e-6)
+    assert assigned.loc[0, 'rotamer_deviation'] == pytest.approx(np.sqrt((9 + 16) / 2), rel=1e-6)
+    assert assigned['in_well'].tolist()[0] and assigned['in_well'].tolist()[2]
+    assert np.isnan(assigned.loc[3, 'chi2']) and np.isnan(assigned.loc[3, 'E_rotamer'])
+
+
+def test_custom_library_widths_and_energies(energy_store):
+    frame = pd.DataFrame({'residue_type': ['SER', 'SER'], 'rotamer': ['g+', 'g-'], 'chi1': [60.0, -60.0], 'chi1_width': [15.0, np.nan]})
+    library = RotamerLibrary.from_frame(frame, energy_store)
+    assert library.frame['chi1_width'].tolist() == [15.0, DEFAULT_WIDTH]
+    assert library.frame['chi2_width'].isna().all()
+    np.testing.assert_allclose(library.frame['E'], library.frame['E_chi1'])
+    _, deviation, in_well = library.nearest('SER', np.array([[80.0], [-80.0]]))
+    assert in_well.tolist() == [False, True]
+
+
+def test_mixed_chi_counts_are_rejected():
+    frame = pd.DataFrame({'residue_type': ['LEU', 'LEU'], 'rotamer': ['mt', 'm'], 'chi1': [-65.0, -65.0], 'chi2': [175.0, np.nan]})
+    with pytest.raises(ValueError, match=r"Every LEU rotamer needs chi1, chi2; missing in rotamers \['m'\]"):
+        RotamerLibrary(frame)
+    # A gap before the last chi angle is just as incomplete
+    frame = pd.DataFrame({'residue_type': ['LEU'], 'rotamer': ['xt'], 'chi2': [175.0]})
+    with pytest.raises(ValueError, match='needs chi1, chi2'):
+        RotamerLibrary(frame)
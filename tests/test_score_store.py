@@ -0,0 +1,76 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ENERGY_ZIP, write_rotamer_csv
+from energy_lookup import score_rotamers
+from energy_store import EnergyStore, read_energy_sources
+from rotamer_io import list_rotamer_files, read_rotamer_batch
+from score_store import NO_KEY, ScoreStore
+from streaming import stream_score
+
+
+@pytest.fixture
+def rotamer_dir(tmp_path):
+    rng = np.random.default_rng(1)
+    directory = tmp_path / 'rotamers'
+    directory.mkdir()
+    for pdb_id in ['1abc', '2xyz', '3def']:
+        rows = [('A', residue, residue_type, chi, repr(float(rng.uniform(0, 360))))
+                for residue, residue_type, n_chi in [(r, 'ARG' if r % 2 else 'SER', 4 if r % 2 else 1) for r in range(1, 40)]
+                for chi in range(n_chi)]
+        write_rotamer_csv(directory / f'{pdb_id}_rotamers_output.csv', rows)
+    return str(directory)
+
+
+# Potentials with the ARG_CHI1 energies doubled
+@pytest.fixture
+def changed_store():
+    raw = read_energy_sources(ENERGY_ZIP)
+    table = pd.read_csv(io.BytesIO(raw['ARG_CHI1']))
+    table['E'] = table['E'] * 2
+    raw['ARG_CHI1'] = table.to_csv(index=False).encode()
+    return EnergyStore.from_sources(raw)
+
+
+def test_load_keeps_original_order_and_null_keys(energy_store, rotamer_dir, tmp_path):
+    data, _, _ = read_rotamer_batch(list_rotamer_files(rotamer_dir))
+    scored, unmatched = score_rotamers(data, energy_store.tables)
+    assert not unmatched.empty
+    scored['AA_CHI'] = scored['AA_CHI'].astype(object)
+    scored.loc[5, 'AA_CHI'] = None
+
+    store = ScoreStore(str(tmp_path / 'store'))
+    store.write(scored, unmatched, energy_store)
+    assert NO_KEY in store.manifest()['keys']
+    loaded, loaded_unmatched = store.load()
+    assert len(loaded) == len(scored)
+    assert loaded['AA_CHI'].isna().sum() == 1 and pd.isna(loaded.loc[5, 'AA_CHI'])
+    np.testing.assert_array_equal(loaded['angle'].to_numpy(), scored['angle'].to_numpy())
+    np.testing.assert_array_equal(loaded['E'].to_numpy(), scored['E'].to_numpy())
+    np.testing.assert_array_equal(loaded_unmatched['angle'].to_numpy(), unmatched['angle'].to_numpy())
+
+
+def test_store_from_streamed_csv(energy_store, changed_store, rotamer_dir, tmp_path):
+    output = str(tmp_path / 'scored.csv')
+    stream_score(list_rotamer_files(rotamer_dir), energy_store.tables, output, files_per_chunk=1)
+    streamed = pd.read_csv(output, float_precision='round_trip')
+
+    store = ScoreStore(str(tmp_path / 'store'))
+    store.write_table(output, energy_store, chunksize=50)
+    assert store.changed_keys(energy_store) == []
+    loaded, unmatched = store.load()
+    assert unmatched.empty
+    np.testing.assert_array_equal(loaded['angle'].to_numpy(), streamed['angle'].to_numpy())
+    np.testing.assert_allclose(loaded['E'].to_numpy(), streamed['E'].to_numpy())
+
+    diff = store.update(changed_store)
+    assert diff['AA_CHI'].tolist() == ['ARG_CHI1']
+    rescored, _ = store.load()
+    expected, _ = changed_store.tables['ARG_CHI1'].lookup(streamed['angle'].to_numpy())
+    arg = (streamed['AA_CHI'] == 'ARG_CHI1').to_numpy()
+    np.testing.assert_array_equal(rescored['angle'].to_numpy(), streamed['angle'].to_numpy())
+    np.testing.assert_allclose(rescored['E'].to_numpy()[arg], expected[arg], rtol=1e-6)
+    np.testing.assert_allclose(rescored['E'].to_numpy()[~arg], streamed['E'].to_numpy()[~arg])
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import ENERGY_ZIP, write_rotamer_csv, write_rotamer_files
+from knowledge_based_energy import main
+from sharding import reduce_shards, run_shard, shard_prefix
+from streaming import ScoreAggregates, stream_score
+
+
+# Rotamer files of a whole run: random ones, one with altloc/occupancy columns and one unreadable file
+def write_run(directory):
+    paths = write_rotamer_files(directory, 11)
+    with open(os.path.join(str(directory), '0005_rotamers_output.csv'), 'w') as handle:
+        handle.write('chain,residue,residue_name,nchi,rotamer_value,altloc,occupancy\nA,7,SER,0,62.0,B,0.5\n')
+    with open(os.path.join(str(directory), '0008_rotamers_output.csv'), 'w') as handle:
+        handle.write('not,a,rotamer,table\n')
+    return paths
+
+
+def assert_same_aggregates(first, second):
+    assert first.counts == second.counts
+    assert first.unmatched == second.unmatched
+    for key in first.joint:
+        np.testing.assert_array_equal(first.joint[key], second.joint[key])
+
+
+@pytest.mark.parametrize('n_shards', [1, 3, 8])
+def test_reduced_shards_match_a_single_streaming_run(energy_store, tmp_path, n_shards):
+    (tmp_path / 'rotamers').mkdir()
+    paths = write_run(tmp_path / 'rotamers')
+    single = tmp_path / 'single.csv'
+    single_aggregates, single_failed = stream_score(paths, energy_store.tables, str(single), files_per_chunk=2)
+
+    output_dir = str(tmp_path / 'shards')
+    for shard_index in range(n_shards):
+        run_shard(paths, energy_store, output_dir, n_shards, shard_index, files_per_chunk=2)
+    reduced = tmp_path / 'reduced.csv'
+    aggregates, failed = reduce_shards(output_dir, str(reduced), str(tmp_path / 'reduced.npz'))
+
+    assert reduced.read_bytes() == single.read_bytes()
+    assert_same_aggregates(aggregates, single_aggregates)
+    assert_same_aggregates(ScoreAggregates.load(str(tmp_path / 'reduced.npz')), single_aggregates)
+    assert failed.equals(single_failed)
+    assert failed['file'].tolist() == [paths[8]]
+
+
+def test_local_shard_subprocesses_match_a_single_streaming_run(energy_store, tmp_path, monkeypatch):
+    # The shard subprocesses compile the potentials into this cache, not the user's
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    (tmp_path / 'rotamers').mkdir()
+    paths = write_run(tmp_path / 'rotamers')
+    single = tmp_path / 'single.csv'
+    single_aggregates, _ = stream_score(paths, energy_store.tables, str(single), files_per_chunk=2)
+
+    output_dir = str(tmp_path / 'shards')
+    main(['shard', str(tmp_path / 'rotamers'), '--out-dir', output_dir, '--local', '3', '--files-per-chunk', '2', '--potentials', ENERGY_ZIP])
+    reduced = tmp_path / 'reduced.csv'
+    main(['reduce', output_dir, '-o', str(reduced), '--aggregates', str(tmp_path / 'reduced.npz')])
+
+    assert reduced.read_bytes() == single.read_bytes()
+    assert_same_aggregates(ScoreAggregates.load(str(tmp_path / 'reduced.npz')), single_aggregates)
+
+
+def test_rerun_without_rows_drops_earlier_rows(energy_store, tmp_path):
+    paths = [str(tmp_path / f'{pdb_id}_rotamers_output.csv') for pdb_id in ('1abc', '2xyz')]
+    for path in paths:
+        write_rotamer_csv(path, [('A', 1, 'SER', 0, '62.0'), ('A', 2, 'LEU', 1, '170.0')])
+    output_dir = str(tmp_path / 'shards')
+    prefix = shard_prefix(output_dir, 0, 1)
+
+    record = run_shard(paths, energy_store, output_dir, 1, 0, files_per_chunk=1)
+    assert record['n_scored'] > 0
+    assert os.path.exists(prefix + '.csv')
+
+    # Same files, now without a single scorable angle
+    for path in paths:
+        write_rotamer_csv(path, [('A', 1, 'SER', 0, 'nan')])
+    record = run_shard(paths, energy_store, output_dir, 1, 0, files_per_chunk=1)
+    assert record['n_scored'] == 0
+    assert not os.path.exists(prefix + '.csv')
+    assert not [name for name in os.listdir(output_dir) if name.endswith('.tmp')]
+
+    output = str(tmp_path / 'scored.csv')
+    aggregates, failed = reduce_shards(output_dir, output)
+    assert sum(aggregates.counts.values()) == 0
+    assert failed.empty
+    assert not os.path.exists(output)
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from energy_lookup import score_rotamers
+from rotamer_io import NORMALIZED_COLUMNS, load_rotamer_files
+from streaming import stream_score
+
+
+def test_chunks_with_different_columns_share_the_header(energy_store, tmp_path):
+    # No altloc/occupancy in the first file; the second has them, with its columns in another order
+    pd.DataFrame({'chain': ['A'], 'residue': ['4'], 'residue_name': ['SER'], 'nchi': ['0'], 'rotamer_value': ['62.0']}).to_csv(tmp_path / '1abc_rotamers_output.csv', index=False)
+    pd.DataFrame({'rotamer_value': ['290.0'], 'occupancy': ['0.5'], 'altloc': ['B'], 'nchi': ['0'], 'residue_name': ['SER'], 'residue': ['5'], 'chain': ['A']}).to_csv(tmp_path / '2xyz_rotamers_output.csv', index=False)
+    paths = [str(tmp_path / '1abc_rotamers_output.csv'), str(tmp_path / '2xyz_rotamers_output.csv')]
+
+    output = tmp_path / 'scored.csv'
+    stream_score(paths, energy_store.tables, str(output), files_per_chunk=1)
+    streamed = pd.read_csv(output, dtype={'icode': str, 'altloc': str}, keep_default_na=False, na_values=[''])
+    assert list(streamed.columns[:len(NORMALIZED_COLUMNS)]) == NORMALIZED_COLUMNS
+    assert streamed['pdb_id'].tolist() == ['1abc', '2xyz']
+    assert streamed['chain'].tolist() == ['A', 'A']
+    assert streamed['residue'].tolist() == [4, 5]
+    assert streamed['angle'].tolist() == [62.0, 290.0]
+    assert streamed['altloc'].isna().tolist() == [True, False]
+    assert streamed.loc[1, 'altloc'] == 'B'
+    assert streamed.loc[1, 'occupancy'] == 0.5
+
+    # Same rows and energies as scoring both files at once
+    scored, _ = score_rotamers(load_rotamer_files(paths, workers=1, verbose=False).data, energy_store.tables)
+    assert streamed['E'].tolist() == pytest.approx(scored['E'].tolist())
+